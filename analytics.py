@@ -0,0 +1,152 @@
+import database
+import pandas as pd
+from datetime import date
+from typing import List
+
+COHORT_STATUSES = ('cadet', 'AMC')
+
+
+def _fetch_frame(query: str, params: tuple, columns: List[str]) -> pd.DataFrame:
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        return pd.DataFrame.from_records(cur.fetchall(), columns=columns)
+    finally:
+        cur.close()
+        conn.close()
+
+
+def load_notes(start_date: date, end_date: date,
+               statuses: tuple = COHORT_STATUSES) -> pd.DataFrame:
+    """Notes of the whole cohort as columns: user_id, note_date, evaluation_type, rating."""
+    notes = _fetch_frame("""
+        SELECT n.user_id, n.note_date, COALESCE(et.name, n.note_type), n.rating
+        FROM user_notes n
+        JOIN users u ON u.id = n.user_id
+        LEFT JOIN evaluation_types et ON et.id = n.evaluation_type_id
+        WHERE n.note_date BETWEEN %s AND %s
+          AND n.rating IS NOT NULL
+          AND u.status = ANY(%s)
+    """, (start_date, end_date, list(statuses)),
+        ["user_id", "note_date", "evaluation_type", "rating"])
+    notes["note_date"] = pd.to_datetime(notes["note_date"])
+    notes["rating"] = notes["rating"].astype(float)
+    return notes
+
+
+def load_attendance(start_date: date, end_date: date,
+                    statuses: tuple = COHORT_STATUSES) -> pd.DataFrame:
+    """Attendance of the whole cohort as columns: user_id, activity_id, activity_date."""
+    attendance = _fetch_frame("""
+        SELECT at.user_id, at.activity_id, ac.date
+        FROM attendance at
+        JOIN activities ac ON ac.id = at.activity_id
+        JOIN users u ON u.id = at.user_id
+        WHERE ac.date BETWEEN %s AND %s
+          AND u.status = ANY(%s)
+    """, (start_date, end_date, list(statuses)),
+        ["user_id", "activity_id", "activity_date"])
+    attendance["activity_date"] = pd.to_datetime(attendance["activity_date"])
+    return attendance
+
+
+def load_cohort(statuses: tuple = COHORT_STATUSES) -> List[int]:
+    """Ids of every member of the cohort, including those without any attendance."""
+    return _fetch_frame("""
+        SELECT id FROM users WHERE status = ANY(%s)
+    """, (list(statuses),), ["user_id"])["user_id"].tolist()
+
+
+def load_activities(start_date: date, end_date: date) -> pd.DataFrame:
+    activities = _fetch_frame("""
+        SELECT id, date
+        FROM activities
+        WHERE date BETWEEN %s AND %s
+    """, (start_date, end_date), ["activity_id", "activity_date"])
+    activities["activity_date"] = pd.to_datetime(activities["activity_date"])
+    return activities
+
+
+def rolling_ratings(notes: pd.DataFrame, user_id: int, window_days: int) -> pd.DataFrame:
+    """Rolling mean rating of one user, indexed by date, one column per evaluation type."""
+    user_notes = notes[notes["user_id"] == user_id]
+    if user_notes.empty:
+        return pd.DataFrame()
+
+    rolled = (
+        user_notes.sort_values("note_date")
+        .set_index("note_date")
+        .groupby("evaluation_type")["rating"]
+        .rolling(f"{window_days}D")
+        .mean()
+        .reset_index()
+    )
+    return rolled.pivot_table(index="note_date", columns="evaluation_type",
+                              values="rating", aggfunc="last")
+
+
+def cohort_comparison(notes: pd.DataFrame, user_id: int, freq: str = "M") -> pd.DataFrame:
+    """Per period and evaluation type: the user's mean rating against the cohort median
+    of per-cadet means. Columns: period, evaluation_type, user, cohort_median."""
+    if notes.empty:
+        return pd.DataFrame(columns=["period", "evaluation_type", "user", "cohort_median"])
+
+    per_cadet = (
+        notes.assign(period=notes["note_date"].dt.to_period(freq).dt.start_time)
+        .groupby(["period", "evaluation_type", "user_id"], as_index=False)["rating"]
+        .mean()
+    )
+    cohort = (
+        per_cadet.groupby(["period", "evaluation_type"], as_index=False)["rating"]
+        .median()
+        .rename(columns={"rating": "cohort_median"})
+    )
+    mine = (
+        per_cadet[per_cadet["user_id"] == user_id]
+        .drop(columns="user_id")
+        .rename(columns={"rating": "user"})
+    )
+    return cohort.merge(mine, on=["period", "evaluation_type"], how="left")[
+        ["period", "evaluation_type", "user", "cohort_median"]
+    ]
+
+
+def attendance_rate(attendance: pd.DataFrame, activities: pd.DataFrame, cohort: List[int],
+                    user_id: int, freq: str = "M") -> pd.DataFrame:
+    """Share of the period's activities attended by the user, against the cohort median.
+    Members of the cohort who attended nothing count as 0.
+    Indexed by period, columns: user, cohort_median."""
+    if activities.empty:
+        return pd.DataFrame(columns=["user", "cohort_median"])
+
+    held = activities.groupby(
+        activities["activity_date"].dt.to_period(freq).dt.start_time
+    )["activity_id"].nunique()
+
+    attended = (
+        attendance.assign(period=attendance["activity_date"].dt.to_period(freq).dt.start_time)
+        .groupby(["period", "user_id"])["activity_id"]
+        .nunique()
+        .unstack(fill_value=0)
+        .reindex(index=held.index, columns=sorted(set(cohort) | {user_id}), fill_value=0)
+    )
+
+    rates = attended.div(held, axis=0)
+    return pd.DataFrame({
+        "user": rates[user_id],
+        "cohort_median": rates.median(axis=1)
+    }).rename_axis("period")
+
+
+def progression_summary(user_id: int, start_date: date, end_date: date,
+                        window_days: int = 30) -> dict:
+    """All progression statistics of one user over [start_date, end_date]."""
+    notes = load_notes(start_date, end_date)
+    attendance = load_attendance(start_date, end_date)
+    activities = load_activities(start_date, end_date)
+    return {
+        "rolling": rolling_ratings(notes, user_id, window_days),
+        "cohort": cohort_comparison(notes, user_id),
+        "attendance": attendance_rate(attendance, activities, load_cohort(), user_id)
+    }
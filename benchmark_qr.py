@@ -0,0 +1,118 @@
+"""Benchmark of the QR decoding strategies of the presence scanner.
+
+    python benchmark_qr.py photos/                 # corpus of camera photos
+    python benchmark_qr.py corpus/ --generate 200  # synthesize a corpus first
+
+Reports, per strategy, the share of images decoded and the latency (mean, median,
+95th percentile), image decoding included. When the corpus has a manifest.csv
+(file name;expected payload), only the expected payload counts as decoded.
+"""
+import argparse
+import csv
+import random
+import statistics
+import time
+import cv2
+import numpy as np
+from datetime import date
+from pathlib import Path
+from pyzbar.pyzbar import decode as zbar_decode
+from qr_decoder import decode_opencv, decode_pyzbar, decode_qr, downscale, image_from_bytes
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+
+def _baseline(data: bytes):
+    # Former behaviour: full-resolution color frame, all symbol types
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return [symbol.data.decode('utf-8') for symbol in zbar_decode(image)]
+
+
+STRATEGIES = {
+    "couleur pleine résolution (actuel)": _baseline,
+    "gris pleine résolution": lambda data: decode_pyzbar(image_from_bytes(data)),
+    "gris réduit 640": lambda data: decode_pyzbar(downscale(image_from_bytes(data), 640)),
+    "opencv seul": lambda data: decode_opencv(image_from_bytes(data)),
+    "pipeline": lambda data: decode_qr(image_from_bytes(data)).payloads,
+}
+
+
+def generate_corpus(directory: Path, count: int, seed: int = 0):
+    """Synthetic camera-like photos: a QR code at a random size, position and angle
+    on a noisy 1920x1080 background, saved as JPEG."""
+    import qrcode
+
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / "manifest.csv", "w", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        for i in range(count):
+            payload = f"{rng.choice(['entry', 'exit'])}_{rng.randint(1, 500)}_{date.today():%Y%m%d}"
+            code = np.array(qrcode.make(payload, box_size=10, border=4).convert("L"))
+            size = rng.randint(150, 700)
+            code = cv2.resize(code, (size, size), interpolation=cv2.INTER_NEAREST)
+            rotation = cv2.getRotationMatrix2D((size / 2, size / 2), rng.uniform(-25, 25), 1.0)
+            code = cv2.warpAffine(code, rotation, (size, size), borderValue=255)
+
+            frame = np.full((1080, 1920), rng.randint(90, 200), np.uint8)
+            frame = cv2.add(frame, np.random.default_rng(seed + i).integers(0, 40, frame.shape, np.uint8))
+            y, x = rng.randint(0, 1080 - size), rng.randint(0, 1920 - size)
+            frame[y:y + size, x:x + size] = code
+            frame = cv2.GaussianBlur(frame, (5, 5), rng.uniform(0.1, 1.5))
+
+            name = f"qr_{i:04d}.jpg"
+            cv2.imwrite(str(directory / name), cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR),
+                        [cv2.IMWRITE_JPEG_QUALITY, 85])
+            writer.writerow([name, payload])
+
+
+def load_corpus(directory: Path):
+    expected = {}
+    manifest = directory / "manifest.csv"
+    if manifest.exists():
+        with open(manifest, newline="") as f:
+            expected = {name: payload for name, payload in csv.reader(f, delimiter=";")}
+    images = [
+        (path.name, path.read_bytes())
+        for path in sorted(directory.iterdir())
+        if path.suffix.lower() in IMAGE_SUFFIXES
+    ]
+    return images, expected
+
+
+def run(images, expected, repeat: int = 1):
+    print(f"{len(images)} images\n")
+    print(f"{'Stratégie':<36} {'Décodés':>8} {'Moyenne':>9} {'Médiane':>9} {'p95':>9}")
+    for label, strategy in STRATEGIES.items():
+        latencies = []
+        decoded = 0
+        for name, data in images:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                payloads = strategy(data)
+                latencies.append((time.perf_counter() - start) * 1000)
+            if payloads and (name not in expected or expected[name] in payloads):
+                decoded += 1
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{label:<36} {100 * decoded / len(images):>7.1f}% "
+              f"{statistics.mean(latencies):>7.1f}ms {statistics.median(latencies):>7.1f}ms {p95:>7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", type=Path, help="dossier d'images")
+    parser.add_argument("--generate", type=int, metavar="N", help="générer N images synthétiques dans le dossier")
+    parser.add_argument("--repeat", type=int, default=1, help="décodages par image")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_corpus(args.corpus, args.generate)
+    images, expected = load_corpus(args.corpus)
+    if not images:
+        parser.error(f"aucune image dans {args.corpus}")
+    run(images, expected, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -37,6 +37,12 @@ def get_connection():
             raise RuntimeError(error_msg) from e
         raise
 
+def is_connection_error(error: Exception) -> bool:
+    """True if the error means the database could not be reached or the connection
+    was lost, as opposed to a statement rejected by the database."""
+    return (isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            or isinstance(error.__cause__, psycopg2.OperationalError))
+
 def init_db():
     conn = get_connection()
     cur = conn.cursor()
@@ -143,6 +149,17 @@ def init_db():
             )
         """)
 
+        # Entry (check_in_time) and exit times, one row per (activity, user)
+        cur.execute("""
+            ALTER TABLE attendance
+            ADD COLUMN IF NOT EXISTS check_out_time TIMESTAMP
+        """)
+        cur.execute("""
+            ALTER TABLE attendance
+            ADD COLUMN IF NOT EXISTS duration INTERVAL
+            GENERATED ALWAYS AS (check_out_time - check_in_time) STORED
+        """)
+
         # Activity equipment table
         cur.execute("""
             CREATE TABLE IF NOT EXISTS activity_equipment (
@@ -199,6 +216,50 @@ def init_db():
             REFERENCES evaluation_types(id)
         """)
 
+        # Ratings are bounded per evaluation type (up to 10), not globally to 1-5
+        cur.execute("ALTER TABLE user_notes DROP CONSTRAINT IF EXISTS user_notes_rating_check")
+        cur.execute("""
+            DO $$
+            BEGIN
+                ALTER TABLE user_notes
+                ADD CONSTRAINT user_notes_rating_range CHECK (rating BETWEEN 1 AND 10);
+            EXCEPTION WHEN duplicate_object THEN
+                NULL;
+            END $$;
+        """)
+        # Evaluation types must fit in the same range, or their notes would be rejected;
+        # NOT VALID keeps existing out-of-range types editable instead of failing init
+        cur.execute("""
+            DO $$
+            BEGIN
+                ALTER TABLE evaluation_types
+                ADD CONSTRAINT evaluation_types_rating_range
+                CHECK (min_rating >= 1 AND max_rating <= 10) NOT VALID;
+            EXCEPTION WHEN duplicate_object THEN
+                NULL;
+            END $$;
+        """)
+
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_user_notes_user_date
+            ON user_notes (user_id, note_date DESC, id DESC)
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_users_status_name
+            ON users (status, name)
+        """)
+
+        # Full-text search over appreciations (French configuration)
+        cur.execute("""
+            ALTER TABLE user_notes
+            ADD COLUMN IF NOT EXISTS appreciation_search TSVECTOR
+            GENERATED ALWAYS AS (to_tsvector('french', COALESCE(appreciation, ''))) STORED
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_user_notes_search
+            ON user_notes USING GIN (appreciation_search)
+        """)
+
         # Insert default evaluation types if none exist
         cur.execute("SELECT COUNT(*) FROM evaluation_types")
         if cur.fetchone()[0] == 0:
@@ -217,6 +278,570 @@ def init_db():
                     ON CONFLICT (name) DO NOTHING
                 """, (name, min_rating, max_rating, description))
 
+        # Badges table
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS badges (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                description TEXT,
+                icon_name VARCHAR(50),
+                points_required INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_badges_points_required
+            ON badges (points_required)
+        """)
+
+        # Badge rules: 'points' (total points) or 'attendance_count' (activities attended)
+        cur.execute("""
+            ALTER TABLE badges
+            ADD COLUMN IF NOT EXISTS rule_type VARCHAR(30) NOT NULL DEFAULT 'points'
+            CHECK (rule_type IN ('points', 'attendance_count'))
+        """)
+        cur.execute("""
+            ALTER TABLE badges
+            ADD COLUMN IF NOT EXISTS threshold INTEGER
+        """)
+        cur.execute("""
+            UPDATE badges SET threshold = points_required
+            WHERE threshold IS NULL
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_badges_rule
+            ON badges (rule_type, threshold)
+        """)
+
+        # Per-user points, kept current by triggers on user_notes and attendance
+        # Notes: rating * 2 points (2 to 20, ratings go up to 10), attendance: 10 points per activity
+        # Level N requires (N*10)^2 points, minimum level is 1
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS user_points (
+                user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                note_points INTEGER NOT NULL DEFAULT 0,
+                attendance_points INTEGER NOT NULL DEFAULT 0,
+                points INTEGER GENERATED ALWAYS AS (note_points + attendance_points) STORED,
+                level INTEGER GENERATED ALWAYS AS (
+                    GREATEST(1, FLOOR(SQRT(GREATEST(note_points + attendance_points, 0)) / 10)::INTEGER)
+                ) STORED,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION add_user_points(
+                p_user_id INTEGER, p_note_points INTEGER, p_attendance_points INTEGER
+            ) RETURNS VOID AS $$
+            BEGIN
+                IF p_user_id IS NULL THEN
+                    RETURN;
+                END IF;
+                INSERT INTO user_points (user_id, note_points, attendance_points)
+                VALUES (p_user_id, p_note_points, p_attendance_points)
+                ON CONFLICT (user_id) DO UPDATE
+                SET note_points = user_points.note_points + EXCLUDED.note_points,
+                    attendance_points = user_points.attendance_points + EXCLUDED.attendance_points,
+                    updated_at = CURRENT_TIMESTAMP;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_user_points_points
+            ON user_points (points DESC)
+        """)
+
+        # Monthly points per user, used for per-period leaderboards
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS user_points_monthly (
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                month DATE NOT NULL,
+                note_points INTEGER NOT NULL DEFAULT 0,
+                attendance_points INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, user_id)
+            )
+        """)
+
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION add_user_points_monthly(
+                p_user_id INTEGER, p_month DATE, p_note_points INTEGER, p_attendance_points INTEGER
+            ) RETURNS VOID AS $$
+            BEGIN
+                IF p_user_id IS NULL OR p_month IS NULL THEN
+                    RETURN;
+                END IF;
+                INSERT INTO user_points_monthly (user_id, month, note_points, attendance_points)
+                VALUES (p_user_id, DATE_TRUNC('month', p_month)::DATE, p_note_points, p_attendance_points)
+                ON CONFLICT (month, user_id) DO UPDATE
+                SET note_points = user_points_monthly.note_points + EXCLUDED.note_points,
+                    attendance_points = user_points_monthly.attendance_points + EXCLUDED.attendance_points;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION user_notes_points_trigger() RETURNS TRIGGER AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    PERFORM add_user_points(OLD.user_id, -COALESCE(OLD.rating, 0) * 2, 0);
+                    PERFORM add_user_points_monthly(OLD.user_id, OLD.note_date, -COALESCE(OLD.rating, 0) * 2, 0);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    PERFORM add_user_points(NEW.user_id, COALESCE(NEW.rating, 0) * 2, 0);
+                    PERFORM add_user_points_monthly(NEW.user_id, NEW.note_date, COALESCE(NEW.rating, 0) * 2, 0);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION attendance_points_trigger() RETURNS TRIGGER AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    PERFORM add_user_points(OLD.user_id, 0, -10);
+                    PERFORM add_user_points_monthly(
+                        OLD.user_id,
+                        COALESCE((SELECT date FROM activities WHERE id = OLD.activity_id), OLD.created_at::DATE),
+                        0, -10
+                    );
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    PERFORM add_user_points(NEW.user_id, 0, 10);
+                    PERFORM add_user_points_monthly(
+                        NEW.user_id,
+                        COALESCE((SELECT date FROM activities WHERE id = NEW.activity_id), NEW.created_at::DATE),
+                        0, 10
+                    );
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+
+        cur.execute("DROP TRIGGER IF EXISTS trg_user_notes_points ON user_notes")
+        cur.execute("""
+            CREATE TRIGGER trg_user_notes_points
+            AFTER INSERT OR DELETE OR UPDATE OF user_id, rating, note_date ON user_notes
+            FOR EACH ROW EXECUTE FUNCTION user_notes_points_trigger()
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS trg_attendance_points ON attendance")
+        cur.execute("""
+            CREATE TRIGGER trg_attendance_points
+            AFTER INSERT OR DELETE OR UPDATE OF user_id, activity_id ON attendance
+            FOR EACH ROW EXECUTE FUNCTION attendance_points_trigger()
+        """)
+
+        # Attendance points are bucketed by activity date: moving an activity to another
+        # month moves the points of its attendees with it
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION activity_date_points_trigger() RETURNS TRIGGER AS $$
+            DECLARE
+                r RECORD;
+            BEGIN
+                FOR r IN
+                    SELECT user_id, COUNT(*)::INTEGER AS attended
+                    FROM attendance
+                    WHERE activity_id = NEW.id AND user_id IS NOT NULL
+                    GROUP BY user_id
+                LOOP
+                    PERFORM add_user_points_monthly(r.user_id, OLD.date, 0, -10 * r.attended);
+                    PERFORM add_user_points_monthly(r.user_id, NEW.date, 0, 10 * r.attended);
+                END LOOP;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS trg_activity_date_points ON activities")
+        cur.execute("""
+            CREATE TRIGGER trg_activity_date_points
+            AFTER UPDATE OF date ON activities
+            FOR EACH ROW
+            WHEN (DATE_TRUNC('month', OLD.date) IS DISTINCT FROM DATE_TRUNC('month', NEW.date))
+            EXECUTE FUNCTION activity_date_points_trigger()
+        """)
+
+        # Full recomputation, used on first install and from the admin page
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION rebuild_user_points() RETURNS VOID AS $$
+            BEGIN
+                DELETE FROM user_points;
+                INSERT INTO user_points (user_id, note_points, attendance_points)
+                SELECT u.id,
+                       COALESCE(n.note_points, 0),
+                       COALESCE(a.attendance_points, 0)
+                FROM users u
+                LEFT JOIN (
+                    SELECT user_id, SUM(COALESCE(rating, 0) * 2) AS note_points
+                    FROM user_notes
+                    GROUP BY user_id
+                ) n ON n.user_id = u.id
+                LEFT JOIN (
+                    SELECT user_id, COUNT(*) * 10 AS attendance_points
+                    FROM attendance
+                    GROUP BY user_id
+                ) a ON a.user_id = u.id
+                WHERE n.user_id IS NOT NULL OR a.user_id IS NOT NULL;
+
+                DELETE FROM user_points_monthly;
+                INSERT INTO user_points_monthly (user_id, month, note_points, attendance_points)
+                SELECT user_id, month, SUM(note_points), SUM(attendance_points)
+                FROM (
+                    SELECT user_id, DATE_TRUNC('month', note_date)::DATE AS month,
+                           COALESCE(rating, 0) * 2 AS note_points, 0 AS attendance_points
+                    FROM user_notes
+                    WHERE user_id IS NOT NULL
+                    UNION ALL
+                    SELECT at.user_id, DATE_TRUNC('month', COALESCE(ac.date, at.created_at::DATE))::DATE,
+                           0, 10
+                    FROM attendance at
+                    LEFT JOIN activities ac ON ac.id = at.activity_id
+                    WHERE at.user_id IS NOT NULL
+                ) p
+                WHERE month IS NOT NULL
+                GROUP BY user_id, month;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+
+        cur.execute("""
+            ALTER TABLE user_points
+            ADD COLUMN IF NOT EXISTS attendance_count INTEGER
+            GENERATED ALWAYS AS (attendance_points / 10) STORED
+        """)
+
+        # Persisted badge awards
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS user_badges (
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                badge_id INTEGER REFERENCES badges(id) ON DELETE CASCADE,
+                awarded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, badge_id)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_user_badges_badge
+            ON user_badges (badge_id)
+        """)
+
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION badge_rule_met(
+                p_rule_type VARCHAR, p_threshold INTEGER, p_points INTEGER, p_attendance_count INTEGER
+            ) RETURNS BOOLEAN AS $$
+                SELECT CASE p_rule_type
+                    WHEN 'points' THEN p_points >= COALESCE(p_threshold, 0)
+                    WHEN 'attendance_count' THEN p_attendance_count >= COALESCE(p_threshold, 0)
+                    ELSE FALSE
+                END
+            $$ LANGUAGE sql IMMUTABLE
+        """)
+
+        # Award badges to the user whose points just changed
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION user_points_badges_trigger() RETURNS TRIGGER AS $$
+            BEGIN
+                INSERT INTO user_badges (user_id, badge_id)
+                SELECT NEW.user_id, b.id
+                FROM badges b
+                WHERE badge_rule_met(b.rule_type, b.threshold, NEW.points, NEW.attendance_count)
+                ON CONFLICT DO NOTHING;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS trg_user_points_badges ON user_points")
+        cur.execute("""
+            CREATE TRIGGER trg_user_points_badges
+            AFTER INSERT OR UPDATE OF note_points, attendance_points ON user_points
+            FOR EACH ROW EXECUTE FUNCTION user_points_badges_trigger()
+        """)
+
+        cur.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM user_points)
+               AND (EXISTS (SELECT 1 FROM user_notes) OR EXISTS (SELECT 1 FROM attendance))
+        """)
+        if cur.fetchone()[0]:
+            cur.execute("SELECT rebuild_user_points()")
+
+        # Initial award pass for points computed before user_badges existed
+        cur.execute("""
+            INSERT INTO user_badges (user_id, badge_id)
+            SELECT up.user_id, b.id
+            FROM user_points up
+            JOIN badges b ON badge_rule_met(b.rule_type, b.threshold, up.points, up.attendance_count)
+            WHERE NOT EXISTS (SELECT 1 FROM user_badges)
+            ON CONFLICT DO NOTHING
+        """)
+
+        # Daily attendance rollup per activity and user status, kept current by trigger
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS attendance_daily (
+                day DATE NOT NULL,
+                activity_id INTEGER REFERENCES activities(id) ON DELETE CASCADE,
+                user_status VARCHAR(50) NOT NULL,
+                attendance_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, activity_id, user_status)
+            )
+        """)
+
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION add_attendance_daily(
+                p_activity_id INTEGER, p_user_id INTEGER, p_created_at TIMESTAMP, p_delta INTEGER
+            ) RETURNS VOID AS $$
+            BEGIN
+                IF p_activity_id IS NULL THEN
+                    RETURN;
+                END IF;
+                INSERT INTO attendance_daily (day, activity_id, user_status, attendance_count)
+                SELECT COALESCE(ac.date, p_created_at::DATE), p_activity_id,
+                       COALESCE((SELECT status FROM users WHERE id = p_user_id), 'inconnu'),
+                       p_delta
+                FROM (SELECT 1) one
+                LEFT JOIN activities ac ON ac.id = p_activity_id
+                ON CONFLICT (day, activity_id, user_status) DO UPDATE
+                SET attendance_count = attendance_daily.attendance_count + EXCLUDED.attendance_count;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION attendance_daily_trigger() RETURNS TRIGGER AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    PERFORM add_attendance_daily(OLD.activity_id, OLD.user_id, OLD.created_at, -1);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    PERFORM add_attendance_daily(NEW.activity_id, NEW.user_id, NEW.created_at, 1);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS trg_attendance_daily ON attendance")
+        cur.execute("""
+            CREATE TRIGGER trg_attendance_daily
+            AFTER INSERT OR DELETE OR UPDATE OF user_id, activity_id ON attendance
+            FOR EACH ROW EXECUTE FUNCTION attendance_daily_trigger()
+        """)
+
+        # Keep the rollup day in sync when an activity is moved to another date
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION activity_date_rollup_trigger() RETURNS TRIGGER AS $$
+            BEGIN
+                UPDATE attendance_daily SET day = NEW.date WHERE activity_id = NEW.id;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS trg_activity_date_rollup ON activities")
+        cur.execute("""
+            CREATE TRIGGER trg_activity_date_rollup
+            AFTER UPDATE OF date ON activities
+            FOR EACH ROW WHEN (OLD.date IS DISTINCT FROM NEW.date)
+            EXECUTE FUNCTION activity_date_rollup_trigger()
+        """)
+
+        # The rollup is keyed by the current user status: move a user's counts
+        # to the new status when it changes
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION user_status_rollup_trigger() RETURNS TRIGGER AS $$
+            BEGIN
+                WITH moved AS (
+                    SELECT COALESCE(ac.date, at.created_at::DATE) AS day, at.activity_id,
+                           COUNT(*) AS attendance_count
+                    FROM attendance at
+                    LEFT JOIN activities ac ON ac.id = at.activity_id
+                    WHERE at.user_id = NEW.id AND at.activity_id IS NOT NULL
+                    GROUP BY 1, 2
+                ),
+                removed AS (
+                    UPDATE attendance_daily ad
+                    SET attendance_count = ad.attendance_count - m.attendance_count
+                    FROM moved m
+                    WHERE ad.day = m.day AND ad.activity_id = m.activity_id
+                      AND ad.user_status = COALESCE(OLD.status, 'inconnu')
+                )
+                INSERT INTO attendance_daily (day, activity_id, user_status, attendance_count)
+                SELECT day, activity_id, COALESCE(NEW.status, 'inconnu'), attendance_count
+                FROM moved
+                ON CONFLICT (day, activity_id, user_status) DO UPDATE
+                SET attendance_count = attendance_daily.attendance_count + EXCLUDED.attendance_count;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS trg_user_status_rollup ON users")
+        cur.execute("""
+            CREATE TRIGGER trg_user_status_rollup
+            AFTER UPDATE OF status ON users
+            FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+            EXECUTE FUNCTION user_status_rollup_trigger()
+        """)
+
+        # Full recomputation, e.g. after restoring attendance rows
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION rebuild_attendance_daily() RETURNS VOID AS $$
+            BEGIN
+                DELETE FROM attendance_daily;
+                INSERT INTO attendance_daily (day, activity_id, user_status, attendance_count)
+                SELECT COALESCE(ac.date, at.created_at::DATE), at.activity_id,
+                       COALESCE(u.status, 'inconnu'), COUNT(*)
+                FROM attendance at
+                LEFT JOIN activities ac ON ac.id = at.activity_id
+                LEFT JOIN users u ON u.id = at.user_id
+                WHERE at.activity_id IS NOT NULL
+                GROUP BY 1, 2, 3;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+
+        cur.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM attendance_daily)
+               AND EXISTS (SELECT 1 FROM attendance)
+        """)
+        if cur.fetchone()[0]:
+            cur.execute("SELECT rebuild_attendance_daily()")
+
+        # Messages and their per-recipient delivery rows
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id SERIAL PRIMARY KEY,
+                sender_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                subject VARCHAR(255) NOT NULL,
+                body TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_created_at
+            ON messages (created_at)
+        """)
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS message_recipients (
+                message_id INTEGER REFERENCES messages(id) ON DELETE CASCADE,
+                recipient_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                is_read BOOLEAN NOT NULL DEFAULT false,
+                read_at TIMESTAMP,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (message_id, recipient_id)
+            )
+        """)
+        # Full-text search over subjects (weight A) and bodies (weight B)
+        cur.execute("""
+            ALTER TABLE messages
+            ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('french', COALESCE(subject, '')), 'A') ||
+                setweight(to_tsvector('french', COALESCE(body, '')), 'B')
+            ) STORED
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_search
+            ON messages USING GIN (search_vector)
+        """)
+
+        # Moderation: messages from non-staff senders wait in 'pending' with their
+        # recipient list and are fanned out to message_recipients on approval
+        cur.execute("""
+            ALTER TABLE messages
+            ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'approved'
+                CHECK (status IN ('pending', 'approved', 'rejected')),
+            ADD COLUMN IF NOT EXISTS recipient_ids INTEGER[],
+            ADD COLUMN IF NOT EXISTS moderated_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            ADD COLUMN IF NOT EXISTS moderated_at TIMESTAMP
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_pending
+            ON messages (created_at, id) WHERE status = 'pending'
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_sender
+            ON messages (sender_id, created_at DESC, id DESC)
+        """)
+
+        # Inbox listing (keyset on created_at, message_id) and unread counts
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_message_recipients_inbox
+            ON message_recipients (recipient_id, is_read, created_at DESC, message_id DESC)
+        """)
+
+        # Recipient typeahead: name prefix search (lower(name) LIKE 'abc%')
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_users_name_prefix
+            ON users (lower(name) text_pattern_ops)
+        """)
+
+        # Notification preferences
+        cur.execute("""
+            ALTER TABLE users
+            ADD COLUMN IF NOT EXISTS phone VARCHAR(30),
+            ADD COLUMN IF NOT EXISTS notify_email BOOLEAN NOT NULL DEFAULT false,
+            ADD COLUMN IF NOT EXISTS notify_sms BOOLEAN NOT NULL DEFAULT false
+        """)
+
+        # Outbound notifications (SMS/email), one row per recipient and channel,
+        # sent by the background dispatcher in notifications.py
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id SERIAL PRIMARY KEY,
+                message_id INTEGER REFERENCES messages(id) ON DELETE CASCADE,
+                recipient_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                channel VARCHAR(10) NOT NULL CHECK (channel IN ('email', 'sms')),
+                address VARCHAR(255) NOT NULL,
+                subject VARCHAR(255),
+                body TEXT NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending'
+                    CHECK (status IN ('pending', 'sending', 'sent', 'failed')),
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                claimed_at TIMESTAMP,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP,
+                UNIQUE (message_id, recipient_id, channel)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_outbox_due
+            ON outbox (next_attempt_at) WHERE status = 'pending'
+        """)
+
+        # Background jobs (reports, exports, recomputations)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id SERIAL PRIMARY KEY,
+                job_type VARCHAR(50) NOT NULL,
+                params JSONB NOT NULL DEFAULT '{}',
+                status VARCHAR(20) NOT NULL DEFAULT 'queued'
+                    CHECK (status IN ('queued', 'running', 'done', 'failed')),
+                progress INTEGER NOT NULL DEFAULT 0,
+                message TEXT,
+                result_name VARCHAR(255),
+                result_path TEXT,
+                error TEXT,
+                created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_jobs_created_by
+            ON jobs (created_by, created_at DESC)
+        """)
+        # Refreshed by running jobs; a running job without heartbeat for too long was
+        # abandoned by a server process that stopped
+        cur.execute("""
+            ALTER TABLE jobs
+            ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_jobs_pending
+            ON jobs (status) WHERE status IN ('queued', 'running')
+        """)
+
         # Insert default permissions
         default_permissions = [
             ('manage_users', 'Gérer les utilisateurs'),
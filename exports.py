@@ -0,0 +1,180 @@
+import csv
+import database
+import uuid
+from datetime import date
+from pathlib import Path
+from typing import Iterator, List, Optional
+from reports import DETAIL_COLUMNS, DETAIL_QUERIES
+
+EXPORT_FORMATS = ["CSV", "XLSX"]
+
+# Exportable datasets: name -> (label, columns, query, filtered by the (start_date, end_date) range)
+EXPORTS = {
+    "attendance": (
+        "Présences",
+        ["Date", "Activité", "Nom", "Prénom", "Statut", "Entrée", "Sortie", "Durée (min)"],
+        """
+            SELECT ac.date, ac.name, u.name, u.first_name, u.status,
+                   COALESCE(at.check_in_time, at.created_at), at.check_out_time,
+                   EXTRACT(EPOCH FROM at.duration)::INTEGER / 60
+            FROM attendance at
+            JOIN activities ac ON ac.id = at.activity_id
+            JOIN users u ON u.id = at.user_id
+            WHERE ac.date BETWEEN %s AND %s
+            ORDER BY ac.date, ac.name, u.name
+        """,
+        True
+    ),
+    "notes": (
+        "Notes et appréciations",
+        ["Date", "Nom", "Statut", "Type", "Note", "Appréciation", "Évaluateur"],
+        """
+            SELECT n.note_date, u.name, u.status, COALESCE(et.name, n.note_type),
+                   n.rating, n.appreciation, e.name
+            FROM user_notes n
+            JOIN users u ON u.id = n.user_id
+            LEFT JOIN users e ON e.id = n.evaluator_id
+            LEFT JOIN evaluation_types et ON et.id = n.evaluation_type_id
+            WHERE n.note_date BETWEEN %s AND %s
+            ORDER BY n.note_date, u.name
+        """,
+        True
+    ),
+    "inventory": (
+        "Inventaire",
+        ["Article", "Catégorie", "Quantité", "Unité", "Seuil d'alerte"],
+        """
+            SELECT item_name, category, quantity, unit, min_quantity
+            FROM inventory
+            ORDER BY category, item_name
+        """,
+        False
+    ),
+    "activities": (
+        "Activités",
+        ["Date", "Activité", "Lieu", "Début", "Fin", "Places", "Description"],
+        """
+            SELECT date, name, location, start_time, end_time, max_participants, description
+            FROM activities
+            WHERE date BETWEEN %s AND %s
+            ORDER BY date, start_time
+        """,
+        True
+    ),
+    "users": (
+        "Utilisateurs",
+        ["Nom", "Prénom", "Grade", "Email", "Statut"],
+        """
+            SELECT name, first_name, rank, email, status
+            FROM users
+            ORDER BY status, name
+        """,
+        False
+    ),
+}
+
+# Report detail rows are exportable too
+for _report_type, _query in DETAIL_QUERIES.items():
+    EXPORTS[f"report:{_report_type}"] = (f"Rapport - {_report_type}", DETAIL_COLUMNS[_report_type], _query, True)
+
+
+def get_columns(export_name: str) -> List[str]:
+    return EXPORTS[export_name][1]
+
+
+def count_rows(export_name: str, start_date: Optional[date], end_date: Optional[date]) -> int:
+    """Number of rows iter_batches will yield, for progress reporting."""
+    if export_name not in EXPORTS:
+        raise ValueError(f"Export inconnu: {export_name}")
+    _, _, query, dated = EXPORTS[export_name]
+
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT COUNT(*) FROM ({query}) AS export", (start_date, end_date) if dated else None)
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.close()
+
+
+def iter_batches(export_name: str, start_date: Optional[date], end_date: Optional[date],
+                 batch_size: int = 5000) -> Iterator[List[tuple]]:
+    """Yield the rows of a dataset in batches from a server-side (named) cursor."""
+    if export_name not in EXPORTS:
+        raise ValueError(f"Export inconnu: {export_name}")
+    _, _, query, dated = EXPORTS[export_name]
+
+    conn = database.get_connection()
+    cur = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+    cur.itersize = batch_size
+    try:
+        cur.execute(query, (start_date, end_date) if dated else None)
+        while batch := cur.fetchmany(batch_size):
+            yield batch
+    finally:
+        cur.close()
+        conn.close()
+
+
+def write_csv(batches: Iterator[List[tuple]], columns: List[str], path: Path,
+              progress=None) -> int:
+    """Write batches to a CSV file as they arrive. Returns the number of rows written."""
+    count = 0
+    # utf-8-sig so that Excel detects the encoding of accented characters
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(columns)
+        for batch in batches:
+            writer.writerows(batch)
+            count += len(batch)
+            if progress:
+                progress(count)
+    return count
+
+
+def write_xlsx(batches: Iterator[List[tuple]], columns: List[str], path: Path,
+               progress=None) -> int:
+    """Write batches to an XLSX file in constant memory mode. Returns the number of rows written."""
+    try:
+        import xlsxwriter
+    except ImportError as e:
+        raise RuntimeError("L'export XLSX nécessite le paquet xlsxwriter") from e
+
+    workbook = xlsxwriter.Workbook(str(path), {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy',
+        'remove_timezone': True
+    })
+    try:
+        sheet = workbook.add_worksheet("Export")
+        header = workbook.add_format({'bold': True, 'bg_color': '#D9D9D9'})
+        sheet.write_row(0, 0, columns, header)
+        count = 0
+        for batch in batches:
+            for row in batch:
+                count += 1
+                sheet.write_row(count, 0, [_xlsx_value(value) for value in row])
+            if progress:
+                progress(count)
+        return count
+    finally:
+        workbook.close()
+
+
+def _xlsx_value(value):
+    # xlsxwriter writes datetime/date natively but not time objects
+    if hasattr(value, 'isoformat') and not isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def export_to_file(export_name: str, export_format: str, start_date: Optional[date],
+                   end_date: Optional[date], path: Path, progress=None) -> int:
+    batches = iter_batches(export_name, start_date, end_date)
+    columns = get_columns(export_name)
+    if export_format == "CSV":
+        return write_csv(batches, columns, path, progress)
+    if export_format == "XLSX":
+        return write_xlsx(batches, columns, path, progress)
+    raise ValueError(f"Format d'export inconnu: {export_format}")
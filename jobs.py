@@ -0,0 +1,297 @@
+import database
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from models import Badge, User
+from exports import EXPORTS, count_rows, export_to_file
+from qr_sheets import generate_sheet
+from reports import DETAIL_COLUMNS, count_detail_rows, iter_detail_rows, rebuild_attendance_rollup
+from utils import generate_pdf_report
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = Path(os.getenv('JOB_RESULTS_DIR', 'job_results'))
+MAX_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+# Running jobs without progress for this long are considered abandoned and re-queued
+STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', '3600'))  # seconds
+
+# Job handlers: job_type -> function(job, params) returning None or (file_name, content),
+# content being bytes, or the Path returned by job.result_file() for results written in place
+_HANDLERS: Dict[str, Callable] = {}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def register(job_type: str):
+    """Decorator registering the handler of a job type."""
+    def decorator(handler: Callable) -> Callable:
+        _HANDLERS[job_type] = handler
+        return handler
+    return decorator
+
+
+class Job:
+    def __init__(self, id: int, job_type: str, params: dict, status: str, progress: int,
+                 message: str, result_name: str, result_path: str, error: str,
+                 created_by: int, created_at: datetime, started_at: datetime = None,
+                 finished_at: datetime = None):
+        self.id = id
+        self.job_type = job_type
+        self.params = params
+        self.status = status
+        self.progress = progress
+        self.message = message
+        self.result_name = result_name
+        self.result_path = result_path
+        self.error = error
+        self.created_by = created_by
+        self.created_at = created_at
+        self.started_at = started_at
+        self.finished_at = finished_at
+
+    _COLUMNS = """
+        id, job_type, params, status, progress, message, result_name, result_path,
+        error, created_by, created_at, started_at, finished_at
+    """
+
+    def set_progress(self, progress: int, message: str = None):
+        """Called by handlers to persist their progress (0-100)."""
+        self.progress = max(0, min(100, int(progress)))
+        if message is not None:
+            self.message = message
+        _update(self.id, progress=self.progress, message=self.message, heartbeat_at=datetime.now())
+
+    def result_file(self, file_name: str) -> Path:
+        """Path where a handler can stream its result instead of returning bytes."""
+        return RESULTS_DIR / f"{self.id}_{file_name}"
+
+    def read_result(self) -> Optional[bytes]:
+        if self.status != 'done' or not self.result_path:
+            return None
+        try:
+            return Path(self.result_path).read_bytes()
+        except OSError as e:
+            logger.error(f"Error reading job result {self.result_path}: {e}")
+            return None
+
+    @staticmethod
+    def get_by_id(job_id: int) -> Optional['Job']:
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SELECT {Job._COLUMNS} FROM jobs WHERE id = %s", (job_id,))
+            if (data := cur.fetchone()) is not None:
+                return Job(*data)
+            return None
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def get_for_user(user_id: int, limit: int = 20) -> List['Job']:
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(f"""
+                SELECT {Job._COLUMNS}
+                FROM jobs
+                WHERE created_by = %s
+                ORDER BY created_at DESC
+                LIMIT %s
+            """, (user_id, limit))
+            return [Job(*row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+            conn.close()
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Type non sérialisable: {type(value)}")
+
+
+def _update(job_id: int, **fields):
+    assignments = ", ".join(f"{name} = %s" for name in fields)
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"UPDATE jobs SET {assignments} WHERE id = %s",
+                    list(fields.values()) + [job_id])
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Process-wide worker pool, shared by every Streamlit session."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="job")
+            RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+            _resume_pending(_executor)
+        return _executor
+
+
+def _resume_pending(executor: ThreadPoolExecutor):
+    """Re-queue jobs abandoned by a stopped server process, then hand every queued job
+    to the pool. Jobs queued or running in another live process are left to it:
+    _run only executes the jobs it manages to claim."""
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE jobs
+            SET status = 'queued', progress = 0, started_at = NULL, heartbeat_at = NULL
+            WHERE status = 'running'
+              AND COALESCE(heartbeat_at, started_at) < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+        """, (STALE_AFTER,))
+        cur.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id")
+        job_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+    for job_id in job_ids:
+        executor.submit(_run, job_id)
+
+
+def _claim(job_id: int) -> Optional[Job]:
+    """Atomically move a queued job to running. None if another worker got it first."""
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            UPDATE jobs
+            SET status = 'running', started_at = CURRENT_TIMESTAMP,
+                heartbeat_at = CURRENT_TIMESTAMP, progress = 0
+            WHERE id = %s AND status = 'queued'
+            RETURNING {Job._COLUMNS}
+        """, (job_id,))
+        data = cur.fetchone()
+        conn.commit()
+        return Job(*data) if data is not None else None
+    finally:
+        cur.close()
+        conn.close()
+
+
+def submit(job_type: str, params: dict, user_id: int) -> int:
+    """Persist a job and hand it to the worker pool. Returns the job id."""
+    if job_type not in _HANDLERS:
+        raise ValueError(f"Type de tâche inconnu: {job_type}")
+
+    executor = _get_executor()
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO jobs (job_type, params, created_by)
+            VALUES (%s, %s, %s)
+            RETURNING id
+        """, (job_type, json.dumps(params, default=_json_default), user_id))
+        job_id = cur.fetchone()[0]
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+    executor.submit(_run, job_id)
+    return job_id
+
+
+def _run(job_id: int):
+    job = _claim(job_id)
+    if job is None:
+        return
+
+    try:
+        result = _HANDLERS[job.job_type](job, job.params)
+        fields = {'status': 'done', 'progress': 100, 'finished_at': datetime.now()}
+        if result is not None:
+            file_name, content = result
+            path = job.result_file(file_name)
+            if not isinstance(content, Path):
+                path.write_bytes(content)
+            fields.update(result_name=file_name, result_path=str(path))
+        _update(job_id, **fields)
+    except Exception as e:
+        logger.exception(f"Job {job_id} ({job.job_type}) failed")
+        _update(job_id, status='failed', error=str(e), finished_at=datetime.now())
+
+
+@register('report_pdf')
+def _report_pdf(job: Job, params: dict):
+    report_type = params['report_type']
+    start_date = date.fromisoformat(params['start_date'])
+    end_date = date.fromisoformat(params['end_date'])
+
+    total = count_detail_rows(report_type, start_date, end_date)
+
+    def tracked(rows):
+        for count, row in enumerate(rows, 1):
+            if count % 1000 == 0:
+                job.set_progress(10 + 85 * count // max(total, 1), f"{count} / {total} lignes traitées")
+            yield row
+
+    job.set_progress(10, "Lecture des données")
+    pdf = generate_pdf_report(
+        tracked(iter_detail_rows(report_type, start_date, end_date)),
+        report_type,
+        columns=DETAIL_COLUMNS[report_type],
+        subtitle=f"Du {start_date.strftime('%d/%m/%Y')} au {end_date.strftime('%d/%m/%Y')}"
+    )
+    return f"rapport_{report_type}_{start_date:%Y%m%d}_{end_date:%Y%m%d}.pdf", pdf.getvalue()
+
+
+@register('rebuild_points')
+def _rebuild_points(job: Job, params: dict):
+    if not User.rebuild_points():
+        raise RuntimeError("Le recalcul des points a échoué")
+
+
+@register('reevaluate_badges')
+def _reevaluate_badges(job: Job, params: dict):
+    awarded = Badge.reevaluate(params.get('badge_id'), params.get('revoke', False))
+    job.set_progress(100, f"{awarded} badge(s) attribué(s)")
+
+
+@register('rebuild_attendance_rollup')
+def _rebuild_attendance_rollup(job: Job, params: dict):
+    if not rebuild_attendance_rollup():
+        raise RuntimeError("Le recalcul des présences journalières a échoué")
+
+
+@register('export')
+def _export(job: Job, params: dict):
+    export_name = params['export_name']
+    export_format = params['format']
+    start_date = date.fromisoformat(params['start_date']) if params.get('start_date') else None
+    end_date = date.fromisoformat(params['end_date']) if params.get('end_date') else None
+
+    file_name = f"export_{export_name.replace(':', '_')}_{datetime.now():%Y%m%d_%H%M}.{export_format.lower()}"
+    path = job.result_file(file_name)
+    total = count_rows(export_name, start_date, end_date)
+    job.set_progress(10, "Lecture des données")
+    count = export_to_file(
+        export_name, export_format, start_date, end_date, path,
+        progress=lambda rows: job.set_progress(10 + 85 * rows // max(total, 1), f"{rows} / {total} lignes exportées")
+    )
+    job.set_progress(100, f"{EXPORTS[export_name][0]} : {count} lignes exportées")
+    return file_name, path
+
+
+@register('qr_sheet')
+def _qr_sheet(job: Job, params: dict):
+    sheet = params['sheet']
+    pdf = generate_sheet(sheet, progress=job.set_progress)
+    return f"qr_{sheet}_{datetime.now():%Y%m%d_%H%M}.pdf", pdf
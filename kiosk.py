@@ -0,0 +1,252 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set
+import database
+import offline_queue
+import qr_tokens
+from models import Activity, User
+
+logger = logging.getLogger(__name__)
+
+# Scans of the same payload within this window are ignored
+DUPLICATE_WINDOW = 30  # seconds
+# Check-ins written per database round trip at most
+WRITE_BATCH_SIZE = 50
+# Personal badges are valid for one season, starting this month
+BADGE_SEASON_START_MONTH = 9
+# Badges issued this close to the end of a season are also valid for the next one
+BADGE_RENEWAL_DAYS = 30
+# Users whose badges are scanned
+ROSTER_STATUSES = ('cadet', 'AMC')
+
+
+def badge_season(day: date = None) -> tuple:
+    """(start, end) of the validity of a badge issued on `day`: the season, from
+    BADGE_SEASON_START_MONTH to the same month of the following year. A badge issued
+    in the last BADGE_RENEWAL_DAYS of a season also covers the next one, so that a
+    badge printed or shown just before the switch does not expire days later."""
+    day = day or date.today()
+    year = day.year if day.month >= BADGE_SEASON_START_MONTH else day.year - 1
+    end_year = year + 1
+    if date(end_year, BADGE_SEASON_START_MONTH, 1) - day <= timedelta(days=BADGE_RENEWAL_DAYS):
+        end_year += 1
+    return (datetime(year, BADGE_SEASON_START_MONTH, 1),
+            datetime(end_year, BADGE_SEASON_START_MONTH, 1) - timedelta(seconds=1))
+
+
+def personal_code(user_id: int, day: date = None) -> str:
+    """Payload of the personal QR badge of a user: a signed token valid over
+    badge_season(), identical over that period so that printed badges can be reused."""
+    valid_from, valid_until = badge_season(day)
+    return qr_tokens.sign('badge', user_id, valid_from, valid_until)
+
+
+def parse_personal_code(payload: str) -> Optional[int]:
+    """User id of a valid badge, None for anything else (forged, expired, activity code)."""
+    try:
+        token = qr_tokens.verify(payload)
+    except qr_tokens.InvalidToken:
+        return None
+    return token.subject_id if token.kind == 'badge' else None
+
+
+class Roster:
+    """Cadets an activity can check in, loaded once per scanning session so that
+    badges are resolved to names without a database round trip."""
+
+    def __init__(self, activity_id: int, names: Dict[int, str], checked_in: Set[int]):
+        self.activity_id = activity_id
+        self.names = names  # user id -> display name
+        self.checked_in = checked_in  # entries already recorded, seen or written by this session
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(activity: Activity, statuses=ROSTER_STATUSES) -> 'Roster':
+        names = {
+            user.id: " ".join(part for part in [user.first_name, user.name] if part)
+            for user in User.get_all_by_status(list(statuses))
+        }
+        checked_in = {row['user_id'] for row in activity.get_attendance_list() if row['entry_time']}
+        return Roster(activity.id, names, checked_in)
+
+    def claim(self, user_id: int) -> bool:
+        """True the first time a user checks in; later calls return False."""
+        with self._lock:
+            if user_id in self.checked_in:
+                return False
+            self.checked_in.add(user_id)
+            return True
+
+    def release(self, user_id: int):
+        """Undo a claim whose entry could not be stored, so the next scan retries it."""
+        with self._lock:
+            self.checked_in.discard(user_id)
+
+class RecentScanCache:
+    """Payloads seen in the last `window` seconds. Thread-safe, bounded in size."""
+
+    def __init__(self, window: float = DUPLICATE_WINDOW, max_entries: int = 1000):
+        self.window = window
+        self.max_entries = max_entries
+        self._seen = OrderedDict()  # payload -> monotonic time of the last accepted scan
+        self._lock = threading.Lock()
+
+    def seen_recently(self, payload: str) -> bool:
+        """True if the payload was accepted within the window; otherwise record it and
+        return False."""
+        now = time.monotonic()
+        with self._lock:
+            # Entries are kept in scan order: drop the expired ones from the front
+            while self._seen and next(iter(self._seen.values())) < now - self.window:
+                self._seen.popitem(last=False)
+            if payload in self._seen:
+                return True
+            self._seen[payload] = now
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return False
+
+
+class CheckInEvent:
+    def __init__(self, activity_id: int, user_id: int, scanned_at: datetime,
+                 status: str = 'queued', name: str = None, roster: Roster = None):
+        self.activity_id = activity_id
+        self.user_id = user_id
+        self.scanned_at = scanned_at
+        self.status = status  # queued, recorded, already, unknown, offline, failed
+        self.name = name
+        self.roster = roster  # roster that claimed the entry, released if it fails
+
+    def fail(self):
+        self.status = 'failed'
+        if self.roster is not None:
+            self.roster.release(self.user_id)
+
+
+class CheckInWriter:
+    """Background thread writing kiosk check-ins, so that decoding the next badge
+    never waits on the database. Queued check-ins are written in batches."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="kiosk-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, activity_id: int, user_id: int, name: str = None,
+               roster: Roster = None) -> CheckInEvent:
+        event = CheckInEvent(activity_id, user_id, datetime.now(), name=name, roster=roster)
+        self._queue.put(event)
+        return event
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: List[CheckInEvent]):
+        by_activity = {}
+        for event in batch:
+            by_activity.setdefault(event.activity_id, []).append(event)
+
+        for activity_id, events in by_activity.items():
+            try:
+                results = Activity.bulk_check_in(
+                    activity_id, [(event.user_id, event.scanned_at) for event in events]
+                )
+                recorded = set()
+                for event in events:
+                    if event.user_id not in results:
+                        event.status = 'unknown'
+                        continue
+                    name, inserted = results[event.user_id]
+                    event.name = event.name or name
+                    # bulk_check_in writes one entry per user (the earliest scan): later
+                    # scans of the same user in this batch are reported as already recorded
+                    if inserted and event.user_id not in recorded:
+                        event.status = 'recorded'
+                        recorded.add(event.user_id)
+                    else:
+                        event.status = 'already'
+            except Exception as e:
+                if not database.is_connection_error(e):
+                    logger.exception(f"Kiosk check-in write rejected for activity {activity_id}")
+                    for event in events:
+                        event.fail()
+                    continue
+                # Database unreachable: keep the scans on local disk until it recovers
+                logger.warning(f"Kiosk check-in write failed for activity {activity_id}, buffering: {e}")
+                for event in events:
+                    try:
+                        offline_queue.enqueue(activity_id, event.user_id, True, event.scanned_at)
+                        event.status = 'offline'
+                    except Exception:
+                        logger.exception("Check-in could not be buffered")
+                        event.fail()
+
+
+_writer: Optional[CheckInWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> CheckInWriter:
+    """Process-wide writer, shared by every kiosk."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = CheckInWriter()
+        return _writer
+
+
+class Kiosk:
+    """State of one kiosk: the activity checked into, its duplicate-scan cache and the
+    recent events shown on screen. Fed with decoded payloads from any thread.
+
+    With a roster, badges are resolved locally: unknown users and users already
+    checked in never reach the database, and names are shown at once."""
+
+    def __init__(self, activity_id: int, window: float = DUPLICATE_WINDOW, history: int = 20,
+                 roster: Roster = None):
+        self.activity_id = activity_id
+        self.roster = roster
+        self.recent = RecentScanCache(window)
+        self.events = deque(maxlen=history)
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def handle(self, payloads: List[str]):
+        for payload in payloads:
+            if self.recent.seen_recently(payload):
+                continue
+            user_id = parse_personal_code(payload)
+            if user_id is None:
+                with self._lock:
+                    self.rejected += 1
+                continue
+            if self.roster is None:
+                event = get_writer().submit(self.activity_id, user_id)
+            elif user_id not in self.roster.names:
+                event = CheckInEvent(self.activity_id, user_id, datetime.now(), 'unknown')
+            elif not self.roster.claim(user_id):
+                event = CheckInEvent(self.activity_id, user_id, datetime.now(), 'already',
+                                     self.roster.names[user_id])
+            else:
+                event = get_writer().submit(self.activity_id, user_id, self.roster.names[user_id],
+                                            self.roster)
+            with self._lock:
+                self.events.appendleft(event)
+
+    def snapshot(self) -> List[CheckInEvent]:
+        with self._lock:
+            return list(self.events)
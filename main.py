@@ -1,12 +1,17 @@
 import streamlit as st
 import database
+import notifications
+import offline_queue
+import reports
 from models import User
+from utils import show_unread_messages
 import hashlib
 from pathlib import Path
 import base64
 import logging
 from dotenv import load_dotenv
 import os
+from datetime import datetime, timedelta
 
 # Load environment variables from .env file
 load_dotenv()
@@ -34,6 +39,11 @@ try:
     database.init_db()
     logger.info("Database initialized successfully")
 
+    # Envoi des notifications SMS / email en attente
+    notifications.start()
+    # Synchronisation des présences enregistrées hors ligne
+    offline_queue.start()
+
     # Charger le CSS personnalisé
     def load_css():
         try:
@@ -118,6 +128,7 @@ try:
             # Vérifier l'authentification
             if not check_authentication():
                 return
+            show_unread_messages(st.session_state.user)
 
             col1, col2, col3 = st.columns([1.5, 1, 1.5])
             with col2:
@@ -137,6 +148,23 @@ try:
             - 📊 Rapports
             """)
 
+            if st.session_state.user.status in ['administration', 'animateur']:
+                st.markdown("### Présences des 30 derniers jours")
+                today = datetime.now().date()
+                daily = reports.daily_attendance(today - timedelta(days=30), today)
+                if daily:
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.metric("Total présences", sum(count for _, count in daily))
+                    with col2:
+                        st.metric("Jours d'activité", len(daily))
+                    st.bar_chart({
+                        'dates': [day for day, _ in daily],
+                        'présences': [count for _, count in daily]
+                    }, x='dates', y='présences')
+                else:
+                    st.info("Aucune présence enregistrée sur les 30 derniers jours")
+
             if st.button("Se déconnecter"):
                 st.session_state.user = None
                 st.session_state.authentication_status = False
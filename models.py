@@ -1,6 +1,9 @@
 import database
+import notifications
+import reports
+from psycopg2.extras import execute_values
 from typing import Optional, List
-from datetime import datetime, time
+from datetime import datetime, date, time
 import hashlib
 
 class Inventory:
@@ -30,6 +33,7 @@ class Inventory:
 
             result = cur.fetchone() is not None
             conn.commit()
+            reports.cache.invalidate('inventory')
             return result
         except Exception as e:
             conn.rollback()
@@ -50,6 +54,7 @@ class Inventory:
                 RETURNING id, item_name, category, quantity, unit, min_quantity
             """, (item_name, category, quantity, unit, min_quantity))
             conn.commit()
+            reports.cache.invalidate('inventory')
             if (data := cur.fetchone()) is not None:
                 return Inventory(*data)
             return None
@@ -79,6 +84,7 @@ class Inventory:
         try:
             cur.execute("DELETE FROM inventory WHERE id = %s RETURNING id", (item_id,))
             conn.commit()
+            reports.cache.invalidate('inventory')
             return cur.fetchone() is not None
         except Exception as e:
             conn.rollback()
@@ -283,6 +289,7 @@ class EquipmentAssignment:
             """, (new_quantity, inventory_id))
 
             conn.commit()
+            reports.cache.invalidate('inventory')
             return True
         except Exception as e:
             conn.rollback()
@@ -330,6 +337,7 @@ class EquipmentAssignment:
             """, (self.quantity, self.inventory_id))
 
             conn.commit()
+            reports.cache.invalidate('inventory')
             return True
         except Exception as e:
             conn.rollback()
@@ -437,6 +445,45 @@ class EquipmentRequest:
             cur.close()
             conn.close()
 
+STAFF_STATUSES = ('administration', 'animateur')
+
+STATUS_GROUP_LABELS = {
+    'cadet': "Tous les cadets",
+    'AMC': "Tous les AMC",
+    'parent': "Tous les parents",
+    'animateur': "Tous les animateurs",
+    'administration': "Toute l'administration"
+}
+
+# Who may write to whom, as a predicate over the sender s and the recipient u:
+# staff write to everyone, parents to their own children, everyone else to
+# users of the same status and to staff
+RECIPIENT_VISIBILITY = """
+    u.id <> s.id
+    AND (
+        s.status IN ('administration', 'animateur')
+        OR (s.status = 'parent' AND EXISTS (
+            SELECT 1 FROM parent_child pc WHERE pc.parent_id = s.id AND pc.child_id = u.id
+        ))
+        OR (s.status <> 'parent' AND (u.status IN ('administration', 'animateur') OR u.status = s.status))
+    )
+"""
+
+# Whose notes a viewer s may read, as a predicate over the note owner u: staff read
+# the notes of every cadet/AMC, parents those of their children, others their own
+NOTE_VISIBILITY = """
+    (
+        u.id = s.id
+        OR (s.status IN ('administration', 'animateur') AND u.status IN ('cadet', 'AMC'))
+        OR (s.status = 'parent' AND EXISTS (
+            SELECT 1 FROM parent_child pc WHERE pc.parent_id = s.id AND pc.child_id = u.id
+        ))
+    )
+"""
+
+# ts_headline options: matched words in markdown bold
+SEARCH_HEADLINE_OPTIONS = "StartSel=**, StopSel=**, MaxFragments=2, MaxWords=25, MinWords=8"
+
 class User:
     def __init__(self, id: int, name: str, email: str, password_hash: str, status: str, 
                  first_name: str = None, rank: str = None):
@@ -453,23 +500,66 @@ class User:
         conn = database.get_connection()
         cur = conn.cursor()
         try:
-            if self.status == 'parent':
-                # Les parents peuvent envoyer des messages à leurs enfants
-                return self.get_children()
-            elif self.status == 'administration' or self.has_role('manage_communications'):
-                # Les administrateurs peuvent envoyer des messages à tout le monde
-                return User.get_all()
-            else:
-                # Les autres utilisateurs peuvent envoyer des messages aux utilisateurs 
-                # de même statut et aux animateurs/administrateurs
-                cur.execute("""
-                    SELECT DISTINCT u.id, u.name, u.email, u.password_hash, u.status
-                    FROM users u
-                    WHERE u.status IN ('administration', 'animateur')
-                    OR u.status = %s
-                    ORDER BY u.name
-                """, (self.status,))
-                return [User(*row) for row in cur.fetchall()]
+            cur.execute(f"""
+                SELECT u.id, u.name, u.email, u.password_hash, u.status
+                FROM users u, users s
+                WHERE s.id = %s AND {RECIPIENT_VISIBILITY}
+                ORDER BY u.name
+            """, (self.id,))
+            return [User(*row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+            conn.close()
+
+    def search_recipients(self, query: str, limit: int = 10) -> List['User']:
+        """Recipients visible to this user whose name starts with query, served by
+        the idx_users_name_prefix index."""
+        query = query.strip().lower()
+        if not query:
+            return []
+        pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(f"""
+                SELECT u.id, u.name, u.email, u.password_hash, u.status
+                FROM users u, users s
+                WHERE s.id = %s
+                  AND lower(u.name) LIKE %s
+                  AND {RECIPIENT_VISIBILITY}
+                ORDER BY lower(u.name)
+                LIMIT %s
+            """, (self.id, pattern, limit))
+            return [User(*row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+            conn.close()
+
+    def get_recipient_groups(self) -> List[tuple]:
+        """Group targets this user may write to, as (group, label); group is a tuple
+        (kind, value) resolved into users when the message is sent."""
+        if self.status == 'parent':
+            return [(('children', None), "Mes enfants")]
+        if self.status not in STAFF_STATUSES:
+            return [(('status', 'animateur'), "Tous les animateurs")]
+
+        groups = [(('status', status), label) for status, label in STATUS_GROUP_LABELS.items()]
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            # Activités récentes et à venir
+            cur.execute("""
+                SELECT id, name, date
+                FROM activities
+                WHERE date BETWEEN CURRENT_DATE - 30 AND CURRENT_DATE + 30
+                ORDER BY date DESC
+            """)
+            for activity_id, name, activity_date in cur.fetchall():
+                label = f"{name} ({activity_date.strftime('%d/%m/%Y')})"
+                groups.append((('activity', activity_id), f"Participants - {label}"))
+                groups.append((('activity_parents', activity_id), f"Parents des participants - {label}"))
+            return groups
         finally:
             cur.close()
             conn.close()
@@ -523,6 +613,22 @@ class User:
             cur.close()
             conn.close()
 
+    @staticmethod
+    def get_all_by_status(statuses: List[str]) -> List['User']:
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT id, name, email, password_hash, status, first_name, rank
+                FROM users
+                WHERE status = ANY(%s)
+                ORDER BY name
+            """, (list(statuses),))
+            return [User(*row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+            conn.close()
+
     def update(self, name: str, email: str, status: str, roles: List[str], 
               first_name: str = None, rank: str = None, password: str = None) -> bool:
         """Update user information and roles"""
@@ -566,6 +672,9 @@ class User:
                         SELECT %s, id FROM roles WHERE name = %s
                     """, (self.id, role_name))
 
+            # The attendance rollup follows the status change (trg_user_status_rollup)
+            status_changed = status != self.status
+
             # Update object attributes
             self.name = name
             self.email = email
@@ -576,6 +685,8 @@ class User:
                 self.password_hash = hashlib.sha256(password.encode()).hexdigest()
 
             conn.commit()
+            if status_changed:
+                reports.cache.invalidate('attendance')
             return True
 
         except Exception as e:
@@ -646,57 +757,301 @@ class User:
             cur.close()
             conn.close()
 
-    def get_points(self) -> dict:
-        """Calculate user points and level based on their activities and notes."""
+    def get_notes(self, start_date: date = None, end_date: date = None,
+                  limit: int = None, before: tuple = None) -> List[dict]:
+        """Get the user's notes, newest first, with the evaluator name.
+        before: (note_date, id) of the last note of the previous page, for keyset pagination."""
+        query = """
+            SELECT n.id, n.note_date, n.note_type, n.rating, n.appreciation,
+                   n.evaluator_id, e.name, n.evaluation_type_id
+            FROM user_notes n
+            LEFT JOIN users e ON e.id = n.evaluator_id
+            WHERE n.user_id = %s
+        """
+        params = [self.id]
+        if start_date is not None:
+            query += " AND n.note_date >= %s"
+            params.append(start_date)
+        if end_date is not None:
+            query += " AND n.note_date <= %s"
+            params.append(end_date)
+        if before is not None:
+            query += " AND (n.note_date, n.id) < (%s, %s)"
+            params.extend(before)
+        query += " ORDER BY n.note_date DESC, n.id DESC"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(query, params)
+            return [
+                {
+                    "id": row[0],
+                    "date": row[1],
+                    "type": row[2],
+                    "rating": row[3],
+                    "appreciation": row[4],
+                    "evaluator_id": row[5],
+                    "evaluator_name": row[6] or "Inconnu",
+                    "evaluation_type_id": row[7]
+                }
+                for row in cur.fetchall()
+            ]
+        finally:
+            cur.close()
+            conn.close()
+
+    def search_notes(self, query: str, limit: int = 20, before: tuple = None) -> List[dict]:
+        """Full-text search (French) over the appreciations this user may read, best
+        matches first. Keyset pagination: pass the (rank, id) of the last result of the
+        previous page as before."""
+        if not query.strip():
+            return []
+        before_rank, before_id = before if before else (None, None)
+
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(f"""
+                WITH q AS (
+                    SELECT websearch_to_tsquery('french', %(query)s) AS query
+                ),
+                hits AS (
+                    SELECT n.id, ts_rank_cd(n.appreciation_search, q.query)::FLOAT8 AS rank
+                    FROM user_notes n
+                    JOIN users u ON u.id = n.user_id
+                    JOIN users s ON s.id = %(viewer_id)s
+                    CROSS JOIN q
+                    WHERE n.appreciation_search @@ q.query
+                      AND {NOTE_VISIBILITY}
+                ),
+                page AS (
+                    SELECT id, rank
+                    FROM hits
+                    WHERE %(before_rank)s::FLOAT8 IS NULL
+                       OR (rank, id) < (%(before_rank)s, %(before_id)s)
+                    ORDER BY rank DESC, id DESC
+                    LIMIT %(limit)s
+                )
+                SELECT n.id, n.user_id, u.name, n.note_date, COALESCE(et.name, n.note_type),
+                       n.rating, ts_headline('french', n.appreciation, q.query, %(headline)s),
+                       e.name, page.rank
+                FROM page
+                JOIN user_notes n ON n.id = page.id
+                JOIN users u ON u.id = n.user_id
+                LEFT JOIN users e ON e.id = n.evaluator_id
+                LEFT JOIN evaluation_types et ON et.id = n.evaluation_type_id
+                CROSS JOIN q
+                ORDER BY page.rank DESC, page.id DESC
+            """, {
+                'query': query, 'viewer_id': self.id, 'before_rank': before_rank,
+                'before_id': before_id, 'limit': limit, 'headline': SEARCH_HEADLINE_OPTIONS
+            })
+            return [
+                {
+                    "id": row[0],
+                    "user_id": row[1],
+                    "user_name": row[2],
+                    "date": row[3],
+                    "type": row[4],
+                    "rating": row[5],
+                    "headline": row[6],
+                    "evaluator_name": row[7] or "Inconnu",
+                    "rank": row[8]
+                }
+                for row in cur.fetchall()
+            ]
+        finally:
+            cur.close()
+            conn.close()
+
+    def add_note(self, date: date, note_type: str, rating: int, appreciation: str,
+                 evaluator_id: int) -> Optional[int]:
+        """Add a note; the evaluation type is resolved from its name in the same statement."""
         conn = database.get_connection()
         cur = conn.cursor()
         try:
-            # Get points from notes (rating 1-5 = 2-10 points)
             cur.execute("""
-                SELECT COALESCE(SUM(rating * 2), 0)
-                FROM user_notes
-                WHERE user_id = %s
-            """, (self.id,))
-            note_points = cur.fetchone()[0]
+                INSERT INTO user_notes
+                (user_id, evaluator_id, note_date, note_type, rating, appreciation, evaluation_type_id)
+                VALUES (%s, %s, %s, %s, %s, %s, (SELECT id FROM evaluation_types WHERE name = %s))
+                RETURNING id
+            """, (self.id, evaluator_id, date, note_type, rating, appreciation, note_type))
+            note_id = cur.fetchone()[0]
+            conn.commit()
+            return note_id
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def bulk_add_notes(evaluator_id: int, note_date: date, notes: List[tuple]) -> int:
+        """Insert a grid of notes in a single statement.
+        notes: list of tuples (user_id, evaluation_type_id, rating, appreciation)"""
+        if not notes:
+            return 0
+
+        eval_types = {t.id: t for t in EvaluationType.get_all(active_only=False)}
+        rows = []
+        for user_id, eval_type_id, rating, appreciation in notes:
+            eval_type = eval_types.get(eval_type_id)
+            if eval_type is None:
+                raise ValueError(f"Type d'évaluation inconnu: {eval_type_id}")
+            min_rating, max_rating = eval_type.rating_bounds
+            if not min_rating <= rating <= max_rating:
+                raise ValueError(
+                    f"Note {rating} hors limites pour '{eval_type.name}' "
+                    f"({min_rating}-{max_rating})"
+                )
+            rows.append((user_id, evaluator_id, note_date, eval_type.name,
+                         int(rating), appreciation or None, eval_type_id))
 
-            # Get points from attendance (10 points per attendance)
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            execute_values(cur, """
+                INSERT INTO user_notes
+                (user_id, evaluator_id, note_date, note_type, rating, appreciation, evaluation_type_id)
+                VALUES %s
+            """, rows, page_size=len(rows))
+            conn.commit()
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def delete_note(self, note_id: int) -> bool:
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
             cur.execute("""
-                SELECT COUNT(*) * 10
-                FROM attendance
-                WHERE user_id = %s
+                DELETE FROM user_notes
+                WHERE id = %s AND user_id = %s
+                RETURNING id
+            """, (note_id, self.id))
+            result = cur.fetchone() is not None
+            conn.commit()
+            return result
+        except Exception as e:
+            conn.rollback()
+            print(f"Error deleting note: {str(e)}")
+            return False
+        finally:
+            cur.close()
+            conn.close()
+
+    def get_notification_settings(self) -> dict:
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT phone, notify_email, notify_sms
+                FROM users
+                WHERE id = %s
             """, (self.id,))
-            attendance_points = cur.fetchone()[0]
+            data = cur.fetchone()
+            if data is None:
+                return {"phone": None, "notify_email": False, "notify_sms": False}
+            return {"phone": data[0], "notify_email": data[1], "notify_sms": data[2]}
+        finally:
+            cur.close()
+            conn.close()
 
-            total_points = note_points + attendance_points
+    def update_notification_settings(self, phone: str, notify_email: bool, notify_sms: bool) -> bool:
+        """Store the phone number and the channels on which to be notified of new messages."""
+        phone = (phone or "").replace(" ", "") or None
+        if notify_sms and not phone:
+            raise ValueError("Un numéro de téléphone est nécessaire pour les notifications SMS")
 
-            # Calculate level: level N requires (N*10)^2 points
-            # So if you have 100 points, you're level 1 (requires 100 points)
-            # Level 2 requires 400 points, level 3 requires 900 points, etc.
-            level = int((total_points ** 0.5) / 10)  # Integer division to get current level
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                UPDATE users
+                SET phone = %s, notify_email = %s, notify_sms = %s
+                WHERE id = %s
+            """, (phone, notify_email, notify_sms, self.id))
+            conn.commit()
+            return cur.rowcount == 1
+        except Exception as e:
+            conn.rollback()
+            print(f"Error updating notification settings: {str(e)}")
+            return False
+        finally:
+            cur.close()
+            conn.close()
 
-            return {
-                "points": int(total_points),
-                "level": max(1, level)  # Minimum level is 1
-            }
+    def get_points(self) -> dict:
+        """Get user points and level from the incrementally maintained user_points table."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT points, level
+                FROM user_points
+                WHERE user_id = %s
+            """, (self.id,))
+            if (data := cur.fetchone()) is not None:
+                return {"points": data[0], "level": data[1]}
+            return {"points": 0, "level": 1}
         finally:
             cur.close()
             conn.close()
 
     def get_badges(self) -> List['Badge']:
-        """Get all badges earned by the user based on points."""
-        points_info = self.get_points()
-        total_points = points_info["points"]
+        """Get all badges awarded to the user."""
+        return self.get_progress()["badges"]
 
+    def get_progress(self) -> dict:
+        """Get points, level and awarded badges in a single query."""
         conn = database.get_connection()
         cur = conn.cursor()
         try:
             cur.execute("""
-                SELECT id, name, description, icon_name, points_required
-                FROM badges
-                WHERE points_required <= %s
-                ORDER BY points_required DESC
-            """, (total_points,))
-            return [Badge(*row) for row in cur.fetchall()]
+                SELECT COALESCE(up.points, 0), COALESCE(up.level, 1),
+                       b.id, b.name, b.description, b.icon_name, b.points_required,
+                       b.rule_type, b.threshold, ub.awarded_at
+                FROM users u
+                LEFT JOIN user_points up ON up.user_id = u.id
+                LEFT JOIN user_badges ub ON ub.user_id = u.id
+                LEFT JOIN badges b ON b.id = ub.badge_id
+                WHERE u.id = %s
+                ORDER BY ub.awarded_at DESC
+            """, (self.id,))
+            rows = cur.fetchall()
+            if not rows:
+                return {"points": 0, "level": 1, "badges": []}
+            return {
+                "points": rows[0][0],
+                "level": rows[0][1],
+                "badges": [Badge(*row[2:]) for row in rows if row[2] is not None]
+            }
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def rebuild_points() -> bool:
+        """Recompute the user_points table from user_notes and attendance."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT rebuild_user_points()")
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"Error rebuilding user points: {str(e)}")
+            return False
         finally:
             cur.close()
             conn.close()
@@ -762,6 +1117,7 @@ class Activity:
             """, (name, description, date, start_time, end_time,
                   max_participants, location, lunch_included, dinner_included))
             conn.commit()
+            reports.cache.invalidate('activities', date)
             if (data := cur.fetchone()) is not None:
                 return Activity(*data)
             return None
@@ -785,6 +1141,42 @@ class Activity:
             cur.close()
             conn.close()
 
+    @staticmethod
+    def get_upcoming(from_date: date = None) -> List['Activity']:
+        """Activities from the given day (today by default), in chronological order."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT id, name, description, date, start_time, end_time,
+                       max_participants, location, lunch_included, dinner_included
+                FROM activities
+                WHERE date >= COALESCE(%s, CURRENT_DATE)
+                ORDER BY date, start_time
+            """, (from_date,))
+            return [Activity(*row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def get_by_id(activity_id: int) -> Optional['Activity']:
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT id, name, description, date, start_time, end_time,
+                       max_participants, location, lunch_included, dinner_included
+                FROM activities
+                WHERE id = %s
+            """, (activity_id,))
+            if (data := cur.fetchone()) is not None:
+                return Activity(*data)
+            return None
+        finally:
+            cur.close()
+            conn.close()
+
     def update(self, name: str, description: str, date: datetime, start_time: time,
                end_time: time, max_participants: int, location: str = None,
                lunch_included: bool = False, dinner_included: bool = False) -> bool:
@@ -803,6 +1195,8 @@ class Activity:
             conn.commit()
             success = cur.fetchone() is not None
             if success:
+                reports.cache.invalidate('activities', self.date)
+                reports.cache.invalidate('activities', date)
                 self.name = name
                 self.description = description
                 self.date = date
@@ -824,6 +1218,7 @@ class Activity:
         try:
             cur.execute("DELETE FROM activities WHERE id = %s RETURNING id", (activity_id,))
             conn.commit()
+            reports.cache.invalidate('activities')
             return cur.fetchone() is not None
         except Exception as e:
             conn.rollback()
@@ -833,16 +1228,147 @@ class Activity:
             cur.close()
             conn.close()
 
-    def get_attendance_list(self) -> List[int]:
+    @staticmethod
+    def bulk_check_in(activity_id: int, check_ins: List[tuple]) -> dict:
+        """Record a batch of entries in one statement; users whose entry is already
+        recorded are left untouched, and a user listed several times gets the earliest
+        time. check_ins: list of (user_id, check_in_time).
+        Returns {user_id: (name, newly recorded)} for the users that exist."""
+        if not check_ins:
+            return {}
+        user_ids = [user_id for user_id, _ in check_ins]
+        times = [check_in_time for _, check_in_time in check_ins]
+
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                WITH scans AS (
+                    -- One row per user: ON CONFLICT cannot update the same row twice
+                    SELECT DISTINCT ON (user_id) user_id, check_in_time
+                    FROM unnest(%s::INTEGER[], %s::TIMESTAMP[]) AS s (user_id, check_in_time)
+                    ORDER BY user_id, check_in_time
+                ),
+                inserted AS (
+                    INSERT INTO attendance (activity_id, user_id, check_in_time)
+                    SELECT %s, s.user_id, s.check_in_time
+                    FROM scans s
+                    JOIN users u ON u.id = s.user_id
+                    ON CONFLICT (activity_id, user_id) DO UPDATE
+                    SET check_in_time = EXCLUDED.check_in_time
+                    WHERE attendance.check_in_time IS NULL
+                    RETURNING user_id
+                )
+                SELECT u.id, u.name, EXISTS (SELECT 1 FROM inserted i WHERE i.user_id = u.id)
+                FROM users u
+                WHERE u.id IN (SELECT user_id FROM scans)
+            """, (user_ids, times, activity_id))
+            results = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+            conn.commit()
+            if any(recorded for _, recorded in results.values()):
+                cur.execute("SELECT date FROM activities WHERE id = %s", (activity_id,))
+                if (data := cur.fetchone()) is not None:
+                    reports.cache.invalidate('attendance', data[0])
+            return results
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def record_attendance(self, user_id: int, is_entry: bool = True, at: datetime = None,
+                          overwrite: bool = False) -> bool:
+        """Record the entry or exit of a user in one idempotent upsert.
+        The first entry is kept unless overwrite is set (manual correction); the last
+        exit wins. Repeated scans are no-ops and never raise."""
+        column = "check_in_time" if is_entry else "check_out_time"
+        keep_existing = is_entry and not overwrite
+
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(f"""
+                INSERT INTO attendance (activity_id, user_id, {column})
+                VALUES (%s, %s, COALESCE(%s, CURRENT_TIMESTAMP))
+                ON CONFLICT (activity_id, user_id) DO UPDATE
+                SET {column} = EXCLUDED.{column}
+                WHERE %s IS FALSE OR attendance.{column} IS NULL
+            """, (self.id, user_id, at, keep_existing))
+            conn.commit()
+            reports.cache.invalidate('attendance', self.date)
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"Error recording attendance: {str(e)}")
+            return False
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def bulk_record_attendance(records: List[tuple]) -> int:
+        """Upsert a batch of entries/exits in one statement, with the same rules as
+        record_attendance: the earliest entry and the latest exit are kept, so replaying
+        a batch changes nothing. Records of unknown users or activities are dropped.
+        records: list of (activity_id, user_id, is_entry, time). Returns rows written."""
+        if not records:
+            return 0
+        activity_ids, user_ids, is_entry, times = (list(column) for column in zip(*records))
+
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                INSERT INTO attendance (activity_id, user_id, check_in_time, check_out_time)
+                SELECT r.activity_id, r.user_id,
+                       MIN(r.at) FILTER (WHERE r.is_entry),
+                       MAX(r.at) FILTER (WHERE NOT r.is_entry)
+                FROM unnest(%s::INTEGER[], %s::INTEGER[], %s::BOOLEAN[], %s::TIMESTAMP[])
+                     AS r (activity_id, user_id, is_entry, at)
+                JOIN users u ON u.id = r.user_id
+                JOIN activities ac ON ac.id = r.activity_id
+                GROUP BY r.activity_id, r.user_id
+                ON CONFLICT (activity_id, user_id) DO UPDATE
+                SET check_in_time = LEAST(attendance.check_in_time, EXCLUDED.check_in_time),
+                    check_out_time = GREATEST(attendance.check_out_time, EXCLUDED.check_out_time)
+                RETURNING (SELECT date FROM activities WHERE id = attendance.activity_id)
+            """, (activity_ids, user_ids, is_entry, times))
+            days = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            for day in set(days):
+                reports.cache.invalidate('attendance', day)
+            return len(days)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def get_attendance_list(self) -> List[dict]:
         conn = database.get_connection()
         cur = conn.cursor()
         try:
             cur.execute("""
-                SELECT user_id
-                FROM activity_attendance
-                WHERE activity_id = %s
+                SELECT a.user_id, u.name, u.status, a.check_in_time, a.check_out_time,
+                       EXTRACT(EPOCH FROM a.duration)::INTEGER / 60
+                FROM attendance a
+                JOIN users u ON u.id = a.user_id
+                WHERE a.activity_id = %s
+                ORDER BY u.name
             """, (self.id,))
-            return [row[0] for row in cur.fetchall()]
+            return [
+                {
+                    "user_id": row[0],
+                    "name": row[1],
+                    "status": row[2],
+                    "entry_time": row[3],
+                    "exit_time": row[4],
+                    "duration_minutes": row[5]
+                }
+                for row in cur.fetchall()
+            ]
         finally:
             cur.close()
             conn.close()
@@ -893,12 +1419,18 @@ class Activity:
 
 
 class Badge:
-    def __init__(self, id: int, name: str, description: str, icon_name: str, points_required: int):
+    RULE_TYPES = ('points', 'attendance_count')
+
+    def __init__(self, id: int, name: str, description: str, icon_name: str, points_required: int,
+                 rule_type: str = 'points', threshold: int = None, awarded_at: datetime = None):
         self.id = id
         self.name = name
         self.description = description
         self.icon_name = icon_name
         self.points_required = points_required
+        self.rule_type = rule_type
+        self.threshold = threshold if threshold is not None else points_required
+        self.awarded_at = awarded_at
 
     @staticmethod
     def get_all() -> List['Badge']:
@@ -906,9 +1438,9 @@ class Badge:
         cur = conn.cursor()
         try:
             cur.execute("""
-                SELECT id, name, description, icon_name, points_required
+                SELECT id, name, description, icon_name, points_required, rule_type, threshold
                 FROM badges
-                ORDER BY points_required
+                ORDER BY rule_type, threshold
             """)
             return [Badge(*row) for row in cur.fetchall()]
         finally:
@@ -916,24 +1448,610 @@ class Badge:
             conn.close()
 
     @staticmethod
-    def create(name: str, description: str, icon_name: str, points_required: int) -> Optional['Badge']:
+    def create(name: str, description: str, icon_name: str, points_required: int,
+               rule_type: str = 'points', threshold: int = None) -> Optional['Badge']:
+        """Create a badge and award it to every user who already satisfies its rule."""
+        if rule_type not in Badge.RULE_TYPES:
+            raise ValueError(f"Unknown badge rule type: {rule_type}")
+        if threshold is None:
+            threshold = points_required
+
         conn = database.get_connection()
         cur = conn.cursor()
         try:
             cur.execute("""
-                INSERT INTO badges (name, description, icon_name, points_required)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, name, description, icon_name, points_required
-            """, (name, description, icon_name, points_required))
+                INSERT INTO badges (name, description, icon_name, points_required, rule_type, threshold)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING id, name, description, icon_name, points_required, rule_type, threshold
+            """, (name, description, icon_name, points_required, rule_type, threshold))
+            data = cur.fetchone()
+            if data is not None:
+                Badge._award_qualifying(cur, data[0])
             conn.commit()
-            if (data := cur.fetchone()) is not None:
+            if data is not None:
                 return Badge(*data)
             return None
         finally:
             cur.close()
             conn.close()
 
+    def update(self, name: str, description: str, icon_name: str,
+               rule_type: str, threshold: int, revoke: bool = False) -> bool:
+        """Update the badge rule and re-evaluate it for all users."""
+        if rule_type not in Badge.RULE_TYPES:
+            raise ValueError(f"Unknown badge rule type: {rule_type}")
+
+        points_required = threshold if rule_type == 'points' else 0
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                UPDATE badges
+                SET name = %s, description = %s, icon_name = %s,
+                    points_required = %s, rule_type = %s, threshold = %s
+                WHERE id = %s
+                RETURNING id
+            """, (name, description, icon_name, points_required, rule_type, threshold, self.id))
+            if cur.fetchone() is None:
+                conn.rollback()
+                return False
+            if revoke:
+                Badge._revoke_unqualified(cur, self.id)
+            Badge._award_qualifying(cur, self.id)
+            conn.commit()
+            self.name = name
+            self.description = description
+            self.icon_name = icon_name
+            self.points_required = points_required
+            self.rule_type = rule_type
+            self.threshold = threshold
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"Error updating badge: {str(e)}")
+            return False
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def reevaluate(badge_id: int = None, revoke: bool = False) -> int:
+        """Re-evaluate one badge (or all badges) for every user in a single statement.
+        Returns the number of new awards."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            if revoke:
+                Badge._revoke_unqualified(cur, badge_id)
+            awarded = Badge._award_qualifying(cur, badge_id)
+            conn.commit()
+            return awarded
+        except Exception as e:
+            conn.rollback()
+            print(f"Error re-evaluating badges: {str(e)}")
+            return 0
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def _award_qualifying(cur, badge_id: int = None) -> int:
+        cur.execute("""
+            INSERT INTO user_badges (user_id, badge_id)
+            SELECT up.user_id, b.id
+            FROM badges b
+            JOIN user_points up
+              ON badge_rule_met(b.rule_type, b.threshold, up.points, up.attendance_count)
+            WHERE %(badge_id)s::INTEGER IS NULL OR b.id = %(badge_id)s
+            ON CONFLICT DO NOTHING
+        """, {"badge_id": badge_id})
+        return cur.rowcount
+
+    @staticmethod
+    def _revoke_unqualified(cur, badge_id: int = None) -> int:
+        cur.execute("""
+            DELETE FROM user_badges ub
+            USING badges b
+            WHERE ub.badge_id = b.id
+              AND (%(badge_id)s::INTEGER IS NULL OR b.id = %(badge_id)s)
+              AND NOT EXISTS (
+                  SELECT 1 FROM user_points up
+                  WHERE up.user_id = ub.user_id
+                    AND badge_rule_met(b.rule_type, b.threshold, up.points, up.attendance_count)
+              )
+        """, {"badge_id": badge_id})
+        return cur.rowcount
+
+class Leaderboard:
+    """Rankings read from the precomputed user_points and user_points_monthly tables."""
+
+    DEFAULT_STATUSES = ('cadet', 'AMC')
+
+    @staticmethod
+    def _month(value) -> Optional[date]:
+        return value.replace(day=1) if value is not None else None
+
+    @staticmethod
+    def get_top(limit: int = 20, start: date = None, end: date = None,
+                statuses: tuple = DEFAULT_STATUSES) -> List[dict]:
+        """Top users by points, overall or for the months covering [start, end]."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            if start is None and end is None:
+                cur.execute("""
+                    SELECT u.id, u.name, u.status, up.points, up.level,
+                           RANK() OVER (ORDER BY up.points DESC) AS rank
+                    FROM user_points up
+                    JOIN users u ON u.id = up.user_id
+                    WHERE u.status = ANY(%s)
+                    ORDER BY up.points DESC, u.name
+                    LIMIT %s
+                """, (list(statuses), limit))
+            else:
+                cur.execute("""
+                    SELECT u.id, u.name, u.status,
+                           SUM(pm.note_points + pm.attendance_points) AS points, NULL,
+                           RANK() OVER (ORDER BY SUM(pm.note_points + pm.attendance_points) DESC) AS rank
+                    FROM user_points_monthly pm
+                    JOIN users u ON u.id = pm.user_id
+                    WHERE pm.month BETWEEN COALESCE(%s, '-infinity'::DATE) AND COALESCE(%s, 'infinity'::DATE)
+                      AND u.status = ANY(%s)
+                    GROUP BY u.id, u.name, u.status
+                    ORDER BY points DESC, u.name
+                    LIMIT %s
+                """, (Leaderboard._month(start), Leaderboard._month(end), list(statuses), limit))
+            return [
+                {
+                    "user_id": row[0],
+                    "name": row[1],
+                    "status": row[2],
+                    "points": int(row[3]),
+                    "level": row[4],
+                    "rank": row[5]
+                }
+                for row in cur.fetchall()
+            ]
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def get_rank(user_id: int, start: date = None, end: date = None,
+                 statuses: tuple = DEFAULT_STATUSES) -> Optional[dict]:
+        """Rank of a single user, overall or for the months covering [start, end]."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            if start is None and end is None:
+                cur.execute("""
+                    WITH me AS (
+                        SELECT COALESCE((SELECT points FROM user_points WHERE user_id = %s), 0) AS points
+                    )
+                    SELECT me.points,
+                           1 + (SELECT COUNT(*)
+                                FROM user_points up
+                                JOIN users u ON u.id = up.user_id
+                                WHERE up.points > me.points AND u.status = ANY(%s)),
+                           (SELECT COUNT(*)
+                            FROM user_points up
+                            JOIN users u ON u.id = up.user_id
+                            WHERE u.status = ANY(%s))
+                    FROM me
+                """, (user_id, list(statuses), list(statuses)))
+            else:
+                cur.execute("""
+                    WITH totals AS (
+                        SELECT pm.user_id, SUM(pm.note_points + pm.attendance_points) AS points
+                        FROM user_points_monthly pm
+                        JOIN users u ON u.id = pm.user_id
+                        WHERE pm.month BETWEEN COALESCE(%s, '-infinity'::DATE) AND COALESCE(%s, 'infinity'::DATE)
+                          AND u.status = ANY(%s)
+                        GROUP BY pm.user_id
+                    ),
+                    me AS (
+                        SELECT COALESCE((SELECT points FROM totals WHERE user_id = %s), 0) AS points
+                    )
+                    SELECT me.points,
+                           1 + (SELECT COUNT(*) FROM totals WHERE totals.points > me.points),
+                           (SELECT COUNT(*) FROM totals)
+                    FROM me
+                """, (Leaderboard._month(start), Leaderboard._month(end), list(statuses), user_id))
+            if (data := cur.fetchone()) is not None:
+                return {"points": int(data[0]), "rank": data[1], "total": data[2]}
+            return None
+        finally:
+            cur.close()
+            conn.close()
+
+class Message:
+    STATUSES = ('pending', 'approved', 'rejected')
+    # Senders whose messages are delivered without moderation
+    TRUSTED_STATUSES = STAFF_STATUSES
+
+    def __init__(self, id: int, sender_id: int, sender_name: str, subject: str, body: str,
+                 created_at: datetime, is_read: bool = None, read_at: datetime = None,
+                 recipient_count: int = None, status: str = 'approved'):
+        self.id = id
+        self.sender_id = sender_id
+        self.sender_name = sender_name
+        self.subject = subject
+        self.body = body
+        self.created_at = created_at
+        self.is_read = is_read
+        self.read_at = read_at
+        self.recipient_count = recipient_count
+        self.status = status
+
+    @staticmethod
+    def requires_moderation(sender: 'User') -> bool:
+        return sender.status not in Message.TRUSTED_STATUSES
+
+    @staticmethod
+    def can_moderate(user: 'User') -> bool:
+        return user.status == 'administration' or (
+            user.status in Message.TRUSTED_STATUSES and user.has_permission('manage_communications')
+        )
+
+    # Group targets resolved into user ids at send time: kind -> query on the group value
+    GROUP_QUERIES = {
+        'status': "SELECT id FROM users WHERE status = %(value)s",
+        'children': "SELECT child_id FROM parent_child WHERE parent_id = %(sender_id)s",
+        'activity': "SELECT user_id FROM attendance WHERE activity_id = %(value)s",
+        'activity_parents': """
+            SELECT pc.parent_id
+            FROM attendance a
+            JOIN parent_child pc ON pc.child_id = a.user_id
+            WHERE a.activity_id = %(value)s
+        """
+    }
+
+    @staticmethod
+    def _recipients_query(sender_id: int, recipient_ids: List[int], groups: List[tuple]) -> tuple:
+        """SELECT of the ids of the recipients the sender is allowed to write to, among
+        the given users and the members of the given groups. Returns (query, params)."""
+        parts = ["SELECT unnest(%(ids)s::INTEGER[])"]
+        params = {'sender_id': sender_id, 'ids': list(recipient_ids)}
+        for index, (kind, value) in enumerate(groups):
+            if kind not in Message.GROUP_QUERIES:
+                raise ValueError(f"Groupe de destinataires inconnu: {kind}")
+            params[f'value_{index}'] = value
+            parts.append(Message.GROUP_QUERIES[kind].replace('%(value)s', f'%(value_{index})s'))
+
+        query = f"""
+            SELECT u.id
+            FROM users u
+            JOIN ({" UNION ".join(parts)}) AS targets (id) ON targets.id = u.id
+            JOIN users s ON s.id = %(sender_id)s
+            WHERE {RECIPIENT_VISIBILITY}
+        """
+        return query, params
+
+    @staticmethod
+    def send(sender_id: int, recipient_ids: List[int], subject: str, body: str,
+             moderated: bool = False, groups: List[tuple] = None) -> tuple:
+        """Store a message and fan it out to all its recipients in one statement.
+        groups are (kind, value) targets of GROUP_QUERIES, resolved in SQL now; recipients
+        the sender may not write to are dropped. With moderated, the message is kept
+        pending with its recipient list until approved.
+        Returns (message id, number of recipients)."""
+        groups = groups or []
+        if not recipient_ids and not groups:
+            raise ValueError("Veuillez sélectionner au moins un destinataire")
+        if not subject.strip() or not body.strip():
+            raise ValueError("Le sujet et le message sont obligatoires")
+
+        recipients_query, params = Message._recipients_query(sender_id, recipient_ids, groups)
+        params.update(subject=subject.strip(), body=body)
+        queued = 0
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            if moderated:
+                cur.execute(f"""
+                    INSERT INTO messages (sender_id, subject, body, status, recipient_ids)
+                    VALUES (%(sender_id)s, %(subject)s, %(body)s, 'pending',
+                            ARRAY({recipients_query} ORDER BY u.id))
+                    RETURNING id, created_at, cardinality(recipient_ids)
+                """, params)
+                message_id, created_at, count = cur.fetchone()
+            else:
+                cur.execute("""
+                    INSERT INTO messages (sender_id, subject, body)
+                    VALUES (%(sender_id)s, %(subject)s, %(body)s)
+                    RETURNING id, created_at
+                """, params)
+                message_id, created_at = cur.fetchone()
+                params.update(message_id=message_id, created_at=created_at)
+                cur.execute(f"""
+                    INSERT INTO message_recipients (message_id, recipient_id, created_at)
+                    SELECT %(message_id)s, r.id, %(created_at)s
+                    FROM ({recipients_query}) AS r
+                    ON CONFLICT DO NOTHING
+                """, params)
+                count = cur.rowcount
+            if not count:
+                conn.rollback()
+                raise ValueError("Aucun destinataire autorisé pour ce message")
+            if not moderated:
+                queued = notifications.enqueue(cur, [message_id])
+            conn.commit()
+            reports.cache.invalidate('messages', created_at.date())
+            if queued:
+                notifications.wake()
+            return message_id, count
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def get_pending(sender_id: int = None, start_date: date = None, end_date: date = None,
+                    limit: int = 100, after: tuple = None) -> List['Message']:
+        """Moderation queue, oldest first. Keyset pagination: pass the (created_at, id)
+        of the last message of the previous page as after."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            after_at, after_id = after if after else (None, None)
+            cur.execute("""
+                SELECT m.id, m.sender_id, u.name, m.subject, m.body, m.created_at, NULL, NULL,
+                       cardinality(m.recipient_ids), m.status
+                FROM messages m
+                LEFT JOIN users u ON u.id = m.sender_id
+                WHERE m.status = 'pending'
+                  AND (%s::INTEGER IS NULL OR m.sender_id = %s)
+                  AND (%s::DATE IS NULL OR m.created_at >= %s)
+                  AND (%s::DATE IS NULL OR m.created_at < %s::DATE + 1)
+                  AND (%s::TIMESTAMP IS NULL OR (m.created_at, m.id) > (%s, %s))
+                ORDER BY m.created_at, m.id
+                LIMIT %s
+            """, (sender_id, sender_id, start_date, start_date, end_date, end_date,
+                  after_at, after_at, after_id, limit))
+            return [Message(*row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def get_pending_senders() -> List[tuple]:
+        """Senders with messages awaiting moderation: list of (id, name, pending count)."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT u.id, u.name, COUNT(*)
+                FROM messages m
+                JOIN users u ON u.id = m.sender_id
+                WHERE m.status = 'pending'
+                GROUP BY u.id, u.name
+                ORDER BY u.name
+            """)
+            return cur.fetchall()
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def moderate(message_ids: List[int], approve: bool, moderator_id: int) -> int:
+        """Approve or reject pending messages in one set-based update. Approved messages
+        are delivered to all their recipients in a single insert. Returns the number
+        of messages moderated."""
+        if not message_ids:
+            return 0
+
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            if approve:
+                # The FROM subquery sees the recipient lists before they are cleared
+                cur.execute("""
+                    WITH approved AS (
+                        UPDATE messages m
+                        SET status = 'approved', recipient_ids = NULL,
+                            moderated_by = %s, moderated_at = CURRENT_TIMESTAMP
+                        FROM (
+                            SELECT id, recipient_ids
+                            FROM messages
+                            WHERE id = ANY(%s) AND status = 'pending'
+                            FOR UPDATE
+                        ) pending
+                        WHERE m.id = pending.id
+                        RETURNING m.id, m.created_at, pending.recipient_ids
+                    ),
+                    delivered AS (
+                        INSERT INTO message_recipients (message_id, recipient_id, created_at)
+                        SELECT a.id, recipient_id, CURRENT_TIMESTAMP
+                        FROM approved a, unnest(a.recipient_ids) AS recipient_id
+                        ON CONFLICT DO NOTHING
+                    )
+                    SELECT id, created_at::DATE FROM approved
+                """, (moderator_id, list(message_ids)))
+                approved = cur.fetchall()
+                days = [day for _, day in approved]
+                queued = notifications.enqueue(cur, [message_id for message_id, _ in approved])
+            else:
+                cur.execute("""
+                    UPDATE messages
+                    SET status = 'rejected', moderated_by = %s, moderated_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY(%s) AND status = 'pending'
+                    RETURNING created_at::DATE
+                """, (moderator_id, list(message_ids)))
+                days = [row[0] for row in cur.fetchall()]
+                queued = 0
+            conn.commit()
+            for day in set(days):
+                reports.cache.invalidate('messages', day)
+            if queued:
+                notifications.wake()
+            return len(days)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def get_inbox(user_id: int, limit: int = 20, before: tuple = None,
+                  unread_only: bool = False) -> List['Message']:
+        """Received messages, newest first. Keyset pagination: pass the (created_at, id)
+        of the last message of the previous page as before."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            before_at, before_id = before if before else (None, None)
+            cur.execute("""
+                SELECT m.id, m.sender_id, u.name, m.subject, m.body, mr.created_at,
+                       mr.is_read, mr.read_at
+                FROM message_recipients mr
+                JOIN messages m ON m.id = mr.message_id
+                LEFT JOIN users u ON u.id = m.sender_id
+                WHERE mr.recipient_id = %s
+                  AND (%s IS FALSE OR mr.is_read = false)
+                  AND (%s::TIMESTAMP IS NULL OR (mr.created_at, mr.message_id) < (%s, %s))
+                ORDER BY mr.created_at DESC, mr.message_id DESC
+                LIMIT %s
+            """, (user_id, unread_only, before_at, before_at, before_id, limit))
+            return [Message(*row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def get_sent(sender_id: int, limit: int = 20, before: tuple = None) -> List['Message']:
+        """Sent messages with their status and number of recipients, newest first
+        (keyset paginated)."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            before_at, before_id = before if before else (None, None)
+            cur.execute("""
+                SELECT m.id, m.sender_id, u.name, m.subject, m.body, m.created_at, NULL, NULL,
+                       COALESCE(cardinality(m.recipient_ids),
+                                (SELECT COUNT(*) FROM message_recipients mr WHERE mr.message_id = m.id)),
+                       m.status
+                FROM messages m
+                LEFT JOIN users u ON u.id = m.sender_id
+                WHERE m.sender_id = %s
+                  AND (%s::TIMESTAMP IS NULL OR (m.created_at, m.id) < (%s, %s))
+                ORDER BY m.created_at DESC, m.id DESC
+                LIMIT %s
+            """, (sender_id, before_at, before_at, before_id, limit))
+            return [Message(*row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def search(user_id: int, query: str, limit: int = 20, before: tuple = None) -> List['Message']:
+        """Full-text search (French) over the subjects and bodies of the messages the
+        user received or sent, best matches first. Each result carries rank and headline.
+        Keyset pagination: pass the (rank, id) of the last result as before."""
+        if not query.strip():
+            return []
+        before_rank, before_id = before if before else (None, None)
+
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                WITH q AS (
+                    SELECT websearch_to_tsquery('french', %(query)s) AS query
+                ),
+                hits AS (
+                    SELECT m.id, ts_rank_cd(m.search_vector, q.query)::FLOAT8 AS rank
+                    FROM messages m
+                    CROSS JOIN q
+                    WHERE m.search_vector @@ q.query
+                      AND (m.sender_id = %(user_id)s OR EXISTS (
+                          SELECT 1 FROM message_recipients mr
+                          WHERE mr.message_id = m.id AND mr.recipient_id = %(user_id)s
+                      ))
+                ),
+                page AS (
+                    SELECT id, rank
+                    FROM hits
+                    WHERE %(before_rank)s::FLOAT8 IS NULL
+                       OR (rank, id) < (%(before_rank)s, %(before_id)s)
+                    ORDER BY rank DESC, id DESC
+                    LIMIT %(limit)s
+                )
+                SELECT m.id, m.sender_id, u.name, m.subject, m.body, m.created_at,
+                       mr.is_read, mr.read_at, NULL, m.status,
+                       page.rank, ts_headline('french', m.body, q.query, %(headline)s)
+                FROM page
+                JOIN messages m ON m.id = page.id
+                LEFT JOIN users u ON u.id = m.sender_id
+                LEFT JOIN message_recipients mr
+                  ON mr.message_id = m.id AND mr.recipient_id = %(user_id)s
+                CROSS JOIN q
+                ORDER BY page.rank DESC, page.id DESC
+            """, {
+                'query': query, 'user_id': user_id, 'before_rank': before_rank,
+                'before_id': before_id, 'limit': limit, 'headline': SEARCH_HEADLINE_OPTIONS
+            })
+            results = []
+            for row in cur.fetchall():
+                message = Message(*row[:10])
+                message.rank, message.headline = row[10], row[11]
+                results.append(message)
+            return results
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def unread_count(user_id: int) -> int:
+        """Number of unread messages, answered from the inbox index alone."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT COUNT(*)
+                FROM message_recipients
+                WHERE recipient_id = %s AND is_read = false
+            """, (user_id,))
+            return cur.fetchone()[0]
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def mark_read(user_id: int, message_ids: List[int] = None) -> int:
+        """Mark the given messages (all unread messages if None) as read."""
+        conn = database.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                UPDATE message_recipients
+                SET is_read = true, read_at = CURRENT_TIMESTAMP
+                WHERE recipient_id = %s AND is_read = false
+                  AND (%s::INTEGER[] IS NULL OR message_id = ANY(%s))
+                RETURNING created_at::DATE
+            """, (user_id, message_ids, message_ids))
+            days = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            for day in set(days):
+                reports.cache.invalidate('messages', day)
+            return len(days)
+        except Exception as e:
+            conn.rollback()
+            print(f"Error marking messages as read: {str(e)}")
+            return 0
+        finally:
+            cur.close()
+            conn.close()
+
+
 class EvaluationType:
+    # Bounds of user_notes.rating, enforced by the database; a note is worth
+    # rating * 2 points, so up to 20
+    RATING_MIN = 1
+    RATING_MAX = 10
+
     def __init__(self, id: int, name: str, min_rating: int, max_rating: int, 
                  description: str, active: bool = True):
         self.id = id
@@ -943,11 +2061,24 @@ class EvaluationType:
         self.description = description
         self.active = active
 
+    @property
+    def rating_bounds(self) -> tuple:
+        """Accepted ratings, clipped to the database range for types created before it."""
+        return (max(self.min_rating, EvaluationType.RATING_MIN),
+                min(self.max_rating, EvaluationType.RATING_MAX))
+
     @staticmethod
-    def create(name: str, min_rating: int, max_rating: int, 
-              description: str = None, active: bool = True) -> Optional['EvaluationType']:
+    def _check_range(min_rating: int, max_rating: int):
         if min_rating > max_rating:
             raise ValueError("min_rating cannot be greater than max_rating")
+        if min_rating < EvaluationType.RATING_MIN or max_rating > EvaluationType.RATING_MAX:
+            raise ValueError(f"Ratings must be between {EvaluationType.RATING_MIN} "
+                             f"and {EvaluationType.RATING_MAX}")
+
+    @staticmethod
+    def create(name: str, min_rating: int, max_rating: int, 
+              description: str = None, active: bool = True) -> Optional['EvaluationType']:
+        EvaluationType._check_range(min_rating, max_rating)
 
         conn = database.get_connection()
         cur = conn.cursor()
@@ -991,6 +2122,9 @@ class EvaluationType:
                max_rating: int = None, description: str = None, 
                active: bool = None) -> bool:
         """Update evaluation type fields"""
+        if min_rating is not None or max_rating is not None:
+            EvaluationType._check_range(self.min_rating if min_rating is None else min_rating,
+                                        self.max_rating if max_rating is None else max_rating)
         update_fields = []
         values = []
 
@@ -0,0 +1,396 @@
+import database
+import json
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.message import EmailMessage
+from pathlib import Path
+from typing import Dict, List, Optional
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ('email', 'sms')
+
+MAX_WORKERS = int(os.getenv('NOTIFY_WORKERS', '4'))
+BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', '50'))
+MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '5'))
+RETRY_BASE_DELAY = float(os.getenv('NOTIFY_RETRY_BASE_DELAY', '30'))  # seconds
+RETRY_MAX_DELAY = float(os.getenv('NOTIFY_RETRY_MAX_DELAY', '3600'))
+POLL_INTERVAL = float(os.getenv('NOTIFY_POLL_INTERVAL', '30'))
+# Messages per second and per channel
+RATE_LIMITS = {
+    'email': float(os.getenv('EMAIL_RATE_PER_SEC', '5')),
+    'sms': float(os.getenv('SMS_RATE_PER_SEC', '1'))
+}
+# Rows left in 'sending' longer than this by a crashed process are retried
+CLAIM_TIMEOUT = int(os.getenv('NOTIFY_CLAIM_TIMEOUT', '600'))  # seconds
+
+
+class NotificationError(Exception):
+    """Raised by providers when a notification could not be sent."""
+
+
+class Provider(ABC):
+    """Sends one notification. Implementations raise NotificationError on failure."""
+
+    @abstractmethod
+    def send(self, address: str, subject: Optional[str], body: str):
+        ...
+
+
+class SmtpEmailProvider(Provider):
+    def __init__(self, host: str, port: int, user: str = None, password: str = None,
+                 sender: str = None, use_tls: bool = True):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sender = sender or user
+        self.use_tls = use_tls
+
+    def send(self, address: str, subject: Optional[str], body: str):
+        email = EmailMessage()
+        email['From'] = self.sender
+        email['To'] = address
+        email['Subject'] = subject or ""
+        email.set_content(body)
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+                if self.use_tls:
+                    smtp.starttls()
+                if self.user:
+                    smtp.login(self.user, self.password)
+                smtp.send_message(email)
+        except (smtplib.SMTPException, OSError) as e:
+            raise NotificationError(str(e)) from e
+
+
+class TwilioSmsProvider(Provider):
+    def __init__(self, account_sid: str, auth_token: str, from_number: str):
+        try:
+            from twilio.rest import Client
+        except ImportError as e:
+            raise RuntimeError("L'envoi de SMS nécessite le paquet twilio") from e
+        self.client = Client(account_sid, auth_token)
+        self.from_number = from_number
+
+    def send(self, address: str, subject: Optional[str], body: str):
+        from twilio.base.exceptions import TwilioException
+
+        text = f"{subject}\n{body}" if subject else body
+        try:
+            self.client.messages.create(to=address, from_=self.from_number, body=text)
+        except TwilioException as e:
+            raise NotificationError(str(e)) from e
+
+
+class FileProvider(Provider):
+    """Local stand-in writing notifications as JSON lines, for development, tests and
+    benchmarks. latency (seconds) and failure_rate (0-1) simulate a remote provider."""
+
+    def __init__(self, path: str, latency: float = 0.0, failure_rate: float = 0.0):
+        self.path = Path(path)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._lock = threading.Lock()
+
+    def send(self, address: str, subject: Optional[str], body: str):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise NotificationError("Échec simulé")
+        line = json.dumps({
+            'sent_at': datetime.now().isoformat(),
+            'address': address,
+            'subject': subject,
+            'body': body
+        }, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+
+def _file_provider(channel: str) -> FileProvider:
+    return FileProvider(
+        os.getenv('NOTIFY_FILE_PATH', f'notifications_{channel}.jsonl'),
+        latency=float(os.getenv('NOTIFY_FILE_LATENCY', '0')),
+        failure_rate=float(os.getenv('NOTIFY_FILE_FAILURE_RATE', '0'))
+    )
+
+
+def get_provider(channel: str) -> Provider:
+    """Provider configured for a channel. EMAIL_PROVIDER / SMS_PROVIDER select it
+    explicitly ('smtp', 'twilio' or 'file'); otherwise the real provider is used
+    when its credentials are set, and the file stand-in when they are not."""
+    if channel == 'email':
+        name = os.getenv('EMAIL_PROVIDER') or ('smtp' if os.getenv('SMTP_HOST') else 'file')
+        if name == 'smtp':
+            return SmtpEmailProvider(
+                os.getenv('SMTP_HOST'),
+                int(os.getenv('SMTP_PORT', '587')),
+                os.getenv('SMTP_USER'),
+                os.getenv('SMTP_PASSWORD'),
+                os.getenv('SMTP_FROM'),
+                os.getenv('SMTP_TLS', '1') == '1'
+            )
+    elif channel == 'sms':
+        name = os.getenv('SMS_PROVIDER') or ('twilio' if os.getenv('TWILIO_ACCOUNT_SID') else 'file')
+        if name == 'twilio':
+            return TwilioSmsProvider(
+                os.getenv('TWILIO_ACCOUNT_SID'),
+                os.getenv('TWILIO_AUTH_TOKEN'),
+                os.getenv('TWILIO_FROM_NUMBER')
+            )
+    else:
+        raise ValueError(f"Canal de notification inconnu: {channel}")
+
+    if name == 'file':
+        return _file_provider(channel)
+    raise ValueError(f"Fournisseur de notification inconnu pour {channel}: {name}")
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing `rate` calls per second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter, in seconds, after the given number of attempts."""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class Dispatcher:
+    """Background thread sending the outbox concurrently. Rows are claimed with
+    FOR UPDATE SKIP LOCKED so that several server processes can run one each."""
+
+    def __init__(self, providers: Dict[str, Provider] = None, max_workers: int = MAX_WORKERS,
+                 batch_size: int = BATCH_SIZE):
+        self._providers = providers or {}
+        self._providers_lock = threading.Lock()
+        self._limiters = {channel: RateLimiter(rate) for channel, rate in RATE_LIMITS.items()}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="notify")
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="notify-dispatcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._executor.shutdown()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _provider(self, channel: str) -> Provider:
+        with self._providers_lock:
+            if channel not in self._providers:
+                self._providers[channel] = get_provider(channel)
+            return self._providers[channel]
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            try:
+                while self.dispatch_once():
+                    pass
+            except Exception:
+                logger.exception("Notification dispatch failed")
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def dispatch_once(self) -> int:
+        """Send one batch of due notifications. Returns the number of rows processed."""
+        batch = _claim(self.batch_size)
+        if not batch:
+            return 0
+        results = list(self._executor.map(self._send, batch))
+        _record(results)
+        return len(batch)
+
+    def _send(self, row: tuple) -> tuple:
+        outbox_id, channel, address, subject, body, attempts = row
+        try:
+            self._limiters[channel].acquire()
+            self._provider(channel).send(address, subject, body)
+            return outbox_id, 'sent', None, 0
+        except Exception as e:
+            logger.warning(f"Notification {outbox_id} ({channel}) failed: {e}")
+            if attempts >= MAX_ATTEMPTS:
+                return outbox_id, 'failed', str(e), 0
+            return outbox_id, 'pending', str(e), retry_delay(attempts)
+
+
+def _claim(limit: int) -> List[tuple]:
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE outbox o
+            SET status = 'sending', attempts = o.attempts + 1, claimed_at = CURRENT_TIMESTAMP
+            WHERE o.id IN (
+                SELECT id
+                FROM outbox
+                WHERE (status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP)
+                   OR (status = 'sending' AND claimed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING o.id, o.channel, o.address, o.subject, o.body, o.attempts
+        """, (CLAIM_TIMEOUT, limit))
+        rows = cur.fetchall()
+        conn.commit()
+        return rows
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _record(results: List[tuple]):
+    """Persist the outcome of a batch in one statement.
+    results: list of (outbox_id, status, error, retry delay in seconds)"""
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        execute_values(cur, """
+            UPDATE outbox o
+            SET status = v.status,
+                last_error = v.error,
+                sent_at = CASE WHEN v.status = 'sent' THEN CURRENT_TIMESTAMP END,
+                next_attempt_at = CURRENT_TIMESTAMP + v.delay * INTERVAL '1 second',
+                claimed_at = NULL
+            FROM (VALUES %s) AS v (id, status, error, delay)
+            WHERE o.id = v.id
+        """, results, template="(%s, %s, %s, %s::FLOAT)", page_size=len(results))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def enqueue(cur, message_ids: List[int]) -> int:
+    """Queue email/SMS notifications for the recipients of delivered messages who
+    opted in. Runs on the caller's cursor, in the same transaction as the delivery."""
+    cur.execute("""
+        INSERT INTO outbox (message_id, recipient_id, channel, address, subject, body)
+        SELECT m.id, u.id, c.channel,
+               CASE c.channel WHEN 'email' THEN u.email ELSE u.phone END,
+               m.subject, m.body
+        FROM messages m
+        JOIN message_recipients mr ON mr.message_id = m.id
+        JOIN users u ON u.id = mr.recipient_id
+        CROSS JOIN (VALUES ('email'), ('sms')) AS c (channel)
+        WHERE m.id = ANY(%s)
+          AND ((c.channel = 'email' AND u.notify_email AND u.email <> '')
+               OR (c.channel = 'sms' AND u.notify_sms AND COALESCE(u.phone, '') <> ''))
+        ON CONFLICT DO NOTHING
+    """, (list(message_ids),))
+    return cur.rowcount
+
+
+def retry_failed() -> int:
+    """Put failed notifications back in the queue."""
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE outbox
+            SET status = 'pending', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP
+            WHERE status = 'failed'
+        """)
+        count = cur.rowcount
+        conn.commit()
+        if count:
+            wake()
+        return count
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    """Outbox row counts per channel and status."""
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT channel, status, COUNT(*)
+            FROM outbox
+            GROUP BY channel, status
+        """)
+        stats = {channel: {} for channel in CHANNELS}
+        for channel, status, count in cur.fetchall():
+            stats[channel][status] = count
+        return stats
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_delivery_status(message_id: int) -> List[tuple]:
+    """Per-recipient notification status of a message: (name, channel, status, attempts, error)."""
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT u.name, o.channel, o.status, o.attempts, o.last_error
+            FROM outbox o
+            JOIN users u ON u.id = o.recipient_id
+            WHERE o.message_id = %s
+            ORDER BY u.name, o.channel
+        """, (message_id,))
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+_dispatcher: Optional[Dispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def start() -> Dispatcher:
+    """Process-wide dispatcher, shared by every Streamlit session."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher()
+            _dispatcher.start()
+        return _dispatcher
+
+
+def wake():
+    """Ask the dispatcher to look at the outbox now rather than at its next poll."""
+    start().wake()
@@ -0,0 +1,179 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Optional
+import database
+from models import Activity
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PATH = os.getenv('CHECKIN_QUEUE_PATH', 'checkin_queue.sqlite3')
+FLUSH_BATCH_SIZE = int(os.getenv('CHECKIN_FLUSH_BATCH_SIZE', '500'))
+FLUSH_INTERVAL = float(os.getenv('CHECKIN_FLUSH_INTERVAL', '15'))  # seconds
+
+_flusher: Optional[threading.Thread] = None
+_flusher_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(QUEUE_PATH, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pending_checkins (
+            activity_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            is_entry INTEGER NOT NULL,
+            at TEXT NOT NULL,
+            queued_at TEXT NOT NULL,
+            PRIMARY KEY (activity_id, user_id, is_entry)
+        )
+    """)
+    # Check-ins rejected by the database itself, kept aside so they never block the queue
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rejected_checkins (
+            activity_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            is_entry INTEGER NOT NULL,
+            at TEXT NOT NULL,
+            error TEXT,
+            rejected_at TEXT NOT NULL
+        )
+    """)
+    return conn
+
+
+def enqueue(activity_id: int, user_id: int, is_entry: bool = True, at: datetime = None):
+    """Buffer a check-in on local disk until PostgreSQL is reachable. One row per
+    (activity, user, direction): the first entry and the last exit are kept, the same
+    rule as Activity.record_attendance."""
+    at = (at or datetime.now()).isoformat(sep=' ')
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(f"""
+                INSERT INTO pending_checkins (activity_id, user_id, is_entry, at, queued_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (activity_id, user_id, is_entry) DO UPDATE
+                SET at = {'MIN' if is_entry else 'MAX'}(at, excluded.at)
+            """, (activity_id, user_id, int(is_entry), at, datetime.now().isoformat(sep=' ')))
+    finally:
+        conn.close()
+    start()
+
+
+def pending_count(table: str = 'pending_checkins') -> int:
+    if not os.path.exists(QUEUE_PATH):
+        return 0
+    conn = _connect()
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def rejected_count() -> int:
+    return pending_count('rejected_checkins')
+
+
+def _write(rows) -> None:
+    Activity.bulk_record_attendance([
+        (activity_id, user_id, bool(is_entry), datetime.fromisoformat(at))
+        for activity_id, user_id, is_entry, at in rows
+    ])
+
+
+def _write_one_by_one(conn: sqlite3.Connection, rows) -> None:
+    """Write the rows of a rejected batch separately, setting aside the ones the
+    database rejects. Connection errors propagate: the rows stay queued."""
+    for row in rows:
+        try:
+            _write([row])
+        except Exception as e:
+            if database.is_connection_error(e):
+                raise
+            logger.error(f"Buffered check-in {row} rejected by the database: {e}")
+            with conn:
+                conn.execute("""
+                    INSERT INTO rejected_checkins (activity_id, user_id, is_entry, at, error, rejected_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (*row, str(e), datetime.now().isoformat(sep=' ')))
+        with conn:
+            conn.execute("""
+                DELETE FROM pending_checkins
+                WHERE activity_id = ? AND user_id = ? AND is_entry = ? AND at = ?
+            """, row)
+
+
+def flush(batch_size: int = FLUSH_BATCH_SIZE) -> int:
+    """Send the buffered check-ins to PostgreSQL in batches of idempotent upserts.
+    Stops when the database is unreachable, leaving the remaining rows queued; rows
+    the database rejects are moved to rejected_checkins.
+    Returns the number of check-ins taken out of the queue."""
+    flushed = 0
+    with _flush_lock:
+        conn = _connect()
+        try:
+            while True:
+                rows = conn.execute("""
+                    SELECT activity_id, user_id, is_entry, at
+                    FROM pending_checkins
+                    ORDER BY queued_at
+                    LIMIT ?
+                """, (batch_size,)).fetchall()
+                if not rows:
+                    break
+                try:
+                    _write(rows)
+                except Exception as e:
+                    if database.is_connection_error(e):
+                        logger.warning(f"Check-in queue flush failed, {len(rows)} kept: {e}")
+                        break
+                    # Rejected batch: isolate the faulty rows instead of retrying it forever
+                    logger.warning(f"Check-in batch rejected, writing rows separately: {e}")
+                    try:
+                        _write_one_by_one(conn, rows)
+                    except Exception as e:
+                        logger.warning(f"Check-in queue flush failed: {e}")
+                        break
+                    flushed += len(rows)
+                    continue
+                # Upserts are idempotent: a crash before this delete only replays the batch
+                with conn:
+                    conn.executemany("""
+                        DELETE FROM pending_checkins
+                        WHERE activity_id = ? AND user_id = ? AND is_entry = ? AND at = ?
+                    """, rows)
+                flushed += len(rows)
+        finally:
+            conn.close()
+    return flushed
+
+
+def _loop():
+    while True:
+        _wakeup.wait(FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            if pending_count():
+                if count := flush():
+                    logger.info(f"{count} buffered check-in(s) flushed")
+        except Exception:
+            logger.exception("Check-in queue flush failed")
+
+
+def start():
+    """Start the background flusher of this process, if not running yet."""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_loop, name="checkin-flush", daemon=True)
+            _flusher.start()
+
+
+def flush_soon():
+    start()
+    _wakeup.set()
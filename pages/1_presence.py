@@ -1,17 +1,97 @@
 import streamlit as st
 from models import User, Activity
 from datetime import datetime, date
-from utils import generate_qr_code
+from utils import QR_FORMATS, qr_code_bytes, show_unread_messages
 import database
-import cv2
-from pyzbar.pyzbar import decode
-import numpy as np
+import jobs
+import offline_queue
+import qr_tokens
+import time
+from kiosk import Kiosk, Roster, get_writer
+from qr_decoder import decode_qr, image_from_bytes
+from qr_sheets import SHEETS
+
+KIOSK_STATUS = {
+    'queued': "⏳ en cours",
+    'recorded': "✅ présence enregistrée",
+    'already': "☑️ déjà enregistré",
+    'unknown': "❓ cadet inconnu",
+    'offline': "📡 enregistré hors ligne",
+    'failed': "⚠️ erreur d'enregistrement"
+}
 
 def check_authentication():
     if 'user' not in st.session_state or st.session_state.user is None:
         st.error("Veuillez vous connecter")
         st.stop()
 
+def record_scan(activity_id, user_id, is_entry):
+    """Enregistre une entrée/sortie ; si la base est injoignable, la présence est
+    conservée localement et synchronisée dès le retour de la connexion."""
+    label = "Entrée" if is_entry else "Sortie"
+    try:
+        # Le QR code signé a déjà été vérifié : un seul aller-retour avec la base
+        recorded = Activity.bulk_record_attendance([(activity_id, user_id, is_entry, datetime.now())])
+    except Exception as e:
+        if not database.is_connection_error(e):
+            st.error(f"Erreur lors de l'enregistrement: {str(e)}")
+            return
+        recorded = None
+    if recorded == 0:
+        st.error("Activité non trouvée")
+        return
+    if recorded:
+        st.success(f"{label} enregistrée avec succès!")
+    else:
+        offline_queue.enqueue(activity_id, user_id, is_entry)
+        st.warning(f"Connexion à la base de données indisponible : {label.lower()} enregistrée "
+                   "sur cet appareil, elle sera synchronisée automatiquement.")
+    st.session_state.camera_active = False
+
+def display_pending_checkins():
+    if rejected := offline_queue.rejected_count():
+        st.error(f"{rejected} présence(s) enregistrée(s) hors ligne refusée(s) par la base de données "
+                 "(voir les journaux du serveur)")
+    pending = offline_queue.pending_count()
+    if pending:
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.warning(f"📡 {pending} présence(s) en attente de synchronisation")
+        with col2:
+            if st.button("Synchroniser"):
+                flushed = offline_queue.flush()
+                if flushed:
+                    st.success(f"{flushed} présence(s) synchronisée(s)")
+                else:
+                    st.error("Base de données toujours injoignable")
+
+def display_sheets(user):
+    """Planches de QR codes à imprimer, générées en arrière-plan."""
+    st.markdown("### Planches à imprimer")
+    col1, col2 = st.columns(2)
+    for column, (sheet, (label, _, _)) in zip((col1, col2), SHEETS.items()):
+        with column:
+            if st.button(label, key=f"sheet_{sheet}"):
+                jobs.submit('qr_sheet', {'sheet': sheet}, user.id)
+                st.success("Génération lancée en arrière-plan")
+
+    sheet_jobs = [job for job in jobs.Job.get_for_user(user.id) if job.job_type == 'qr_sheet'][:5]
+    if any(job.status in ('queued', 'running') for job in sheet_jobs):
+        st.button("Rafraîchir", key="refresh_sheets")
+    for job in sheet_jobs:
+        label = SHEETS.get(job.params.get('sheet'), (job.job_type,))[0]
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            st.write(f"**{label}** ({job.created_at.strftime('%d/%m/%Y %H:%M')})")
+            if job.status == 'running':
+                st.progress(job.progress, job.message)
+            elif job.status == 'failed':
+                st.caption(f"❌ {job.error}")
+        with col2:
+            if job.status == 'done' and (content := job.read_result()) is not None:
+                st.download_button("Télécharger le PDF", content, job.result_name,
+                                   "application/pdf", key=f"download_sheet_{job.id}")
+
 def scan_qr_code():
     """Fonction pour scanner les QR codes via la caméra web"""
     if 'camera_active' not in st.session_state:
@@ -24,30 +104,20 @@ def scan_qr_code():
         img_file_buffer = st.camera_input("Scanner un QR code")
         if img_file_buffer is not None:
             try:
-                bytes_data = img_file_buffer.getvalue()
-                cv2_img = cv2.imdecode(np.frombuffer(bytes_data, np.uint8), cv2.IMREAD_COLOR)
-                qr_codes = decode(cv2_img)
+                result = decode_qr(image_from_bytes(img_file_buffer.getvalue()))
+                if st.session_state.user.status == 'administration':
+                    st.caption(f"Décodage : {result.strategy or 'échec'} en {result.total_ms:.0f} ms ("
+                               + ", ".join(f"{stage} {ms:.0f} ms" for stage, ms in result.timings.items()) + ")")
 
-                if qr_codes:
-                    for qr_code in qr_codes:
-                        data = qr_code.data.decode('utf-8')
+                if result.payloads:
+                    for data in result.payloads:
                         try:
-                            qr_type, activity_id, date_str = data.split('_')
-                            activity = Activity.get_by_id(int(activity_id))
-
-                            if activity:
-                                if qr_type == "entry":
-                                    if activity.record_attendance(st.session_state.user.id, is_entry=True):
-                                        st.success("Entrée enregistrée avec succès!")
-                                        st.session_state.camera_active = False
-                                elif qr_type == "exit":
-                                    if activity.record_attendance(st.session_state.user.id, is_entry=False):
-                                        st.success("Sortie enregistrée avec succès!")
-                                        st.session_state.camera_active = False
-                            else:
-                                st.error("Activité non trouvée")
-                        except ValueError:
-                            st.error("Format du QR code invalide")
+                            token = qr_tokens.verify(data)
+                            if token.kind not in ("entry", "exit"):
+                                raise qr_tokens.InvalidToken("Ce QR code n'est pas un code d'activité")
+                            record_scan(token.subject_id, st.session_state.user.id, token.kind == "entry")
+                        except qr_tokens.InvalidToken as e:
+                            st.error(str(e))
                         except Exception as e:
                             st.error(f"Erreur lors du scan: {str(e)}")
                 else:
@@ -55,11 +125,79 @@ def scan_qr_code():
             except Exception as e:
                 st.error(f"Erreur lors du traitement de l'image: {str(e)}")
 
+def display_kiosk_events(kiosk):
+    events = kiosk.snapshot()
+    recorded = sum(1 for event in events if event.status == 'recorded')
+    st.write(f"**{recorded}** présence(s) enregistrée(s) parmi les {len(events)} derniers scans"
+             + (f" — {get_writer().pending()} en attente d'écriture" if get_writer().pending() else ""))
+    if kiosk.roster is not None:
+        st.progress(len(kiosk.roster.checked_in) / max(1, len(kiosk.roster.names)),
+                    f"{len(kiosk.roster.checked_in)} / {len(kiosk.roster.names)} cadets présents")
+    for event in events:
+        st.write(f"{event.scanned_at.strftime('%H:%M:%S')} — {event.name or f'#{event.user_id}'} — "
+                 f"{KIOSK_STATUS[event.status]}")
+    if kiosk.rejected:
+        st.caption(f"{kiosk.rejected} QR code(s) refusé(s) (badge invalide ou expiré)")
+
+def kiosk_mode(activities):
+    """Scan des badges : un encadrant (ou une borne d'accueil) scanne à la suite les
+    badges QR signés des cadets pour l'activité choisie. La caméra reste active et
+    décode en continu ; la liste des cadets est chargée une fois par activité pour
+    afficher les noms sans interroger la base, un même badge n'est compté qu'une
+    fois par fenêtre de temps et les présences sont écrites en arrière-plan."""
+    activity = st.selectbox(
+        "Activité",
+        activities,
+        format_func=lambda x: f"{x.name} ({x.date.strftime('%d/%m/%Y')})",
+        key="kiosk_activity"
+    )
+    if activity is None:
+        return
+    if st.session_state.get("kiosk") is None or st.session_state.kiosk.activity_id != activity.id:
+        st.session_state.kiosk = Kiosk(activity.id, roster=Roster.load(activity))
+    kiosk = st.session_state.kiosk
+    if st.button("Recharger la liste des cadets", key="reload_roster"):
+        kiosk.roster = Roster.load(activity)
+
+    try:
+        from streamlit_webrtc import webrtc_streamer
+    except ImportError:
+        webrtc_streamer = None
+
+    if webrtc_streamer is not None:
+        def process_frame(frame):
+            kiosk.handle(decode_qr(frame.to_ndarray(format="gray")).payloads)
+            return frame
+
+        ctx = webrtc_streamer(
+            key=f"kiosk_{activity.id}",
+            video_frame_callback=process_frame,
+            media_stream_constraints={"video": True, "audio": False},
+            async_processing=True
+        )
+        events_placeholder = st.empty()
+        while ctx.state.playing:
+            with events_placeholder.container():
+                display_kiosk_events(kiosk)
+            time.sleep(0.5)
+        with events_placeholder.container():
+            display_kiosk_events(kiosk)
+    else:
+        # Sans streamlit-webrtc : une photo par cadet, mais la caméra reste active
+        st.info("Décodage continu indisponible (paquet streamlit-webrtc manquant) : "
+                "prenez une photo pour chaque cadet.")
+        img_file_buffer = st.camera_input("Scanner un badge", key=f"kiosk_camera_{activity.id}")
+        if img_file_buffer is not None:
+            kiosk.handle(decode_qr(image_from_bytes(img_file_buffer.getvalue())).payloads)
+        display_kiosk_events(kiosk)
+
 def main():
     check_authentication()
+    show_unread_messages(st.session_state.user)
     user = st.session_state.user
 
     st.title("Gestion des Présences")
+    display_pending_checkins()
 
     # Créer les onglets principaux
     tab_scanner, tab_admin = st.tabs(["Scanner un QR Code", "Administration"])
@@ -78,7 +216,7 @@ def main():
     with tab_admin:
         if user.has_permission('manage_attendance'):
             st.subheader("Administration des Présences")
-            admin_tab1, admin_tab2 = st.tabs(["Générer QR Codes", "Gestion Manuelle"])
+            admin_tab1, admin_tab2, admin_tab3 = st.tabs(["Générer QR Codes", "Gestion Manuelle", "Scanner les badges"])
 
             with admin_tab1:
                 st.markdown("### Générer QR Codes")
@@ -92,34 +230,41 @@ def main():
                     )
 
                     if selected_activity:
-                        entry_data = f"entry_{selected_activity.id}_{datetime.now().strftime('%Y%m%d')}"
-                        entry_qr = generate_qr_code(entry_data)
+                        # Jetons déterministes : les images sont servies par le cache de utils
+                        entry_data = qr_tokens.activity_token(selected_activity, "entry")
+                        exit_data = qr_tokens.activity_token(selected_activity, "exit")
                         st.markdown("### QR Code d'entrée")
-                        st.markdown(f'<img src="data:image/png;base64,{entry_qr}" style="width:300px">', unsafe_allow_html=True)
-
-                        exit_data = f"exit_{selected_activity.id}_{datetime.now().strftime('%Y%m%d')}"
-                        exit_qr = generate_qr_code(exit_data)
+                        st.image(qr_code_bytes(entry_data), width=300)
                         st.markdown("### QR Code de sortie")
-                        st.markdown(f'<img src="data:image/png;base64,{exit_qr}" style="width:300px">', unsafe_allow_html=True)
+                        st.image(qr_code_bytes(exit_data), width=300)
 
+                        valid_from, valid_until = qr_tokens.activity_window(selected_activity)
+                        st.caption(f"QR codes signés, valables du {valid_from.strftime('%d/%m/%Y %H:%M')} "
+                                   f"au {valid_until.strftime('%d/%m/%Y %H:%M')}")
+
+                        file_format = st.radio("Format", list(QR_FORMATS), horizontal=True,
+                                               help="SVG : vectoriel, net à toutes les tailles d'impression")
+                        suffix = f"{selected_activity.name}_{selected_activity.date.strftime('%Y%m%d')}.{file_format.lower()}"
                         col1, col2 = st.columns(2)
                         with col1:
                             st.download_button(
                                 "Télécharger QR Code Entrée",
-                                entry_qr,
-                                file_name=f"qr_entree_{selected_activity.name}_{datetime.now().strftime('%Y%m%d')}.png",
-                                mime="image/png"
+                                qr_code_bytes(entry_data, format=file_format),
+                                file_name=f"qr_entree_{suffix}",
+                                mime=QR_FORMATS[file_format]
                             )
                         with col2:
                             st.download_button(
                                 "Télécharger QR Code Sortie",
-                                exit_qr,
-                                file_name=f"qr_sortie_{selected_activity.name}_{datetime.now().strftime('%Y%m%d')}.png",
-                                mime="image/png"
+                                qr_code_bytes(exit_data, format=file_format),
+                                file_name=f"qr_sortie_{suffix}",
+                                mime=QR_FORMATS[file_format]
                             )
                 else:
                     st.warning("Aucune activité n'est disponible")
 
+                display_sheets(user)
+
             with admin_tab2:
                 st.markdown("### Gestion Manuelle")
                 activities = Activity.get_all()
@@ -141,11 +286,13 @@ def main():
                                 with st.expander(f"{attendance['name']} ({attendance['status']})"):
                                     st.write(f"**Entrée:** {attendance['entry_time'].strftime('%d/%m/%Y %H:%M') if attendance['entry_time'] else 'Non enregistrée'}")
                                     st.write(f"**Sortie:** {attendance['exit_time'].strftime('%d/%m/%Y %H:%M') if attendance['exit_time'] else 'Non enregistrée'}")
+                                    if attendance['duration_minutes'] is not None:
+                                        st.write(f"**Durée:** {attendance['duration_minutes'] // 60} h {attendance['duration_minutes'] % 60:02d}")
 
                                     col1, col2 = st.columns(2)
                                     with col1:
                                         if st.button("Modifier entrée", key=f"entry_{attendance['user_id']}"):
-                                            if selected_activity.record_attendance(attendance['user_id'], is_entry=True):
+                                            if selected_activity.record_attendance(attendance['user_id'], is_entry=True, overwrite=True):
                                                 st.success("Entrée mise à jour")
                                                 st.rerun()
                                     with col2:
@@ -172,7 +319,7 @@ def main():
 
                             if st.form_submit_button("Enregistrer"):
                                 if action == "Marquer l'entrée":
-                                    if selected_activity.record_attendance(selected_user.id, is_entry=True):
+                                    if selected_activity.record_attendance(selected_user.id, is_entry=True, overwrite=True):
                                         st.success(f"Entrée enregistrée pour {selected_user.name}")
                                         st.rerun()
                                 else:
@@ -181,6 +328,14 @@ def main():
                                         st.rerun()
                 else:
                     st.warning("Aucune activité n'est disponible")
+
+            with admin_tab3:
+                st.markdown("### Scanner les badges des cadets")
+                activities = Activity.get_all()
+                if activities:
+                    kiosk_mode(activities)
+                else:
+                    st.warning("Aucune activité n'est disponible")
         else:
             st.warning("Vous n'avez pas les permissions nécessaires pour accéder à cette section")
 
@@ -1,6 +1,7 @@
 import streamlit as st
 from models import Activity, Inventory
 from datetime import datetime, time
+from utils import show_unread_messages
 
 def check_authentication():
     if 'user' not in st.session_state or st.session_state.user is None:
@@ -9,6 +10,7 @@ def check_authentication():
 
 def main():
     check_authentication()
+    show_unread_messages(st.session_state.user)
 
     st.title("Gestion des Activités")
 
@@ -1,5 +1,6 @@
 import streamlit as st
 from models import Inventory, InventoryCategory, CategoryField, User, EquipmentAssignment, EquipmentRequest
+from utils import show_unread_messages
 
 def check_authentication():
     if 'user' not in st.session_state or st.session_state.user is None:
@@ -8,6 +9,7 @@ def check_authentication():
 
 def main():
     check_authentication()
+    show_unread_messages(st.session_state.user)
 
     st.title("Gestion des Stocks")
     user = st.session_state.user
@@ -1,6 +1,14 @@
 import streamlit as st
-from models import User
-from datetime import datetime
+import pandas as pd
+import notifications
+from models import Message
+from datetime import datetime, timedelta
+from utils import show_unread_messages
+
+MESSAGES_PAGE_SIZE = 20
+MODERATION_PAGE_SIZE = 100
+RECIPIENT_SEARCH_MIN_LENGTH = 2
+STATUS_LABELS = {'pending': "⏳ En attente de validation", 'approved': "✅ Envoyé", 'rejected': "❌ Rejeté"}
 
 def check_authentication():
     if 'user' not in st.session_state or st.session_state.user is None:
@@ -8,70 +16,305 @@ def check_authentication():
         st.stop()
     return True
 
+def paginate(key, fetch, cursor=lambda msg: (msg.created_at, msg.id)):
+    """Pagine une liste de messages par curseur, (created_at, id) par défaut.
+    fetch(limit, before) retourne les messages de la page."""
+    state_key = f"messages_cursors_{key}"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = [None]
+    cursors = st.session_state[state_key]
+
+    messages = fetch(MESSAGES_PAGE_SIZE + 1, cursors[-1])
+    has_more = len(messages) > MESSAGES_PAGE_SIZE
+    messages = messages[:MESSAGES_PAGE_SIZE]
+
+    def navigation():
+        col1, col2 = st.columns(2)
+        with col1:
+            if len(cursors) > 1 and st.button("← Messages plus récents", key=f"messages_prev_{key}"):
+                cursors.pop()
+                st.rerun()
+        with col2:
+            if has_more and st.button("Messages plus anciens →", key=f"messages_next_{key}"):
+                cursors.append(cursor(messages[-1]))
+                st.rerun()
+
+    return messages, navigation
+
+def display_compose(user):
+    """Destinataires choisis par recherche sur le nom (et non plus dans la liste complète
+    des utilisateurs) ou par groupe, résolu au moment de l'envoi."""
+    selected = st.session_state.setdefault("message_recipients", {})
+
+    query = st.text_input("Rechercher un destinataire", placeholder="Début du nom",
+                          key="recipient_search")
+    if len(query.strip()) >= RECIPIENT_SEARCH_MIN_LENGTH:
+        matches = [r for r in user.search_recipients(query) if r.id not in selected]
+        if not matches:
+            st.caption("Aucun destinataire trouvé")
+        for recipient in matches:
+            if st.button(f"➕ {recipient.name} ({recipient.status})", key=f"add_recipient_{recipient.id}"):
+                selected[recipient.id] = f"{recipient.name} ({recipient.status})"
+                st.rerun()
+
+    if selected:
+        st.write("**Destinataires sélectionnés :**")
+        for recipient_id, label in list(selected.items()):
+            if st.button(f"✖ {label}", key=f"remove_recipient_{recipient_id}"):
+                del selected[recipient_id]
+                st.rerun()
+
+    groups = dict(user.get_recipient_groups())
+    with st.form("new_message", clear_on_submit=True):
+        selected_groups = st.multiselect(
+            "Groupes",
+            options=list(groups),
+            format_func=lambda g: groups[g]
+        )
+        subject = st.text_input("Sujet")
+        content = st.text_area("Message")
+
+        if st.form_submit_button("Envoyer"):
+            try:
+                moderated = Message.requires_moderation(user)
+                _, count = Message.send(user.id, list(selected), subject, content,
+                                        moderated=moderated, groups=selected_groups)
+                selected.clear()
+                st.session_state["messages_cursors_sent"] = [None]
+                if moderated:
+                    st.info(f"Message pour {count} destinataire(s) envoyé pour validation")
+                else:
+                    st.success(f"Message envoyé à {count} destinataire(s)!")
+            except ValueError as e:
+                st.error(str(e))
+            except Exception as e:
+                st.error(f"Erreur lors de l'envoi du message: {str(e)}")
+
+def display_inbox(user):
+    unread_only = st.checkbox("Non lus uniquement", key="inbox_unread_only")
+    if st.session_state.get("inbox_filter") != unread_only:
+        st.session_state["inbox_filter"] = unread_only
+        st.session_state["messages_cursors_inbox"] = [None]
+
+    messages, navigation = paginate(
+        "inbox",
+        lambda limit, before: Message.get_inbox(user.id, limit=limit, before=before,
+                                                unread_only=unread_only)
+    )
+
+    if not messages:
+        st.info("Aucun message")
+        return
+
+    if st.button("Tout marquer comme lu"):
+        Message.mark_read(user.id)
+        st.rerun()
+
+    for msg in messages:
+        marker = "" if msg.is_read else "🔵 "
+        with st.expander(f"{marker}{msg.subject} - {msg.created_at.strftime('%d/%m/%Y %H:%M')}"):
+            st.write(f"De: {msg.sender_name or 'Utilisateur supprimé'}")
+            st.write(msg.body)
+            if not msg.is_read:
+                if st.button("Marquer comme lu", key=f"read_{msg.id}"):
+                    Message.mark_read(user.id, [msg.id])
+                    st.rerun()
+
+    navigation()
+
+def display_sent(user):
+    messages, navigation = paginate(
+        "sent",
+        lambda limit, before: Message.get_sent(user.id, limit=limit, before=before)
+    )
+
+    if not messages:
+        st.info("Aucun message envoyé")
+        return
+
+    for msg in messages:
+        with st.expander(f"{msg.subject} - {msg.created_at.strftime('%d/%m/%Y %H:%M')}"):
+            st.write(f"Statut: {STATUS_LABELS.get(msg.status, msg.status)}")
+            st.write(f"Destinataires: {msg.recipient_count}")
+            st.write(msg.body)
+            if msg.status == 'approved' and st.checkbox("Suivi des notifications", key=f"delivery_{msg.id}"):
+                delivery = notifications.get_delivery_status(msg.id)
+                if delivery:
+                    st.dataframe(
+                        pd.DataFrame(delivery, columns=["Destinataire", "Canal", "Statut", "Tentatives", "Erreur"]),
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                else:
+                    st.info("Aucun destinataire n'a demandé de notification")
+
+    navigation()
+
+def display_search(user):
+    """Recherche plein texte dans les messages reçus et envoyés, classée par pertinence."""
+    query = st.text_input("Rechercher dans les messages", key="message_search",
+                          placeholder='ex. sortie "tenue de sport" -annulée')
+    if st.session_state.get("message_search_filter") != query:
+        st.session_state["message_search_filter"] = query
+        st.session_state["messages_cursors_search"] = [None]
+    if not query.strip():
+        return
+
+    messages, navigation = paginate(
+        "search",
+        lambda limit, before: Message.search(user.id, query, limit=limit, before=before),
+        cursor=lambda msg: (msg.rank, msg.id)
+    )
+    if not messages:
+        st.info("Aucun message ne correspond à cette recherche")
+        return
+
+    for msg in messages:
+        sent = msg.sender_id == user.id
+        with st.expander(f"{msg.subject} - {msg.created_at.strftime('%d/%m/%Y %H:%M')}"
+                         + (" (envoyé)" if sent else "")):
+            st.markdown(msg.headline)
+            if st.checkbox("Afficher le message complet", key=f"search_full_{msg.id}"):
+                st.write(f"De: {msg.sender_name or 'Utilisateur supprimé'}")
+                st.write(msg.body)
+
+    navigation()
+
+def display_moderation(user):
+    """File de modération : sélection multiple, validée ou rejetée en une seule requête."""
+    if result := st.session_state.pop("moderation_result", None):
+        st.success(result)
+
+    senders = Message.get_pending_senders()
+    if not senders:
+        st.info("Aucun message en attente de validation")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        sender = st.selectbox(
+            "Expéditeur",
+            options=[None] + senders,
+            format_func=lambda s: "Tous" if s is None else f"{s[1]} ({s[2]})"
+        )
+    with col2:
+        date_filter = st.date_input(
+            "Période",
+            value=(datetime.now() - timedelta(days=30), datetime.now()),
+            key="moderation_period"
+        )
+    if len(date_filter) != 2:
+        return
+    start_date, end_date = date_filter
+
+    # Pile des curseurs de pagination, réinitialisée quand les filtres changent
+    filter_signature = (sender[0] if sender else None, start_date, end_date)
+    if st.session_state.get("moderation_filter") != filter_signature:
+        st.session_state["moderation_filter"] = filter_signature
+        st.session_state["moderation_cursors"] = [None]
+    cursors = st.session_state["moderation_cursors"]
+
+    messages = Message.get_pending(filter_signature[0], start_date, end_date,
+                                   limit=MODERATION_PAGE_SIZE + 1, after=cursors[-1])
+    has_more = len(messages) > MODERATION_PAGE_SIZE
+    messages = messages[:MODERATION_PAGE_SIZE]
+    if not messages:
+        st.info("Aucun message en attente pour ces critères")
+        return
+
+    select_all = st.checkbox("Tout sélectionner", key="moderation_select_all")
+    queue = pd.DataFrame([
+        {
+            "id": msg.id,
+            "Sélection": select_all,
+            "Date": msg.created_at.strftime('%d/%m/%Y %H:%M'),
+            "Expéditeur": msg.sender_name,
+            "Sujet": msg.subject,
+            "Message": msg.body,
+            "Destinataires": msg.recipient_count
+        }
+        for msg in messages
+    ])
+
+    with st.form("moderation_queue"):
+        edited = st.data_editor(
+            queue,
+            column_config={
+                "id": None,
+                "Sélection": st.column_config.CheckboxColumn("Sélection")
+            },
+            disabled=["Date", "Expéditeur", "Sujet", "Message", "Destinataires"],
+            hide_index=True,
+            use_container_width=True,
+            num_rows="fixed",
+            key=f"moderation_editor_{select_all}"
+        )
+
+        col1, col2 = st.columns(2)
+        with col1:
+            approve = st.form_submit_button("Approuver la sélection")
+        with col2:
+            reject = st.form_submit_button("Rejeter la sélection")
+
+        if approve or reject:
+            selected = [int(row["id"]) for row in edited.to_dict("records") if row["Sélection"]]
+            if not selected:
+                st.warning("Aucun message sélectionné")
+            else:
+                try:
+                    count = Message.moderate(selected, approve, user.id)
+                    st.session_state["moderation_result"] = (
+                        f"{count} message(s) {'approuvé(s) et envoyé(s)' if approve else 'rejeté(s)'}"
+                    )
+                    cursors[:] = [None]
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Erreur lors de la modération: {str(e)}")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1 and st.button("← Page précédente", key="moderation_prev"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if has_more and st.button("Page suivante →", key="moderation_next"):
+            cursors.append((messages[-1].created_at, messages[-1].id))
+            st.rerun()
+
 def main():
     check_authentication()
+    show_unread_messages(st.session_state.user)
     user = st.session_state.user
 
     st.title("Messages et Communications")
 
-    tab1, tab2 = st.tabs(["Nouveau Message", "Boîte de réception"])
+    unread = Message.unread_count(user.id)
+    inbox_label = f"Boîte de réception ({unread})" if unread else "Boîte de réception"
+    tab_labels = ["Nouveau Message", inbox_label, "Messages envoyés", "Recherche"]
+    can_moderate = Message.can_moderate(user)
+    if can_moderate:
+        tab_labels.append("Modération")
+    tabs = st.tabs(tab_labels)
+    tab1, tab2, tab3, tab4 = tabs[:4]
 
     with tab1:
-        with st.form("new_message"):
-            # Get available recipients based on user's status
-            available_recipients = user.get_available_recipients()
-
-            # Create recipient selection with grade and firstname, now using multiselect
-            selected_recipients = st.multiselect(
-                "Destinataires",
-                options=available_recipients,
-                format_func=lambda x: f"{x.name} ({x.status})"  # Simplified format without rank and first_name
-            )
-
-            subject = st.text_input("Sujet")
-            content = st.text_area("Message")
-
-            if st.form_submit_button("Envoyer"):
-                if selected_recipients:
-                    success_count = 0
-                    for recipient in selected_recipients:
-                        if user.has_role('manage_communications'):  # Changed from has_permission
-                            # TODO: Implement actual message sending here
-                            success_count += 1
-
-                    if success_count == len(selected_recipients):
-                        st.success(f"Message envoyé à {len(selected_recipients)} destinataire(s)!")
-                    elif success_count > 0:
-                        st.warning(f"Message envoyé à {success_count}/{len(selected_recipients)} destinataires")
-                    else:
-                        st.info("Messages envoyés pour validation")
-                else:
-                    st.error("Veuillez sélectionner au moins un destinataire")
+        display_compose(user)
 
     with tab2:
         st.subheader("Messages reçus")
+        display_inbox(user)
+
+    with tab3:
+        st.subheader("Messages envoyés")
+        display_sent(user)
+
+    with tab4:
+        display_search(user)
 
-        # TODO: Récupérer les vrais messages depuis la base de données
-        messages = [
-            {
-                "date": "2024-01-19",
-                "sender": "Admin",
-                "subject": "Rappel activité",
-                "content": "N'oubliez pas l'activité de demain!"
-            }
-        ]
-
-        for msg in messages:
-            with st.expander(f"{msg['subject']} - {msg['date']}"):
-                st.write(f"De: {msg['sender']}")
-                st.write(msg['content'])
-
-                if user.has_role('manage_communications'):  # Changed from has_permission
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.button("Approuver", key=f"approve_{msg['subject']}")
-                    with col2:
-                        st.button("Rejeter", key=f"reject_{msg['subject']}")
+    if can_moderate:
+        with tabs[4]:
+            st.subheader("Messages en attente de validation")
+            display_moderation(user)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,11 @@
 import streamlit as st
-from utils import generate_pdf_report
+import jobs
+import mimetypes
+from exports import EXPORTS, EXPORT_FORMATS
+from qr_sheets import SHEETS
+from reports import REPORT_TYPES, generate_report, cache as report_cache
 from datetime import datetime, timedelta
+from utils import show_unread_messages
 
 def check_authentication():
     if 'user' not in st.session_state or st.session_state.user is None:
@@ -12,14 +17,60 @@ def check_authentication():
         st.error("Accès non autorisé. Cette page est réservée au personnel administratif.")
         st.stop()
 
+JOB_STATUS_LABELS = {
+    'queued': "⏳ En attente",
+    'running': "⚙️ En cours",
+    'done': "✅ Terminé",
+    'failed': "❌ Échec"
+}
+
+def display_jobs(user_id):
+    with st.expander("Mes rapports", expanded=True):
+        user_jobs = jobs.Job.get_for_user(user_id, limit=10)
+        if not user_jobs:
+            st.info("Aucun rapport généré récemment")
+            return
+
+        if any(job.status in ('queued', 'running') for job in user_jobs):
+            st.button("Rafraîchir", key="refresh_jobs")
+
+        for job in user_jobs:
+            col1, col2, col3 = st.columns([3, 2, 2])
+            with col1:
+                params = job.params or {}
+                label = (params.get('report_type')
+                         or EXPORTS.get(params.get('export_name'), SHEETS.get(params.get('sheet'), (job.job_type,)))[0])
+                st.write(f"**{label}** "
+                         f"({job.created_at.strftime('%d/%m/%Y %H:%M')})")
+                if job.message:
+                    st.caption(job.message)
+            with col2:
+                st.write(JOB_STATUS_LABELS.get(job.status, job.status))
+                if job.status == 'running':
+                    st.progress(job.progress)
+                elif job.status == 'failed':
+                    st.caption(job.error)
+            with col3:
+                if job.status == 'done' and job.result_name:
+                    content = job.read_result()
+                    if content is not None:
+                        st.download_button(
+                            "Télécharger",
+                            content,
+                            job.result_name,
+                            mimetypes.guess_type(job.result_name)[0] or "application/octet-stream",
+                            key=f"download_job_{job.id}"
+                        )
+
 def main():
     check_authentication()
+    show_unread_messages(st.session_state.user)
     
     st.title("Rapports et Statistiques")
     
     report_type = st.selectbox(
         "Type de rapport",
-        ["Présences", "Activités", "Stocks", "Communications"]
+        REPORT_TYPES
     )
     
     col1, col2 = st.columns(2)
@@ -34,41 +85,81 @@ def main():
             value=datetime.now()
         )
     
-    if st.button("Générer le rapport"):
-        # TODO: Récupérer les vraies données depuis la base de données
-        data = [
-            "Ligne 1 du rapport",
-            "Ligne 2 du rapport",
-            "Ligne 3 du rapport"
-        ]
-        
-        pdf = generate_pdf_report(data, report_type)
-        
-        st.download_button(
-            "Télécharger le rapport PDF",
-            pdf,
-            f"rapport_{report_type}_{datetime.now().strftime('%Y%m%d')}.pdf",
-            "application/pdf"
+    if start_date > end_date:
+        st.error("La date de début doit précéder la date de fin")
+        st.stop()
+
+    try:
+        report = generate_report(report_type, start_date, end_date)
+    except Exception as e:
+        st.error(f"Erreur lors de la génération du rapport: {str(e)}")
+        st.stop()
+
+    if st.session_state.user.status == 'administration':
+        stats = report_cache.stats()
+        st.caption(
+            f"Cache des rapports : {stats['hits']} succès, {stats['misses']} échecs "
+            f"({stats['hit_rate']} %), {stats['entries']}/{stats['max_entries']} entrées"
         )
+
+    if st.button("Générer le rapport"):
+        try:
+            jobs.submit('report_pdf', {
+                'report_type': report_type,
+                'start_date': start_date,
+                'end_date': end_date
+            }, st.session_state.user.id)
+            st.success("Rapport en cours de génération, il apparaîtra dans « Mes rapports »")
+        except Exception as e:
+            st.error(f"Erreur lors du lancement du rapport: {str(e)}")
+
+    user = st.session_state.user
+    if user.status == 'administration' or user.has_permission('view_reports'):
+        with st.expander("Export de données"):
+            col1, col2 = st.columns(2)
+            with col1:
+                export_name = st.selectbox(
+                    "Données",
+                    list(EXPORTS),
+                    format_func=lambda x: EXPORTS[x][0]
+                )
+            with col2:
+                export_format = st.selectbox("Format", EXPORT_FORMATS)
+            if EXPORTS[export_name][3]:
+                st.caption("Les lignes exportées sont filtrées sur la période sélectionnée ci-dessus")
+            if st.button("Exporter"):
+                try:
+                    jobs.submit('export', {
+                        'export_name': export_name,
+                        'format': export_format,
+                        'start_date': start_date,
+                        'end_date': end_date
+                    }, user.id)
+                    st.success("Export en cours, il apparaîtra dans « Mes rapports »")
+                except Exception as e:
+                    st.error(f"Erreur lors du lancement de l'export: {str(e)}")
+
+    display_jobs(user.id)
     
     # Affichage des statistiques
     st.subheader("Statistiques")
     
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("Total présences", "150")
-    with col2:
-        st.metric("Activités réalisées", "12")
-    with col3:
-        st.metric("Messages envoyés", "45")
-    
-    # Graphique exemple
-    chart_data = {
-        'dates': ['2024-01-15', '2024-01-16', '2024-01-17', '2024-01-18', '2024-01-19'],
-        'présences': [25, 30, 28, 32, 35]
-    }
+    metric_cols = st.columns(len(report.metrics))
+    for col, (label, value) in zip(metric_cols, report.metrics):
+        with col:
+            st.metric(label, value)
     
-    st.line_chart(chart_data)
+    if report.chart:
+        st.line_chart(report.chart_data(), x='dates', y=report.chart_label)
+    else:
+        st.info("Aucune donnée sur cette période")
+
+    if report.rows:
+        st.dataframe(
+            [dict(zip(report.columns, row)) for row in report.rows],
+            hide_index=True,
+            use_container_width=True
+        )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,6 +1,10 @@
 import streamlit as st
 from models import User, Role, Permission
-from utils import validate_email
+from utils import validate_email, show_unread_messages
+import jobs
+import notifications
+import qr_tokens
+import reports
 import io
 import csv
 
@@ -23,10 +27,11 @@ def main():
         st.stop()
 
     check_admin()
+    show_unread_messages(st.session_state.user)
 
     st.title("Administration")
 
-    tabs = st.tabs(["Gestion des Utilisateurs", "Import Utilisateurs", "Rôles et Permissions", "Associations Parent-Enfant"])
+    tabs = st.tabs(["Gestion des Utilisateurs", "Import Utilisateurs", "Rôles et Permissions", "Associations Parent-Enfant", "Maintenance"])
 
     with tabs[0]:
         st.subheader("Utilisateurs existants")
@@ -260,5 +265,80 @@ user@example.com,Nom Utilisateur,parent,password123,role1|role2"""
                 else:
                     st.info("Aucun enfant associé")
 
+    with tabs[4]:
+        st.subheader("Points et niveaux")
+        st.write("Les points sont mis à jour automatiquement à chaque présence ou note. "
+                 "Utilisez ce bouton pour les recalculer entièrement.")
+        if st.button("Recalculer les points"):
+            jobs.submit('rebuild_points', {}, st.session_state.user.id)
+            st.success("Recalcul lancé en arrière-plan")
+        if st.button("Réévaluer les badges"):
+            jobs.submit('reevaluate_badges', {}, st.session_state.user.id)
+            st.success("Réévaluation lancée en arrière-plan")
+        if st.button("Recalculer les présences journalières"):
+            jobs.submit('rebuild_attendance_rollup', {}, st.session_state.user.id)
+            st.success("Recalcul lancé en arrière-plan")
+
+        st.subheader("Cache des rapports")
+        stats = reports.cache.stats()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Entrées", f"{stats['entries']}/{stats['max_entries']}")
+        with col2:
+            st.metric("Succès", stats['hits'], help=f"Taux de succès : {stats['hit_rate']} %")
+        with col3:
+            st.metric("Échecs", stats['misses'])
+        with col4:
+            st.metric("Invalidations", stats['invalidations'], help=f"Évictions LRU : {stats['evictions']}")
+        if st.button("Vider le cache des rapports"):
+            reports.cache.clear()
+            st.success("Cache vidé")
+
+        st.subheader("Notifications SMS / email")
+        stats = notifications.get_stats()
+        for channel, label in [('email', "Email"), ('sms', "SMS")]:
+            counts = stats[channel]
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric(f"{label} en attente", counts.get('pending', 0))
+            with col2:
+                st.metric(f"{label} en cours", counts.get('sending', 0))
+            with col3:
+                st.metric(f"{label} envoyés", counts.get('sent', 0))
+            with col4:
+                st.metric(f"{label} en échec", counts.get('failed', 0))
+        if st.button("Relancer les notifications en échec"):
+            count = notifications.retry_failed()
+            st.success(f"{count} notification(s) remise(s) en file d'attente")
+
+        st.subheader("Clés de signature des QR codes")
+        current, accepted = qr_tokens.key_ids()
+        st.write(f"Clé courante : {current} — clés acceptées : {', '.join(map(str, accepted))}")
+        st.caption("Après une rotation, les QR codes déjà imprimés restent valides jusqu'au "
+                   "retrait de l'ancienne clé.")
+        try:
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Générer une nouvelle clé"):
+                    st.success(f"Nouvelle clé {qr_tokens.rotate_key()} utilisée pour les nouveaux QR codes")
+                    st.rerun()
+            with col2:
+                previous = [key_id for key_id in accepted if key_id != current]
+                if previous:
+                    retired = st.selectbox("Clé à retirer", previous)
+                    if st.button("Retirer la clé"):
+                        qr_tokens.retire_key(retired)
+                        st.success(f"Les QR codes signés avec la clé {retired} sont désormais refusés")
+                        st.rerun()
+        except RuntimeError as e:
+            st.error(f"Rotation impossible : {str(e)}")
+
+        st.subheader("Tâches récentes")
+        for job in jobs.Job.get_for_user(st.session_state.user.id, limit=10):
+            status = f"{job.status} ({job.progress}%)" if job.status == 'running' else job.status
+            st.write(f"- {job.created_at.strftime('%d/%m/%Y %H:%M')} — {job.job_type}: {status}"
+                     + (f" — {job.message}" if job.message else "")
+                     + (f" — {job.error}" if job.error else ""))
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,7 +1,10 @@
 import streamlit as st
-from models import User, Badge, EvaluationType
+from models import User, Badge, EvaluationType, Leaderboard
+import analytics
 from datetime import datetime, timedelta
 import plotly.graph_objs as go
+import pandas as pd
+from utils import show_unread_messages
 
 def check_authentication():
     if 'user' not in st.session_state or st.session_state.user is None:
@@ -42,20 +45,229 @@ def create_level_progress_chart(points, level):
 
     return fig
 
+NOTES_PAGE_SIZE = 20
+
+def display_notes(cadet, key, deletable_by=None):
+    """Affiche les notes d'un cadet, filtrées par date et paginées par curseur (date, id)."""
+    date_filter = st.date_input(
+        "Filtrer par date",
+        value=(datetime.now() - timedelta(days=30), datetime.now()),
+        key=f"notes_filter_{key}"
+    )
+    if len(date_filter) != 2:
+        return
+    start_date, end_date = date_filter
+
+    # Pile des curseurs de pagination, réinitialisée quand le filtre ou le cadet change
+    state_key = f"notes_cursors_{key}"
+    filter_signature = (cadet.id, start_date, end_date)
+    if st.session_state.get(f"{state_key}_filter") != filter_signature:
+        st.session_state[f"{state_key}_filter"] = filter_signature
+        st.session_state[state_key] = [None]
+    cursors = st.session_state[state_key]
+
+    notes = cadet.get_notes(start_date, end_date, limit=NOTES_PAGE_SIZE + 1, before=cursors[-1])
+    has_more = len(notes) > NOTES_PAGE_SIZE
+    notes = notes[:NOTES_PAGE_SIZE]
+
+    if not notes:
+        st.info("Aucune note sur cette période")
+
+    for note in notes:
+        with st.expander(f"{note['date'].strftime('%d/%m/%Y')} - {note['type']}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write(f"**Note:** {'⭐' * note['rating']}")
+                st.write(f"**Type:** {note['type']}")
+            with col2:
+                st.write(f"**Évaluateur:** {note['evaluator_name']}")
+                st.write(f"**Date:** {note['date'].strftime('%d/%m/%Y')}")
+            st.write("**Appréciation:**")
+            st.write(note['appreciation'])
+
+            if deletable_by is not None and deletable_by == note['evaluator_id']:
+                if st.button("Supprimer", key=f"delete_note_{note['id']}"):
+                    if cadet.delete_note(note['id']):
+                        st.success("Note supprimée!")
+                        st.rerun()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1 and st.button("← Notes plus récentes", key=f"notes_prev_{key}"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if has_more and st.button("Notes plus anciennes →", key=f"notes_next_{key}"):
+            cursors.append((notes[-1]['date'], notes[-1]['id']))
+            st.rerun()
+
+def display_note_search(user):
+    """Recherche plein texte dans les appréciations visibles par l'utilisateur."""
+    query = st.text_input("Rechercher dans les appréciations", key="note_search",
+                          placeholder='ex. "prise de parole" autonomie')
+    state_key = "note_search_cursors"
+    if st.session_state.get("note_search_filter") != query:
+        st.session_state["note_search_filter"] = query
+        st.session_state[state_key] = [None]
+    if not query.strip():
+        return
+    cursors = st.session_state[state_key]
+
+    results = user.search_notes(query, limit=NOTES_PAGE_SIZE + 1, before=cursors[-1])
+    has_more = len(results) > NOTES_PAGE_SIZE
+    results = results[:NOTES_PAGE_SIZE]
+    if not results:
+        st.info("Aucune appréciation ne correspond à cette recherche")
+        return
+
+    for note in results:
+        st.markdown(f"**{note['user_name']}** — {note['date'].strftime('%d/%m/%Y')} — "
+                    f"{note['type']} ({note['rating']}) — par {note['evaluator_name']}")
+        st.markdown("> " + note['headline'].replace("\n", " "))
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1 and st.button("← Résultats précédents", key="note_search_prev"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if has_more and st.button("Résultats suivants →", key="note_search_next"):
+            cursors.append((results[-1]['rank'], results[-1]['id']))
+            st.rerun()
+
+def display_evaluation_grid(cadets, evaluator):
+    """Grille cadets × types d'évaluation, enregistrée en un seul insert groupé."""
+    eval_types = EvaluationType.get_all()
+    if not cadets or not eval_types:
+        st.info("Aucun cadet ou type d'évaluation disponible")
+        return
+
+    grid = pd.DataFrame({
+        "id": [c.id for c in cadets],
+        "Nom": [c.name for c in cadets],
+        "Statut": [c.status for c in cadets],
+        **{t.name: pd.Series([None] * len(cadets), dtype="Int64") for t in eval_types},
+        "Appréciation": [""] * len(cadets)
+    })
+
+    column_config = {
+        "id": None,
+        "Nom": st.column_config.TextColumn(disabled=True),
+        "Statut": st.column_config.TextColumn(disabled=True),
+        "Appréciation": st.column_config.TextColumn(width="large")
+    }
+    for t in eval_types:
+        column_config[t.name] = st.column_config.NumberColumn(
+            help=t.description,
+            min_value=t.rating_bounds[0],
+            max_value=t.rating_bounds[1],
+            step=1
+        )
+
+    # Confirmation of the previous save, shown after the grid has been reset
+    saved = st.session_state.pop("evaluation_grid_saved", None)
+    if saved:
+        st.success(f"{saved} note(s) enregistrée(s)")
+
+    with st.form("evaluation_grid"):
+        note_date = st.date_input("Date", value=datetime.now(), key="grid_note_date")
+        edited = st.data_editor(
+            grid,
+            column_config=column_config,
+            hide_index=True,
+            use_container_width=True,
+            num_rows="fixed",
+            key="evaluation_grid_editor"
+        )
+
+        if st.form_submit_button("Enregistrer la grille"):
+            notes = []
+            for row in edited.to_dict("records"):
+                for t in eval_types:
+                    rating = row.get(t.name)
+                    if pd.notna(rating):
+                        notes.append((row["id"], t.id, int(rating), row.get("Appréciation")))
+            if not notes:
+                st.warning("Aucune note saisie")
+                return
+            try:
+                count = User.bulk_add_notes(evaluator.id, note_date, notes)
+            except ValueError as e:
+                st.error(str(e))
+            except Exception as e:
+                st.error(f"Erreur lors de l'enregistrement: {str(e)}")
+            else:
+                # Empty the grid, so that submitting again does not duplicate the notes
+                st.session_state.pop("evaluation_grid_editor", None)
+                st.session_state.evaluation_grid_saved = count
+                st.rerun()
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_progression_summary(user_id, window_days, start_date, end_date):
+    return analytics.progression_summary(user_id, start_date, end_date, window_days)
+
+def display_progression_analytics(user_id, window_days, start_date, end_date):
+    summary = get_progression_summary(user_id, window_days, start_date, end_date)
+
+    st.markdown(f"#### Moyenne mobile sur {window_days} jours par type d'évaluation")
+    rolling = summary["rolling"]
+    if rolling.empty:
+        st.info("Aucune note sur cette période")
+    else:
+        fig = go.Figure()
+        for eval_type in rolling.columns:
+            series = rolling[eval_type].dropna()
+            fig.add_trace(go.Scatter(x=series.index, y=series.values, mode="lines+markers", name=eval_type))
+        fig.update_layout(height=350, margin=dict(l=10, r=10, t=30, b=10), yaxis_title="Note moyenne")
+        st.plotly_chart(fig, use_container_width=True)
+
+    st.markdown("#### Comparaison avec la médiane de la promotion")
+    cohort = summary["cohort"].dropna(subset=["user"])
+    if cohort.empty:
+        st.info("Pas assez de données pour comparer")
+    else:
+        fig = go.Figure()
+        for eval_type, rows in cohort.groupby("evaluation_type"):
+            fig.add_trace(go.Scatter(x=rows["period"], y=rows["user"], mode="lines+markers",
+                                     name=f"{eval_type} (cadet)"))
+            fig.add_trace(go.Scatter(x=rows["period"], y=rows["cohort_median"], mode="lines",
+                                     line=dict(dash="dash"), name=f"{eval_type} (médiane)"))
+        fig.update_layout(height=350, margin=dict(l=10, r=10, t=30, b=10), yaxis_title="Note moyenne")
+        st.plotly_chart(fig, use_container_width=True)
+
+    st.markdown("#### Taux de présence mensuel")
+    attendance = summary["attendance"]
+    if attendance.empty:
+        st.info("Aucune activité sur cette période")
+    else:
+        fig = go.Figure()
+        fig.add_trace(go.Bar(x=attendance.index, y=attendance["user"] * 100, name="Cadet"))
+        fig.add_trace(go.Scatter(x=attendance.index, y=attendance["cohort_median"] * 100,
+                                 mode="lines+markers", name="Médiane de la promotion"))
+        fig.update_layout(height=350, margin=dict(l=10, r=10, t=30, b=10), yaxis_title="Présence (%)")
+        st.plotly_chart(fig, use_container_width=True)
+
+def badge_requirement(badge):
+    if badge.rule_type == 'attendance_count':
+        return f"{badge.threshold} activités requises"
+    return f"{badge.threshold} points requis"
+
 def main():
     check_authentication()
+    show_unread_messages(st.session_state.user)
     user = st.session_state.user
 
     st.title("🏆 Tableau de Progression")
 
     # Tabs for different sections
-    tab1, tab2, tab3 = st.tabs(["Progression & Badges", "Notes & Appréciations", "Configuration Évaluations"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Progression & Badges", "Notes & Appréciations", "Configuration Évaluations", "Classement", "Analyses"])
 
     with tab1:
-        # Get user points and level
-        progress = user.get_points()
+        # Get user points, level and badges
+        progress = user.get_progress()
         points = progress["points"]
         level = progress["level"]
+        badges = progress["badges"]
 
         # Display main stats in columns
         col1, col2, col3 = st.columns(3)
@@ -64,7 +276,6 @@ def main():
         with col2:
             st.metric("Points Total", points)
         with col3:
-            badges = user.get_badges()
             st.metric("Badges Gagnés", len(badges))
 
         # Show level progress chart
@@ -80,6 +291,7 @@ def main():
                     <h3>{badge.icon_name}</h3>
                     <p><strong>{badge.name}</strong></p>
                     <p><small>{badge.description}</small></p>
+                    <p><small>Obtenu le {badge.awarded_at.strftime('%d/%m/%Y') if badge.awarded_at else '-'}</small></p>
                 </div>
                 """, unsafe_allow_html=True)
 
@@ -97,19 +309,26 @@ def main():
                     <div style='text-align: center; padding: 10px; margin: 5px; background-color: #f0f2f6; border-radius: 10px; opacity: 0.6;'>
                         <h3>❓</h3>
                         <p><strong>{badge.name}</strong></p>
-                        <p><small>{badge.points_required} points requis</small></p>
+                        <p><small>{badge_requirement(badge)}</small></p>
                     </div>
                     """, unsafe_allow_html=True)
         else:
             st.info("Félicitations ! Vous avez débloqué tous les badges disponibles !")
 
     with tab2:
+        with st.expander("🔍 Rechercher dans les appréciations"):
+            display_note_search(user)
+
         if user.status in ['administration', 'animateur']:
+            cadets = User.get_all_by_status(['cadet', 'AMC'])
+
+            with st.expander("Évaluation groupée"):
+                display_evaluation_grid(cadets, user)
+
             # Interface pour ajouter/modifier des notes
             st.subheader("Ajouter une note")
 
             # Sélection du cadet/AMC
-            cadets = User.get_all_by_status(['cadet', 'AMC'])
             selected_cadet = st.selectbox(
                 "Sélectionner un cadet/AMC",
                 cadets,
@@ -140,58 +359,14 @@ def main():
                         except Exception as e:
                             st.error(f"Erreur lors de l'enregistrement: {str(e)}")
 
-            # Affichage des notes existantes
-            st.subheader("Notes existantes")
-            date_filter = st.date_input(
-                "Filtrer par date",
-                value=(datetime.now() - timedelta(days=30), datetime.now())
-            )
-
-            if len(date_filter) == 2:
-                start_date, end_date = date_filter
-                notes = selected_cadet.get_notes(start_date, end_date)
-
-                for note in notes:
-                    with st.expander(f"{note['date'].strftime('%d/%m/%Y')} - {note['type']}"):
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.write(f"**Note:** {'⭐' * note['rating']}")
-                            st.write(f"**Type:** {note['type']}")
-                        with col2:
-                            st.write(f"**Évaluateur:** {note['evaluator_name']}")
-                            st.write(f"**Date:** {note['date'].strftime('%d/%m/%Y')}")
-                        st.write("**Appréciation:**")
-                        st.write(note['appreciation'])
-
-                        if user.id == note['evaluator_id']:
-                            if st.button("Supprimer", key=f"delete_note_{note['id']}"):
-                                if selected_cadet.delete_note(note['id']):
-                                    st.success("Note supprimée!")
-                                    st.rerun()
+                # Affichage des notes existantes
+                st.subheader("Notes existantes")
+                display_notes(selected_cadet, "staff", deletable_by=user.id)
 
         elif user.status in ['cadet', 'AMC']:
             # Interface pour voir ses propres notes
             st.subheader("Mes notes")
-            date_filter = st.date_input(
-                "Filtrer par date",
-                value=(datetime.now() - timedelta(days=30), datetime.now())
-            )
-
-            if len(date_filter) == 2:
-                start_date, end_date = date_filter
-                notes = user.get_notes(start_date, end_date)
-
-                for note in notes:
-                    with st.expander(f"{note['date'].strftime('%d/%m/%Y')} - {note['type']}"):
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.write(f"**Note:** {'⭐' * note['rating']}")
-                            st.write(f"**Type:** {note['type']}")
-                        with col2:
-                            st.write(f"**Évaluateur:** {note['evaluator_name']}")
-                            st.write(f"**Date:** {note['date'].strftime('%d/%m/%Y')}")
-                        st.write("**Appréciation:**")
-                        st.write(note['appreciation'])
+            display_notes(user, "self")
 
         elif user.status == 'parent':
             # Interface pour voir les notes de ses enfants
@@ -204,27 +379,7 @@ def main():
                     children,
                     format_func=lambda x: x.name
                 )
-
-                date_filter = st.date_input(
-                    "Filtrer par date",
-                    value=(datetime.now() - timedelta(days=30), datetime.now())
-                )
-
-                if len(date_filter) == 2:
-                    start_date, end_date = date_filter
-                    notes = selected_child.get_notes(start_date, end_date)
-
-                    for note in notes:
-                        with st.expander(f"{note['date'].strftime('%d/%m/%Y')} - {note['type']}"):
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.write(f"**Note:** {'⭐' * note['rating']}")
-                                st.write(f"**Type:** {note['type']}")
-                            with col2:
-                                st.write(f"**Évaluateur:** {note['evaluator_name']}")
-                                st.write(f"**Date:** {note['date'].strftime('%d/%m/%Y')}")
-                            st.write("**Appréciation:**")
-                            st.write(note['appreciation'])
+                display_notes(selected_child, "child")
             else:
                 st.warning("Aucun enfant associé à votre compte")
 
@@ -233,13 +388,13 @@ def main():
         with st.expander("Administration - Ajouter des badges de test"):
             if st.button("Créer des badges de test"):
                 test_badges = [
-                    ("Première Présence", "Participez à votre première activité", "🌟", 10),
-                    ("Expert", "Atteignez 100 points", "🏅", 100),
-                    ("Super Participant", "Participez à 10 activités", "🌈", 200),
-                    ("Maître", "Atteignez le niveau 5", "👑", 500),
+                    ("Première Présence", "Participez à votre première activité", "🌟", 0, 'attendance_count', 1),
+                    ("Expert", "Atteignez 100 points", "🏅", 100, 'points', 100),
+                    ("Super Participant", "Participez à 10 activités", "🌈", 0, 'attendance_count', 10),
+                    ("Maître", "Atteignez le niveau 5", "👑", 500, 'points', 500),
                 ]
-                for name, desc, icon, points in test_badges:
-                    Badge.create(name, desc, icon, points)
+                for name, desc, icon, points, rule_type, threshold in test_badges:
+                    Badge.create(name, desc, icon, points, rule_type, threshold)
                 st.success("Badges de test créés !")
                 st.rerun()
 
@@ -292,6 +447,143 @@ def main():
                         st.rerun()
                     except Exception as e:
                         st.error(f"Erreur: {str(e)}")
+
+            # Gestion des règles d'attribution des badges
+            st.divider()
+            st.subheader("Règles des Badges")
+            rule_labels = {'points': "Points", 'attendance_count': "Nombre d'activités"}
+
+            for badge in all_badges:
+                with st.expander(f"{badge.icon_name} {badge.name}"):
+                    with st.form(f"edit_badge_{badge.id}"):
+                        new_name = st.text_input("Nom", badge.name)
+                        new_desc = st.text_area("Description", badge.description or "")
+                        new_icon = st.text_input("Icône", badge.icon_name or "")
+                        new_rule = st.selectbox(
+                            "Règle",
+                            list(rule_labels),
+                            index=list(rule_labels).index(badge.rule_type),
+                            format_func=lambda x: rule_labels[x]
+                        )
+                        new_threshold = st.number_input("Seuil", 0, 100000, badge.threshold or 0)
+                        revoke = st.checkbox("Retirer le badge aux utilisateurs qui ne remplissent plus la règle")
+
+                        if st.form_submit_button("Mettre à jour"):
+                            try:
+                                if badge.update(new_name, new_desc, new_icon, new_rule, new_threshold, revoke):
+                                    st.success("Badge mis à jour et réévalué!")
+                                    st.rerun()
+                                else:
+                                    st.error("Erreur lors de la mise à jour du badge")
+                            except Exception as e:
+                                st.error(f"Erreur: {str(e)}")
+
+            with st.form("new_badge"):
+                st.write("Ajouter un badge")
+                name = st.text_input("Nom")
+                description = st.text_area("Description")
+                icon = st.text_input("Icône", "🎖️")
+                rule_type = st.selectbox("Règle", list(rule_labels), format_func=lambda x: rule_labels[x])
+                threshold = st.number_input("Seuil", 0, 100000, 10)
+
+                if st.form_submit_button("Créer le badge"):
+                    try:
+                        Badge.create(name, description, icon,
+                                     threshold if rule_type == 'points' else 0,
+                                     rule_type, threshold)
+                        st.success("Badge créé!")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Erreur: {str(e)}")
+
+            if st.button("Réévaluer tous les badges"):
+                awarded = Badge.reevaluate()
+                st.success(f"{awarded} badge(s) attribué(s)")
+        else:
+            st.warning("Vous n'avez pas les permissions nécessaires pour accéder à cette section.")
+
+    with tab4:
+        if user.status in ['administration', 'animateur', 'cadet', 'AMC']:
+            st.subheader("🏅 Classement des cadets et AMC")
+
+            col1, col2 = st.columns(2)
+            with col1:
+                period = st.selectbox(
+                    "Période",
+                    ["Général", "Ce mois-ci", "Cette année", "Personnalisée"]
+                )
+            with col2:
+                top_n = st.number_input("Nombre de participants affichés", 5, 100, 20)
+
+            today = datetime.now().date()
+            start_date, end_date = None, None
+            if period == "Ce mois-ci":
+                start_date, end_date = today.replace(day=1), today
+            elif period == "Cette année":
+                start_date, end_date = today.replace(month=1, day=1), today
+            elif period == "Personnalisée":
+                date_range = st.date_input(
+                    "Mois couverts",
+                    value=(today - timedelta(days=90), today),
+                    key="leaderboard_range"
+                )
+                if len(date_range) == 2:
+                    start_date, end_date = date_range
+
+            if user.status in ['cadet', 'AMC']:
+                my_rank = Leaderboard.get_rank(user.id, start_date, end_date)
+                if my_rank and my_rank["points"] > 0:
+                    st.metric("Mon rang", f"{my_rank['rank']} / {my_rank['total']}",
+                              help=f"{my_rank['points']} points sur la période")
+                else:
+                    st.info("Vous n'avez pas encore de points sur cette période")
+
+            ranking = Leaderboard.get_top(int(top_n), start_date, end_date)
+            if ranking:
+                st.dataframe(
+                    [
+                        {
+                            "Rang": entry["rank"],
+                            "Nom": entry["name"],
+                            "Statut": entry["status"],
+                            "Points": entry["points"]
+                        }
+                        for entry in ranking
+                    ],
+                    hide_index=True,
+                    use_container_width=True
+                )
+            else:
+                st.info("Aucun point enregistré sur cette période")
+        else:
+            st.warning("Vous n'avez pas les permissions nécessaires pour accéder à cette section.")
+
+    with tab5:
+        if user.status in ['administration', 'animateur']:
+            st.subheader("📈 Analyses de progression")
+            cadets = User.get_all_by_status(['cadet', 'AMC'])
+            if cadets:
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    selected_cadet = st.selectbox(
+                        "Sélectionner un cadet/AMC",
+                        cadets,
+                        format_func=lambda x: f"{x.name} ({x.status})",
+                        key="analytics_cadet"
+                    )
+                with col2:
+                    window_days = st.selectbox("Fenêtre de moyenne mobile (jours)", [7, 30, 90], index=1)
+                with col3:
+                    date_range = st.date_input(
+                        "Période",
+                        value=(datetime.now() - timedelta(days=365), datetime.now()),
+                        key="analytics_range"
+                    )
+
+                if len(date_range) == 2:
+                    display_progression_analytics(selected_cadet.id, window_days, *date_range)
+            else:
+                st.info("Aucun cadet enregistré")
         else:
             st.warning("Vous n'avez pas les permissions nécessaires pour accéder à cette section.")
 
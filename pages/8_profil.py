@@ -1,6 +1,8 @@
 import streamlit as st
 from models import User
 import hashlib
+from kiosk import personal_code
+from utils import qr_code_bytes, show_unread_messages
 
 def check_authentication():
     if 'user' not in st.session_state or st.session_state.user is None:
@@ -9,6 +11,7 @@ def check_authentication():
 
 def main():
     check_authentication()
+    show_unread_messages(st.session_state.user)
     user = st.session_state.user
 
     st.title("Mon Profil")
@@ -23,6 +26,32 @@ def main():
     if user.rank:
         st.write(f"**Grade:** {user.rank}")
 
+    # Badge QR personnel, scanné par les encadrants ou la borne de présence
+    if user.status in ['cadet', 'AMC']:
+        st.header("Mon badge de présence")
+        st.image(qr_code_bytes(personal_code(user.id)), width=250)
+        st.caption("Présentez ce badge à votre arrivée ; il est valable toute la saison")
+
+    # Notifications des nouveaux messages
+    st.header("Notifications")
+    settings = user.get_notification_settings()
+    with st.form("notification_settings"):
+        phone = st.text_input("Téléphone (format international, ex. +33612345678)",
+                              settings["phone"] or "")
+        notify_email = st.checkbox("Recevoir les nouveaux messages par email",
+                                   value=settings["notify_email"])
+        notify_sms = st.checkbox("Recevoir les nouveaux messages par SMS",
+                                 value=settings["notify_sms"])
+
+        if st.form_submit_button("Enregistrer"):
+            try:
+                if user.update_notification_settings(phone, notify_email, notify_sms):
+                    st.success("Préférences de notification enregistrées")
+                else:
+                    st.error("Une erreur est survenue lors de l'enregistrement")
+            except ValueError as e:
+                st.error(str(e))
+
     # Section pour changer le mot de passe
     st.header("Changer le mot de passe")
     with st.form("change_password"):
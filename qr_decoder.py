@@ -0,0 +1,103 @@
+import threading
+import time
+import cv2
+import numpy as np
+from typing import Dict, List, Optional
+from pyzbar.pyzbar import ZBarSymbol, decode as zbar_decode
+
+# Longest side of the first decoding attempt; larger sizes are only tried on failure
+SCALES = (640, 1024, None)
+
+# cv2.QRCodeDetector is not safe to share between threads (Streamlit sessions and
+# webrtc frame callbacks): one detector per thread
+_local = threading.local()
+
+
+class DecodeResult:
+    def __init__(self, payloads: List[str], strategy: Optional[str], timings: Dict[str, float]):
+        self.payloads = payloads
+        self.strategy = strategy  # which attempt succeeded, e.g. "pyzbar@640"
+        self.timings = timings  # stage -> milliseconds
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.timings.values())
+
+
+class _Timer:
+    def __init__(self, timings: Dict[str, float]):
+        self.timings = timings
+
+    def __call__(self, stage: str, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def image_from_bytes(data: bytes) -> np.ndarray:
+    """Decode an encoded image (JPEG/PNG from st.camera_input) straight to grayscale."""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def downscale(image: np.ndarray, max_side: Optional[int]) -> np.ndarray:
+    """Shrink the image so that its longest side is at most max_side (None: unchanged)."""
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if max_side is None or longest <= max_side:
+        return image
+    ratio = max_side / longest
+    return cv2.resize(image, (int(width * ratio), int(height * ratio)), interpolation=cv2.INTER_AREA)
+
+
+def decode_pyzbar(image: np.ndarray) -> List[str]:
+    return [symbol.data.decode('utf-8') for symbol in zbar_decode(image, symbols=[ZBarSymbol.QRCODE])]
+
+
+def decode_opencv(image: np.ndarray) -> List[str]:
+    detector = getattr(_local, 'detector', None)
+    if detector is None:
+        detector = _local.detector = cv2.QRCodeDetector()
+    found, payloads, _, _ = detector.detectAndDecodeMulti(image)
+    if not found:
+        return []
+    return [payload for payload in payloads if payload]
+
+
+def decode_qr(image: np.ndarray, scales=SCALES, fallback: bool = True) -> DecodeResult:
+    """Decode the QR codes of a camera frame.
+
+    The frame is converted to grayscale, then decoded with pyzbar at increasing
+    sizes (small images decode much faster and are enough for a code held in front
+    of the camera). If every size fails, cv2.QRCodeDetector gets a last try on the
+    full-resolution frame. Each stage is timed in the result.
+    """
+    timings: Dict[str, float] = {}
+    timed = _Timer(timings)
+
+    gray = timed("grayscale", to_gray, image)
+    full_side = max(gray.shape[:2])
+    tried = set()
+    for max_side in scales:
+        side = full_side if max_side is None else min(max_side, full_side)
+        if side in tried:
+            continue
+        tried.add(side)
+        scaled = timed("downscale", downscale, gray, side)
+        payloads = timed("pyzbar", decode_pyzbar, scaled)
+        if payloads:
+            return DecodeResult(payloads, f"pyzbar@{side}", timings)
+
+    if fallback:
+        payloads = timed("opencv", decode_opencv, gray)
+        if payloads:
+            return DecodeResult(payloads, "opencv", timings)
+
+    return DecodeResult([], None, timings)
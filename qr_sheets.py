@@ -0,0 +1,139 @@
+"""Printable sheets of QR codes: activity entry/exit codes and personal badges.
+
+The QR images are rendered in a pool of worker processes (qrcode is pure Python
+and CPU bound), then laid out on a grid of A4 pages in a single PDF.
+"""
+import functools
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, List, Optional
+from reportlab.lib import colors
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from kiosk import ROSTER_STATUSES, personal_code
+from models import Activity, User
+import qr_tokens
+from utils import PAGE_HEIGHT, PAGE_MARGIN, PAGE_WIDTH, _fit_text, qr_code_bytes
+
+WORKERS = int(os.getenv('QR_SHEET_WORKERS', '0')) or None  # None: one per CPU
+QR_BOX_SIZE = 8
+
+# sheet -> (label, columns, rows)
+SHEETS = {
+    'activities': ("QR codes des activités à venir", 2, 3),
+    'badges': ("Badges QR des cadets", 3, 4)
+}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class SheetCard:
+    def __init__(self, title: str, subtitle: str, payload: str):
+        self.title = title
+        self.subtitle = subtitle
+        self.payload = payload
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Process-wide pool. Workers are spawned rather than forked: the Streamlit
+    server runs many threads, which a fork would copy in an unknown state."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def render_codes(payloads: List[str]) -> List[bytes]:
+    """PNG images of the payloads, rendered in parallel, in the same order."""
+    # Workers only need utils: the sheet data is gathered in this process
+    render = functools.partial(qr_code_bytes, box_size=QR_BOX_SIZE)
+    if len(payloads) < 8:  # not worth the round trips to the workers
+        return [render(payload) for payload in payloads]
+    chunksize = max(1, len(payloads) // (4 * (WORKERS or os.cpu_count() or 1)))
+    return list(_get_pool().map(render, payloads, chunksize=chunksize))
+
+
+def activity_cards(activities: List[Activity]) -> List[SheetCard]:
+    cards = []
+    for activity in activities:
+        when = (f"{activity.date.strftime('%d/%m/%Y')} "
+                f"{activity.start_time.strftime('%H:%M')}-{activity.end_time.strftime('%H:%M')}")
+        for kind, label in [("entry", "Entrée"), ("exit", "Sortie")]:
+            cards.append(SheetCard(f"{label} — {activity.name}", when,
+                                   qr_tokens.activity_token(activity, kind)))
+    return cards
+
+
+def badge_cards(users: List[User]) -> List[SheetCard]:
+    return [
+        SheetCard(" ".join(part for part in [user.rank, user.first_name, user.name] if part),
+                  user.status, personal_code(user.id))
+        for user in users
+    ]
+
+
+def build_sheet(cards: List[SheetCard], title: str, columns: int, rows: int,
+                progress: Callable[[int, str], None] = None) -> bytes:
+    """Multi-page PDF with one card (title, QR code, subtitle) per grid cell."""
+    progress = progress or (lambda percent, message: None)
+    progress(10, f"Génération de {len(cards)} QR codes")
+    images = render_codes([card.payload for card in cards])
+    progress(70, "Mise en page")
+
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=(PAGE_WIDTH, PAGE_HEIGHT))
+    generated_at = datetime.now().strftime('%d/%m/%Y %H:%M')
+    top = PAGE_HEIGHT - 70
+    cell_width = (PAGE_WIDTH - 2 * PAGE_MARGIN) / columns
+    cell_height = (top - PAGE_MARGIN) / rows
+    code_size = min(cell_width, cell_height - 36) - 12
+    per_page = columns * rows
+    pages = max(1, -(-len(cards) // per_page))
+
+    for page in range(pages):
+        p.setFont("Helvetica-Bold", 16)
+        p.drawString(PAGE_MARGIN, PAGE_HEIGHT - 45, title)
+        p.setFont("Helvetica", 9)
+        p.drawString(PAGE_MARGIN, PAGE_HEIGHT - 60, f"Généré le: {generated_at}")
+        p.drawRightString(PAGE_WIDTH - PAGE_MARGIN, PAGE_MARGIN / 2, f"Page {page + 1}/{pages}")
+
+        for index, (card, image) in enumerate(zip(cards[page * per_page:(page + 1) * per_page],
+                                                  images[page * per_page:(page + 1) * per_page])):
+            x = PAGE_MARGIN + (index % columns) * cell_width
+            y = top - (index // columns + 1) * cell_height
+            # Cutting guides
+            p.setStrokeColor(colors.lightgrey)
+            p.setDash(3, 3)
+            p.rect(x, y, cell_width, cell_height)
+            p.setDash()
+
+            p.setFont("Helvetica-Bold", 10)
+            p.drawCentredString(x + cell_width / 2, y + cell_height - 16,
+                                _fit_text(card.title, cell_width - 8, "Helvetica-Bold", 10))
+            p.drawImage(ImageReader(io.BytesIO(image)), x + (cell_width - code_size) / 2,
+                        y + (cell_height - code_size) / 2 - 2, code_size, code_size)
+            p.setFont("Helvetica", 8)
+            p.drawCentredString(x + cell_width / 2, y + 8,
+                                _fit_text(card.subtitle, cell_width - 8, "Helvetica", 8))
+        p.showPage()
+
+    p.save()
+    return buffer.getvalue()
+
+
+def generate_sheet(sheet: str, progress: Callable[[int, str], None] = None) -> bytes:
+    label, columns, rows = SHEETS[sheet]
+    if sheet == 'activities':
+        cards = activity_cards(Activity.get_upcoming())
+    else:
+        cards = badge_cards(User.get_all_by_status(list(ROSTER_STATUSES)))
+    if not cards:
+        raise ValueError("Aucun QR code à imprimer")
+    return build_sheet(cards, label, columns, rows, progress)
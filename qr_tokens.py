@@ -0,0 +1,190 @@
+"""Signed QR tokens.
+
+A token carries what the scanner needs to accept a scan without asking the
+database: the kind of code (entry, exit, personal badge), the id it applies to, a
+validity window and an optional nonce, followed by a truncated HMAC-SHA256.
+
+    Q1 + base32(kind | key id | subject id | valid from | valid until | [nonce] | mac)
+
+The token only uses upper-case letters and digits, so the QR code is encoded in
+alphanumeric mode and stays small (version 3 for an activity code).
+
+Secrets are identified by a one-byte key id embedded in the token. New tokens are
+signed with the current key; tokens signed with any other known key remain valid
+until that key is retired, which allows rotating the secret without reprinting
+every code at once. Keys come from QR_SIGNING_KEYS ("id:secret,id:secret") with
+QR_SIGNING_KEY_ID selecting the current one; without it, a key file is generated
+on first use and rotate_key() / retire_key() manage it.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+KEYS_PATH = os.getenv('QR_KEYS_PATH', 'qr_keys.json')
+# Activity codes are accepted this long before the start and after the end
+ACTIVITY_MARGIN = timedelta(minutes=int(os.getenv('QR_ACTIVITY_MARGIN_MINUTES', '60')))
+# Tolerated clock difference between the device that signed and the one that scans
+CLOCK_SKEW = 120  # seconds
+
+PREFIX = "Q1"
+KINDS = {'entry': 1, 'exit': 2, 'badge': 3}
+_KIND_NAMES = {code: name for name, code in KINDS.items()}
+_HEADER = struct.Struct(">BBIII")  # kind, key id, subject id, valid from, valid until
+NONCE_SIZE = 8
+MAC_SIZE = 16
+
+_keys_lock = threading.Lock()
+_keys: Optional[Tuple[int, Dict[int, bytes]]] = None
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+class Token:
+    def __init__(self, kind: str, subject_id: int, valid_from: datetime, valid_until: datetime,
+                 nonce: Optional[bytes] = None, key_id: int = None):
+        self.kind = kind
+        self.subject_id = subject_id  # activity id for entry/exit, user id for a badge
+        self.valid_from = valid_from
+        self.valid_until = valid_until
+        self.nonce = nonce
+        self.key_id = key_id
+
+
+def _load_keys() -> Tuple[int, Dict[int, bytes]]:
+    """(current key id, {key id: secret}), from the environment or the key file."""
+    global _keys
+    with _keys_lock:
+        if _keys is None:
+            configured = os.getenv('QR_SIGNING_KEYS')
+            if configured:
+                keys = {}
+                for item in configured.split(','):
+                    key_id, _, secret = item.strip().partition(':')
+                    keys[int(key_id)] = secret.encode()
+                current = int(os.getenv('QR_SIGNING_KEY_ID', max(keys)))
+            elif os.path.exists(KEYS_PATH):
+                with open(KEYS_PATH) as f:
+                    stored = json.load(f)
+                keys = {int(key_id): bytes.fromhex(secret) for key_id, secret in stored['keys'].items()}
+                current = stored['current']
+            else:
+                current, keys = 1, {1: secrets.token_bytes(32)}
+                _save_keys(current, keys)
+            if current not in keys or not 0 <= current <= 255:
+                raise RuntimeError(f"QR signing key {current} is not configured")
+            _keys = current, keys
+        return _keys
+
+
+def _save_keys(current: int, keys: Dict[int, bytes]):
+    if os.getenv('QR_SIGNING_KEYS'):
+        raise RuntimeError("QR signing keys come from QR_SIGNING_KEYS: rotate them in the environment")
+    tmp_path = f"{KEYS_PATH}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'current': current,
+                   'keys': {str(key_id): secret.hex() for key_id, secret in keys.items()}}, f)
+    os.replace(tmp_path, KEYS_PATH)
+
+
+def rotate_key() -> int:
+    """Generate a new signing key and make it current. Codes signed with the previous
+    keys stay valid until those are retired. Returns the new key id."""
+    global _keys
+    current, keys = _load_keys()
+    with _keys_lock:
+        key_id = next(i % 256 for i in range(current + 1, current + 257) if i % 256 not in keys)
+        keys = {**keys, key_id: secrets.token_bytes(32)}
+        _save_keys(key_id, keys)
+        _keys = key_id, keys
+    return key_id
+
+
+def retire_key(key_id: int):
+    """Stop accepting the codes signed with a previous key."""
+    global _keys
+    current, keys = _load_keys()
+    if key_id == current:
+        raise ValueError("La clé courante ne peut pas être retirée")
+    with _keys_lock:
+        keys = {i: secret for i, secret in keys.items() if i != key_id}
+        _save_keys(current, keys)
+        _keys = current, keys
+
+
+def key_ids() -> Tuple[int, list]:
+    """(current key id, all accepted key ids)."""
+    current, keys = _load_keys()
+    return current, sorted(keys)
+
+
+def _mac(secret: bytes, body: bytes) -> bytes:
+    return hmac.new(secret, body, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def sign(kind: str, subject_id: int, valid_from: datetime, valid_until: datetime,
+         nonce: bool = False) -> str:
+    """Signed token for a QR code. With nonce, two tokens for the same code differ."""
+    current, keys = _load_keys()
+    body = _HEADER.pack(KINDS[kind], current, subject_id,
+                        int(valid_from.timestamp()), int(valid_until.timestamp()))
+    if nonce:
+        body += secrets.token_bytes(NONCE_SIZE)
+    data = body + _mac(keys[current], body)
+    return PREFIX + base64.b32encode(data).decode().rstrip("=")
+
+
+def verify(payload: str, now: float = None) -> Token:
+    """Check the signature and validity window of a scanned payload, without any
+    database access. Raises InvalidToken with the reason of the rejection."""
+    if not payload.startswith(PREFIX):
+        raise InvalidToken("QR code non reconnu")
+    encoded = payload[len(PREFIX):]
+    try:
+        data = base64.b32decode(encoded + "=" * (-len(encoded) % 8))
+    except ValueError:
+        raise InvalidToken("QR code illisible")
+    if len(data) not in (_HEADER.size + MAC_SIZE, _HEADER.size + NONCE_SIZE + MAC_SIZE):
+        raise InvalidToken("QR code illisible")
+
+    body, mac = data[:-MAC_SIZE], data[-MAC_SIZE:]
+    kind, key_id, subject_id, valid_from, valid_until = _HEADER.unpack_from(body)
+    _, keys = _load_keys()
+    if key_id not in keys or not hmac.compare_digest(mac, _mac(keys[key_id], body)):
+        raise InvalidToken("Signature du QR code invalide")
+    if kind not in _KIND_NAMES:
+        raise InvalidToken("QR code non reconnu")
+
+    now = time.time() if now is None else now
+    if now < valid_from - CLOCK_SKEW:
+        raise InvalidToken("QR code pas encore valide")
+    if now > valid_until + CLOCK_SKEW:
+        raise InvalidToken("QR code expiré")
+
+    return Token(_KIND_NAMES[kind], subject_id, datetime.fromtimestamp(valid_from),
+                 datetime.fromtimestamp(valid_until), body[_HEADER.size:] or None, key_id)
+
+
+def activity_window(activity) -> Tuple[datetime, datetime]:
+    """(valid from, valid until) of the codes of an activity: from ACTIVITY_MARGIN
+    before its start until ACTIVITY_MARGIN after its end."""
+    start = datetime.combine(activity.date, activity.start_time) - ACTIVITY_MARGIN
+    end = datetime.combine(activity.date, activity.end_time) + ACTIVITY_MARGIN
+    if activity.end_time <= activity.start_time:  # activity ending after midnight
+        end += timedelta(days=1)
+    return start, end
+
+
+def activity_token(activity, kind: str, nonce: bool = False) -> str:
+    """Entry or exit token of an activity, valid over activity_window()."""
+    return sign(kind, activity.id, *activity_window(activity), nonce)
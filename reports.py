@@ -0,0 +1,428 @@
+import database
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Iterator, List, Optional
+
+REPORT_TYPES = ["Présences", "Activités", "Stocks", "Communications"]
+
+
+class Report:
+    def __init__(self, report_type: str, start_date: date, end_date: date,
+                 columns: List[str], rows: List[tuple], metrics: List[tuple],
+                 chart: List[tuple], chart_label: str):
+        self.report_type = report_type
+        self.start_date = start_date
+        self.end_date = end_date
+        self.columns = columns
+        self.rows = rows
+        self.metrics = metrics  # list of (label, value)
+        self.chart = chart  # list of (date, value)
+        self.chart_label = chart_label
+
+    def chart_data(self) -> dict:
+        return {
+            'dates': [day for day, _ in self.chart],
+            self.chart_label: [value for _, value in self.chart]
+        }
+
+
+# Tables each report type reads, used to invalidate cached results on writes
+REPORT_SOURCES = {
+    "Présences": {"attendance", "activities"},
+    "Activités": {"attendance", "activities"},
+    "Stocks": {"inventory"},
+    "Communications": {"messages"}
+}
+
+
+class ReportCache:
+    """Process-wide LRU cache of report results, shared by every Streamlit session."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple) -> Optional[Report]:
+        with self._lock:
+            report = self._entries.get(key)
+            if report is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return report
+
+    def put(self, key: tuple, report: Report):
+        with self._lock:
+            self._entries[key] = report
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, source: str, day: Optional[date] = None):
+        """Drop the cached reports reading `source` whose range contains `day`
+        (all of them when day is None)."""
+        if isinstance(day, datetime):
+            day = day.date()
+        with self._lock:
+            stale = [
+                key for key in self._entries
+                if source in REPORT_SOURCES.get(key[0], ())
+                and (day is None or key[1] <= day <= key[2])
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(100.0 * self.hits / lookups, 1) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+cache = ReportCache(int(os.getenv('REPORT_CACHE_SIZE', '64')))
+
+
+def generate_report(report_type: str, start_date: date, end_date: date,
+                    use_cache: bool = True) -> Report:
+    """Run the aggregate query set of a report type over [start_date, end_date],
+    or return the cached result of an identical request."""
+    builder = _BUILDERS.get(report_type)
+    if builder is None:
+        raise ValueError(f"Type de rapport inconnu: {report_type}")
+
+    key = (report_type, start_date, end_date)
+    if use_cache and (report := cache.get(key)) is not None:
+        return report
+
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        report = builder(cur, start_date, end_date)
+    finally:
+        cur.close()
+        conn.close()
+
+    if use_cache:
+        cache.put(key, report)
+    return report
+
+
+def count_detail_rows(report_type: str, start_date: date, end_date: date) -> int:
+    """Number of rows iter_detail_rows will stream, for progress reporting."""
+    query = DETAIL_QUERIES.get(report_type)
+    if query is None:
+        return 0
+
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT COUNT(*) FROM ({query}) AS detail", (start_date, end_date))
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.close()
+
+
+def iter_detail_rows(report_type: str, start_date: date, end_date: date,
+                     itersize: int = 2000) -> Iterator[tuple]:
+    """Stream the detail rows of a report through a server-side cursor.
+
+    Rows are fetched from PostgreSQL in batches of itersize, so memory stays
+    bounded whatever the size of the period.
+    """
+    query = DETAIL_QUERIES.get(report_type)
+    if query is None:
+        return
+
+    conn = database.get_connection()
+    cur = conn.cursor(name=f"report_{uuid.uuid4().hex}")
+    cur.itersize = itersize
+    try:
+        cur.execute(query, (start_date, end_date))
+        yield from cur
+    finally:
+        cur.close()
+        conn.close()
+
+
+def daily_attendance(start_date: date, end_date: date) -> List[tuple]:
+    """Attendance count per day over [start_date, end_date], read from the daily rollup."""
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT day, SUM(attendance_count)
+            FROM attendance_daily
+            WHERE day BETWEEN %s AND %s
+            GROUP BY day
+            ORDER BY day
+        """, (start_date, end_date))
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def rebuild_attendance_rollup() -> bool:
+    """Recompute the attendance_daily table from the raw attendance table."""
+    conn = database.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT rebuild_attendance_daily()")
+        conn.commit()
+        cache.invalidate('attendance')
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"Error rebuilding attendance rollup: {str(e)}")
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _attendance_report(cur, start_date: date, end_date: date) -> Report:
+    cur.execute("""
+        SELECT COALESCE(SUM(attendance_count), 0), COUNT(DISTINCT activity_id),
+               COALESCE(SUM(attendance_count) FILTER (WHERE user_status IN ('cadet', 'AMC')), 0)
+        FROM attendance_daily
+        WHERE day BETWEEN %s AND %s
+    """, (start_date, end_date))
+    total, activities, cadets = cur.fetchone()
+
+    cur.execute("""
+        SELECT ac.date, ac.name,
+               COALESCE(SUM(ad.attendance_count) FILTER (WHERE ad.user_status = 'cadet'), 0),
+               COALESCE(SUM(ad.attendance_count) FILTER (WHERE ad.user_status = 'AMC'), 0),
+               COALESCE(SUM(ad.attendance_count) FILTER (WHERE ad.user_status NOT IN ('cadet', 'AMC')), 0),
+               COALESCE(SUM(ad.attendance_count), 0), ac.max_participants,
+               ROUND(100.0 * COALESCE(SUM(ad.attendance_count), 0) / NULLIF(ac.max_participants, 0), 1)
+        FROM activities ac
+        LEFT JOIN attendance_daily ad ON ad.day = ac.date AND ad.activity_id = ac.id
+        WHERE ac.date BETWEEN %s AND %s
+        GROUP BY ac.id
+        ORDER BY ac.date, ac.name
+    """, (start_date, end_date))
+    rows = cur.fetchall()
+
+    cur.execute("""
+        SELECT day, SUM(attendance_count)
+        FROM attendance_daily
+        WHERE day BETWEEN %s AND %s
+        GROUP BY day
+        ORDER BY day
+    """, (start_date, end_date))
+    chart = cur.fetchall()
+
+    return Report(
+        "Présences", start_date, end_date,
+        ["Date", "Activité", "Cadets", "AMC", "Encadrement", "Total", "Places", "Remplissage (%)"],
+        rows,
+        [("Total présences", total), ("Présences cadets/AMC", cadets),
+         ("Activités concernées", activities)],
+        chart, "présences"
+    )
+
+
+def _activities_report(cur, start_date: date, end_date: date) -> Report:
+    cur.execute("""
+        SELECT COUNT(*),
+               COALESCE(ROUND(AVG(participants), 1), 0),
+               COALESCE(ROUND(100.0 * SUM(participants) / NULLIF(SUM(max_participants), 0), 1), 0)
+        FROM (
+            SELECT ac.max_participants, COALESCE(SUM(ad.attendance_count), 0) AS participants
+            FROM activities ac
+            LEFT JOIN attendance_daily ad ON ad.day = ac.date AND ad.activity_id = ac.id
+            WHERE ac.date BETWEEN %s AND %s
+            GROUP BY ac.id
+        ) per_activity
+    """, (start_date, end_date))
+    count, avg_participants, fill_rate = cur.fetchone()
+
+    cur.execute("""
+        SELECT ac.date, ac.name, COALESCE(ac.location, ''),
+               TO_CHAR(ac.start_time, 'HH24:MI') || ' - ' || TO_CHAR(ac.end_time, 'HH24:MI'),
+               COALESCE(SUM(ad.attendance_count), 0), ac.max_participants
+        FROM activities ac
+        LEFT JOIN attendance_daily ad ON ad.day = ac.date AND ad.activity_id = ac.id
+        WHERE ac.date BETWEEN %s AND %s
+        GROUP BY ac.id
+        ORDER BY ac.date, ac.start_time
+    """, (start_date, end_date))
+    rows = cur.fetchall()
+
+    cur.execute("""
+        SELECT date, COUNT(*)
+        FROM activities
+        WHERE date BETWEEN %s AND %s
+        GROUP BY date
+        ORDER BY date
+    """, (start_date, end_date))
+    chart = cur.fetchall()
+
+    return Report(
+        "Activités", start_date, end_date,
+        ["Date", "Activité", "Lieu", "Horaires", "Participants", "Places"],
+        rows,
+        [("Activités réalisées", count), ("Participants moyens", avg_participants),
+         ("Taux de remplissage (%)", fill_rate)],
+        chart, "activités"
+    )
+
+
+def _inventory_report(cur, start_date: date, end_date: date) -> Report:
+    cur.execute("""
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE quantity <= min_quantity)
+        FROM inventory
+    """)
+    items, low_stock = cur.fetchone()
+
+    cur.execute("""
+        SELECT COUNT(*), COALESCE(SUM(quantity), 0)
+        FROM equipment_assignments
+        WHERE assigned_at >= %s AND assigned_at < %s::DATE + 1
+    """, (start_date, end_date))
+    assignments, assigned_quantity = cur.fetchone()
+
+    cur.execute("""
+        WITH assigned AS (
+            SELECT inventory_id, SUM(quantity) AS quantity
+            FROM equipment_assignments
+            WHERE assigned_at >= %s AND assigned_at < %s::DATE + 1
+            GROUP BY inventory_id
+        )
+        SELECT i.category, COUNT(*), SUM(i.quantity),
+               COUNT(*) FILTER (WHERE i.quantity <= i.min_quantity),
+               COALESCE(SUM(a.quantity), 0)
+        FROM inventory i
+        LEFT JOIN assigned a ON a.inventory_id = i.id
+        GROUP BY i.category
+        ORDER BY i.category
+    """, (start_date, end_date))
+    rows = cur.fetchall()
+
+    cur.execute("""
+        SELECT assigned_at::DATE, SUM(quantity)
+        FROM equipment_assignments
+        WHERE assigned_at >= %s AND assigned_at < %s::DATE + 1
+        GROUP BY assigned_at::DATE
+        ORDER BY assigned_at::DATE
+    """, (start_date, end_date))
+    chart = cur.fetchall()
+
+    return Report(
+        "Stocks", start_date, end_date,
+        ["Catégorie", "Articles", "Quantité en stock", "Sous le seuil", "Quantité attribuée"],
+        rows,
+        [("Articles en stock", items), ("Articles sous le seuil", low_stock),
+         ("Attributions sur la période", f"{assignments} ({assigned_quantity} unités)")],
+        chart, "unités attribuées"
+    )
+
+
+def _communications_report(cur, start_date: date, end_date: date) -> Report:
+    cur.execute("""
+        SELECT COUNT(DISTINCT m.id) FILTER (WHERE m.status = 'approved'),
+               COUNT(DISTINCT m.id) FILTER (WHERE m.status = 'pending'),
+               COUNT(mr.recipient_id), COUNT(mr.recipient_id) FILTER (WHERE mr.is_read)
+        FROM messages m
+        LEFT JOIN message_recipients mr ON mr.message_id = m.id
+        WHERE m.created_at >= %s AND m.created_at < %s::DATE + 1
+    """, (start_date, end_date))
+    sent, pending, deliveries, read = cur.fetchone()
+    read_rate = round(100 * read / deliveries, 1) if deliveries else 0
+
+    cur.execute("""
+        SELECT m.created_at::DATE, COUNT(DISTINCT m.id), COUNT(mr.recipient_id),
+               COUNT(mr.recipient_id) FILTER (WHERE mr.is_read)
+        FROM messages m
+        LEFT JOIN message_recipients mr ON mr.message_id = m.id
+        WHERE m.created_at >= %s AND m.created_at < %s::DATE + 1
+          AND m.status = 'approved'
+        GROUP BY m.created_at::DATE
+        ORDER BY m.created_at::DATE
+    """, (start_date, end_date))
+    rows = cur.fetchall()
+
+    return Report(
+        "Communications", start_date, end_date,
+        ["Date", "Messages", "Destinataires", "Lus"],
+        rows,
+        [("Messages envoyés", sent), ("En attente de validation", pending),
+         ("Destinataires", deliveries), ("Taux de lecture (%)", read_rate)],
+        [(day, messages) for day, messages, _, _ in rows], "messages"
+    )
+
+
+_BUILDERS = {
+    "Présences": _attendance_report,
+    "Activités": _activities_report,
+    "Stocks": _inventory_report,
+    "Communications": _communications_report
+}
+
+
+DETAIL_COLUMNS = {
+    "Présences": ["Date", "Activité", "Nom", "Statut", "Enregistré le"],
+    "Activités": ["Date", "Activité", "Lieu", "Début", "Fin", "Places"],
+    "Stocks": ["Attribué le", "Article", "Catégorie", "Quantité", "Attribué à", "Rendu le"],
+    "Communications": ["Envoyé le", "Expéditeur", "Sujet", "Statut", "Destinataires", "Lus"]
+}
+
+DETAIL_QUERIES = {
+    "Présences": """
+        SELECT ac.date, ac.name, u.name, u.status, COALESCE(at.check_in_time, at.created_at)
+        FROM attendance at
+        JOIN activities ac ON ac.id = at.activity_id
+        JOIN users u ON u.id = at.user_id
+        WHERE ac.date BETWEEN %s AND %s
+        ORDER BY ac.date, ac.name, u.name
+    """,
+    "Activités": """
+        SELECT date, name, COALESCE(location, ''), start_time, end_time, max_participants
+        FROM activities
+        WHERE date BETWEEN %s AND %s
+        ORDER BY date, start_time
+    """,
+    "Stocks": """
+        SELECT ea.assigned_at, i.item_name, i.category, ea.quantity, u.name, ea.returned_at
+        FROM equipment_assignments ea
+        JOIN inventory i ON i.id = ea.inventory_id
+        JOIN users u ON u.id = ea.user_id
+        WHERE ea.assigned_at >= %s AND ea.assigned_at < %s::DATE + 1
+        ORDER BY ea.assigned_at
+    """,
+    "Communications": """
+        SELECT m.created_at, COALESCE(u.name, ''), m.subject, m.status,
+               COALESCE(cardinality(m.recipient_ids), COUNT(mr.recipient_id)),
+               COUNT(mr.recipient_id) FILTER (WHERE mr.is_read)
+        FROM messages m
+        LEFT JOIN users u ON u.id = m.sender_id
+        LEFT JOIN message_recipients mr ON mr.message_id = m.id
+        WHERE m.created_at >= %s AND m.created_at < %s::DATE + 1
+        GROUP BY m.id, u.name
+        ORDER BY m.created_at
+    """
+}
@@ -1,37 +1,120 @@
+import functools
+import os
 import qrcode
+import qrcode.image.svg
 import io
 import base64
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from datetime import datetime
 
-def generate_qr_code(data):
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+# QR images kept in memory, shared by every session
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '256'))
+QR_FORMATS = {"PNG": "image/png", "SVG": "image/svg+xml"}
+
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_code_bytes(data, box_size=10, format="PNG"):
+    """Encoded QR code image (PNG, or SVG for printing), memoized by
+    (payload, size, format)."""
+    if format not in QR_FORMATS:
+        raise ValueError(f"Unsupported QR code format: {format}")
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=5)
     qr.add_data(data)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64 for display
+    if format == "SVG":
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+
     buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode()
+    img.save(buffered)
+    return buffered.getvalue()
+
+def generate_qr_code(data, box_size=10, format="PNG"):
+    """QR code as a base64 string, for embedding in HTML."""
+    return base64.b64encode(qr_code_bytes(data, box_size, format)).decode()
+
+def show_unread_messages(user):
+    """Unread messages indicator in the sidebar, shown on every page."""
+    import streamlit as st
+    from models import Message
+
+    try:
+        unread = Message.unread_count(user.id)
+    except Exception as e:
+        print(f"Error counting unread messages: {str(e)}")
+        return
+    if unread:
+        st.sidebar.info(f"📬 {unread} message(s) non lu(s)")
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+PAGE_MARGIN = 40
+ROW_HEIGHT = 16
 
-def generate_pdf_report(data, report_type):
+def _fit_text(text, width, font_name, font_size):
+    """Truncate text so that it fits in the given width."""
+    text = "" if text is None else str(text)
+    text_width = stringWidth(text, font_name, font_size)
+    if text_width <= width:
+        return text
+    # Estimate the cut from the average glyph width, then adjust
+    cut = int(len(text) * width / text_width)
+    while cut > 0 and stringWidth(text[:cut] + "…", font_name, font_size) > width:
+        cut -= 1
+    return text[:cut] + "…"
+
+def generate_pdf_report(data, report_type, columns=None, subtitle=None):
+    """Render rows as a paginated table.
+
+    data: any iterable of rows (tuples, or plain strings for a single column);
+    it is consumed lazily so it can come straight from a server-side cursor.
+    The page header and column titles are repeated on every page.
+    """
+    columns = columns or [""]
     buffer = io.BytesIO()
-    p = canvas.Canvas(buffer)
-    
-    # Header
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(50, 800, f"Rapport - {report_type}")
-    p.setFont("Helvetica", 12)
-    p.drawString(50, 780, f"Généré le: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
-    
-    # Content
-    y_position = 750
-    for item in data:
-        p.drawString(50, y_position, str(item))
-        y_position -= 20
-        
+    p = canvas.Canvas(buffer, pagesize=A4)
+    generated_at = datetime.now().strftime('%d/%m/%Y %H:%M')
+    column_width = (PAGE_WIDTH - 2 * PAGE_MARGIN) / len(columns)
+    page_number = 0
+
+    def start_page():
+        nonlocal page_number
+        page_number += 1
+        p.setFont("Helvetica-Bold", 16)
+        p.drawString(PAGE_MARGIN, PAGE_HEIGHT - 50, f"Rapport - {report_type}")
+        p.setFont("Helvetica", 10)
+        p.drawString(PAGE_MARGIN, PAGE_HEIGHT - 66, f"Généré le: {generated_at}")
+        if subtitle:
+            p.drawString(PAGE_MARGIN, PAGE_HEIGHT - 80, subtitle)
+        p.drawRightString(PAGE_WIDTH - PAGE_MARGIN, PAGE_MARGIN / 2, f"Page {page_number}")
+
+        y = PAGE_HEIGHT - 105
+        p.setFillColor(colors.lightgrey)
+        p.rect(PAGE_MARGIN, y - 4, PAGE_WIDTH - 2 * PAGE_MARGIN, ROW_HEIGHT, stroke=0, fill=1)
+        p.setFillColor(colors.black)
+        p.setFont("Helvetica-Bold", 9)
+        for index, title in enumerate(columns):
+            p.drawString(PAGE_MARGIN + index * column_width + 2, y,
+                         _fit_text(title, column_width - 4, "Helvetica-Bold", 9))
+        p.setFont("Helvetica", 9)
+        return y - ROW_HEIGHT
+
+    y_position = start_page()
+    for row in data:
+        if y_position < PAGE_MARGIN:
+            p.showPage()
+            y_position = start_page()
+        if isinstance(row, str) or not isinstance(row, (tuple, list)):
+            row = (row,)
+        for index, value in enumerate(row[:len(columns)]):
+            if isinstance(value, datetime):
+                value = format_datetime(value)
+            p.drawString(PAGE_MARGIN + index * column_width + 2, y_position,
+                         _fit_text(value, column_width - 4, "Helvetica", 9))
+        y_position -= ROW_HEIGHT
+
     p.save()
     buffer.seek(0)
     return buffer